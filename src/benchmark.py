@@ -0,0 +1,146 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import subprocess
+
+from synthkern import writeCorpus
+
+#Benchmark of mtc_to_seqs.py on a synthetic corpus (see synthkern.py).
+#
+#Runs mtc_to_seqs.py -essen on the corpus with -timings, and reports:
+#- songs per second (wall time of the run, including startup). Only songs that produced a
+#  sequence are counted; if songs failed, the benchmark fails (exit status 1).
+#- mean latency per song of the stages (parse, context, features, textfeatures, write)
+#- mean latency per song of IMA (ima and imafuture in the feature graph) and of the
+#  slowest features
+#The result can be saved as baseline, and is compared to the baseline: a value that is
+#more than tolerance worse than the baseline is a regression (exit status 1).
+
+SRCDIR = os.path.dirname(os.path.abspath(__file__))
+
+#Generate the corpus in root, unless it has been generated with the same parameters
+def prepareCorpus(root, params):
+    paramspath = os.path.join(root, 'params.json')
+    if os.path.exists(paramspath):
+        with open(paramspath) as f:
+            if json.load(f) == params:
+                return
+        shutil.rmtree(root)
+    print(f'Generating {params["songs"]} melodies in {root}')
+    writeCorpus(root, params['songs'], seed=params['seed'], minmeasures=params['minmeasures'], maxmeasures=params['maxmeasures'])
+    with open(paramspath, 'w') as f:
+        json.dump(params, f)
+
+def meanMs(hist):
+    return 1000.0 * hist['wall'] / hist['n'] if hist['n'] else 0.0
+
+#returns the result of one run
+#extra: extra arguments for mtc_to_seqs.py
+def run(corpusdir, workdir, jobs=1, extra=()):
+    outputpath = os.path.join(workdir, 'out')
+    if os.path.exists(outputpath):
+        shutil.rmtree(outputpath)
+    os.makedirs(outputpath)
+    timingspath = os.path.join(workdir, 'timings.json')
+    cmd = [
+        sys.executable, os.path.join(SRCDIR, 'mtc_to_seqs.py'),
+        '-essen',
+        '-essenroot', corpusdir,
+        '-outputpath', outputpath,
+        '-jobs', str(jobs),
+        '-timings', timingspath,
+    ] + list(extra)
+    start = time.perf_counter()
+    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL)
+    seconds = time.perf_counter() - start
+    with open(timingspath) as f:
+        timings = json.load(f)['collections']['essen']
+    features = timings['features']
+    #songs that produced a sequence; the timings include the songs that failed
+    nsongs = len([name for name in os.listdir(outputpath) if name.endswith('.json')])
+    ncorpus = len([name for name in os.listdir(os.path.join(corpusdir, 'krn')) if name.endswith('.krn')])
+    return {
+        'songs': nsongs,
+        'failed': ncorpus - nsongs,
+        'seconds': seconds,
+        'songs_per_second': nsongs / seconds,
+        'stages_ms': {name: meanMs(hist) for name, hist in timings['stages'].items()},
+        'ima_ms': sum(1000.0 * features[name]['wall'] for name in ('ima', 'imafuture') if name in features) / max(nsongs, 1),
+        'slowest_features_ms': {name: meanMs(hist) for name, hist in list(features.items())[:10]},
+    }
+
+#returns list of (name, baseline value, value) that are more than tolerance worse
+def regressions(result, baseline, tolerance):
+    res = []
+    if result['songs_per_second'] < baseline['songs_per_second'] * (1.0 - tolerance):
+        res.append(('songs_per_second', baseline['songs_per_second'], result['songs_per_second']))
+    for name, ms in result['stages_ms'].items():
+        base = baseline['stages_ms'].get(name)
+        if base is not None and ms > base * (1.0 + tolerance):
+            res.append((f'stage {name} (ms)', base, ms))
+    if result['ima_ms'] > baseline['ima_ms'] * (1.0 + tolerance):
+        res.append(('ima (ms)', baseline['ima_ms'], result['ima_ms']))
+    return res
+
+def printResult(result):
+    print(f"{result['songs']} songs in {result['seconds']:.1f} s: {result['songs_per_second']:.1f} songs/s")
+    for name, ms in result['stages_ms'].items():
+        print(f'  {name:<14} {ms:8.2f} ms/song')
+    print(f"  {'ima':<14} {result['ima_ms']:8.2f} ms/song")
+    print('  slowest features:')
+    for name, ms in result['slowest_features_ms'].items():
+        print(f'    {name:<28} {ms:8.2f} ms/song')
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='Benchmark mtc_to_seqs.py on a synthetic corpus. Arguments after -- are passed to mtc_to_seqs.py (e.g. -- -fastparse -imaengine python).')
+    argparser.add_argument('-workdir', type=str, help='Directory for the corpus and the output.', default='benchmark')
+    argparser.add_argument('-songs', type=int, help='Number of melodies in the corpus.', default=500)
+    argparser.add_argument('-seed', type=int, help='Seed of the corpus generator.', default=1)
+    argparser.add_argument('-minmeasures', type=int, help='Minimal number of measures of a melody.', default=4)
+    argparser.add_argument('-maxmeasures', type=int, help='Maximal number of measures of a melody.', default=32)
+    argparser.add_argument('-jobs', type=int, help='Number of worker processes of mtc_to_seqs.py.', default=1)
+    argparser.add_argument('-repeat', type=int, help='Number of runs. The fastest run is reported.', default=3)
+    argparser.add_argument('-baseline', type=str, help='Baseline (json) to compare to.', default='benchmark_baseline.json')
+    argparser.add_argument('-savebaseline', help='Save the result as baseline.', default=False, action='store_true')
+    argparser.add_argument('-tolerance', type=float, help='Fraction a value may be worse than the baseline.', default=0.1)
+    argparser.add_argument('extra', nargs=argparse.REMAINDER)
+    cmdargs = argparser.parse_args()
+
+    extra = cmdargs.extra[1:] if cmdargs.extra[:1] == ['--'] else cmdargs.extra
+    params = {
+        'songs': cmdargs.songs,
+        'seed': cmdargs.seed,
+        'minmeasures': cmdargs.minmeasures,
+        'maxmeasures': cmdargs.maxmeasures,
+    }
+    corpusdir = os.path.join(cmdargs.workdir, 'corpus')
+    prepareCorpus(corpusdir, params)
+
+    results = [run(corpusdir, cmdargs.workdir, jobs=cmdargs.jobs, extra=extra) for _ in range(cmdargs.repeat)]
+    result = max(results, key=lambda r: r['songs_per_second'])
+    #a run in which songs failed (e.g. onsets2ima is not installed) does not measure the
+    #extraction
+    failed = max(r['failed'] for r in results)
+    if failed:
+        sys.exit(f"{failed} songs failed. Without onsets2ima, use: -- -imaengine python")
+    result['params'] = dict(params, jobs=cmdargs.jobs, extra=extra)
+    printResult(result)
+
+    if cmdargs.savebaseline:
+        with open(cmdargs.baseline, 'w') as f:
+            json.dump(result, f, indent=1)
+        print(f'Baseline saved to {cmdargs.baseline}')
+    elif os.path.exists(cmdargs.baseline):
+        with open(cmdargs.baseline) as f:
+            baseline = json.load(f)
+        if baseline['params'] != result['params']:
+            print(f'Warning: baseline was measured with other parameters: {baseline["params"]}')
+        worse = regressions(result, baseline, cmdargs.tolerance)
+        for name, base, value in worse:
+            print(f'REGRESSION {name}: {base:.2f} -> {value:.2f}')
+        if worse:
+            sys.exit(1)
+        print(f'No regressions against {cmdargs.baseline}')
@@ -0,0 +1,198 @@
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import itertools
+import socketserver
+import urllib.request
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+import mtc_to_seqs
+from textindex import TextIndex
+
+#Long-running extraction server for interactive use (e.g. AnnotateMeldoy.ipynb).
+#music21, the metadata records of the collections and the indexes of the text feature
+#files stay loaded, such that extracting one song only costs the parsing and the features.
+#
+#Requests (HTTP on localhost, or on a Unix socket with -socket), json in and out:
+#  POST /song  {"collection": "mtcfsinst", "id": "NLB072355_01"}
+#  POST /kern  {"kern": "**kern\n*M4/4\n...", "metadata": {"id": ...}}
+#  GET  /status
+#Both POST requests take an optional "features" (list of features). The response is the
+#sequence as written by mtc_to_seqs.py (status 200), or {"error": ..., "stage": ...,
+#"message": ...} (status 404 or 422).
+#
+#Requests are handled one at a time: music21 is not thread safe.
+
+#A short melody to warm up music21
+WARMUP_KERN = '**kern\n*M4/4\n*k[]\n*C:\n=1\n4c\n4d\n4e\n4f\n=2\n2g\n2r\n==\n*-\n'
+
+class ExtractError(Exception):
+    def __init__(self, status, error, stage='', message=''):
+        self.status = status
+        self.response = {'error': error, 'stage': stage, 'message': message}
+    def __str__(self):
+        return repr(self.response)
+
+#The loaded state of the server
+class Extractor():
+    def __init__(self):
+        self.records = {} #collection -> records
+        self.tmpdir = tempfile.mkdtemp(prefix='extractdaemon')
+        self.counter = itertools.count()
+
+    #load the records and the text feature index of a collection
+    def load(self, collection):
+        if collection not in self.records:
+            if collection not in mtc_to_seqs.COLLECTIONS:
+                raise ExtractError(404, 'UnknownCollection', message=collection)
+            recordsfunc, _, textFeatureFile = mtc_to_seqs.collectionSource(collection)
+            print(f'Loading {collection}')
+            self.records[collection] = recordsfunc()
+            if textFeatureFile and os.path.exists(textFeatureFile):
+                mtc_to_seqs.getTextFeatures.indexes.setdefault(textFeatureFile, TextIndex(textFeatureFile))._connection()
+        return self.records[collection]
+
+    def warmup(self):
+        self.kern(WARMUP_KERN, {'id': 'warmup'})
+
+    def _result(self, seq, failure):
+        if seq is None:
+            raise ExtractError(422, failure.get('error', 'ExtractionFailed'), failure.get('stage', ''), failure.get('message', ''))
+        return seq
+
+    def _selection(self, features):
+        if features is None:
+            return None
+        try:
+            return mtc_to_seqs.FeatureSelection(features)
+        except ValueError as e:
+            raise ExtractError(422, 'UnknownFeatures', message=str(e))
+
+    #sequence of a song of a collection
+    def song(self, collection, songid, features=None):
+        records = self.load(collection)
+        if songid not in records:
+            raise ExtractError(404, 'UnknownSong', message=songid)
+        _, krndir, textFeatureFile = mtc_to_seqs.collectionSource(collection)
+        failure = {}
+        seq = mtc_to_seqs.extractSong(
+            songid,
+            records[songid],
+            krndir=krndir,
+            textFeatureFile=textFeatureFile,
+            failure=failure,
+            features=self._selection(features),
+        )
+        return self._result(seq, failure)
+
+    #sequence of a melody in **kern
+    def kern(self, kern, metadata=None, features=None):
+        metadata = dict(metadata or {})
+        metadata.setdefault('id', 'kern')
+        self._selection(features)
+        #a new file for every request: music21 might cache by path
+        path = os.path.join(self.tmpdir, f'{next(self.counter)}.krn')
+        with open(path, 'w', encoding='utf8') as f:
+            f.write(kern)
+        try:
+            failure = {}
+            seq = mtc_to_seqs.extractFeatures(path, metadata=metadata, features=features, failure=failure)
+            return self._result(seq, failure)
+        finally:
+            os.remove(path)
+
+class RequestHandler(BaseHTTPRequestHandler):
+    def _send(self, status, response):
+        data = json.dumps(response).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/status':
+            extractor = self.server.extractor
+            self._send(200, {'collections': {name: len(records) for name, records in extractor.records.items()}})
+        else:
+            self._send(404, {'error': 'UnknownPath', 'stage': '', 'message': self.path})
+
+    def do_POST(self):
+        extractor = self.server.extractor
+        try:
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            except ValueError as e:
+                raise ExtractError(400, 'InvalidRequest', message=str(e))
+            if self.path == '/song':
+                seq = extractor.song(request['collection'], request['id'], features=request.get('features'))
+            elif self.path == '/kern':
+                seq = extractor.kern(request['kern'], metadata=request.get('metadata'), features=request.get('features'))
+            else:
+                raise ExtractError(404, 'UnknownPath', message=self.path)
+        except ExtractError as e:
+            self._send(e.status, e.response)
+        except KeyError as e:
+            self._send(400, {'error': 'InvalidRequest', 'stage': '', 'message': f'missing {e}'})
+        except Exception as e:
+            self._send(500, {'error': type(e).__name__, 'stage': '', 'message': str(e)})
+        else:
+            self._send(200, seq)
+
+    #client_address of a Unix socket is not a (host, port) tuple
+    def address_string(self):
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+class UnixHTTPServer(socketserver.UnixStreamServer):
+    def __init__(self, path, handler):
+        if os.path.exists(path):
+            os.remove(path)
+        super().__init__(path, handler)
+
+#Client: returns the sequence of a song of a collection, or of a melody in **kern (kern).
+#Raises urllib.error.HTTPError if the song could not be extracted.
+def requestSequence(collection=None, songid=None, kern=None, metadata=None, features=None, url='http://127.0.0.1:8765'):
+    if kern is not None:
+        path, request = '/kern', {'kern': kern, 'metadata': metadata or {}}
+    else:
+        path, request = '/song', {'collection': collection, 'id': songid}
+    if features is not None:
+        request['features'] = features
+    req = urllib.request.Request(url + path, data=json.dumps(request).encode('utf8'), headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(req) as response:
+        return json.load(response)
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='Serve feature extraction of single songs. Other arguments are options of mtc_to_seqs.py (e.g. -mtcroot, -features, -fastparse).')
+    argparser.add_argument('-host', type=str, help='Host to listen on.', default='127.0.0.1')
+    argparser.add_argument('-port', type=int, help='Port to listen on.', default=8765)
+    argparser.add_argument('-socket', type=str, help='Listen on this Unix socket instead of a port.', default='')
+    argparser.add_argument('-preload', type=str, help='Comma separated list of collections to load at startup (e.g. mtcfsinst,mtcann).', default='')
+    cmdargs, extractargs = argparser.parse_known_args()
+    mtc_to_seqs.configure(extractargs)
+
+    extractor = Extractor()
+    extractor.warmup()
+    for collection in filter(None, cmdargs.preload.split(',')):
+        extractor.load(collection)
+
+    if cmdargs.socket:
+        server = UnixHTTPServer(cmdargs.socket, RequestHandler)
+        print(f'Listening on {cmdargs.socket}')
+    else:
+        server = HTTPServer((cmdargs.host, cmdargs.port), RequestHandler)
+        print(f'Listening on http://{cmdargs.host}:{cmdargs.port}')
+    server.extractor = extractor
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        shutil.rmtree(extractor.tmpdir, ignore_errors=True)
+        if cmdargs.socket and os.path.exists(cmdargs.socket):
+            os.remove(cmdargs.socket)
@@ -0,0 +1,101 @@
+import os
+import time
+import sqlite3
+import hashlib
+
+#Ledger of the songs of which the extraction failed, in an SQLite database.
+#For every failure it records the hash of the .krn file, the version of the extractor,
+#the stage (parse, context, features, ...), the exception class, message and traceback.
+#
+#A song with a failure is quarantined: it is skipped until the .krn file or the version
+#changes, such that broken files are not parsed again in every run. Songs are identified
+#by the absolute path of their .krn file, such that the ledger can be shared by the
+#collections.
+class FailureLedger():
+    def __init__(self, path):
+        self.path = str(path)
+        self.conn = sqlite3.connect(self.path, timeout=120)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS failures (
+                krnpath TEXT PRIMARY KEY,
+                songid TEXT NOT NULL,
+                krnsize INTEGER NOT NULL,
+                krnmtime INTEGER NOT NULL,
+                krnhash TEXT NOT NULL,
+                version TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                error TEXT NOT NULL,
+                message TEXT NOT NULL,
+                traceback TEXT NOT NULL,
+                time REAL NOT NULL
+            )
+        ''')
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    #(size, mtime, hash) of the file. (-1, -1, '') if it does not exist.
+    #old: (size, mtime, hash) from the ledger, such that unchanged files are not read
+    def _fileKey(self, krnpath, old=None):
+        try:
+            st = os.stat(krnpath)
+        except FileNotFoundError:
+            return -1, -1, ''
+        if old is not None and old[0] == st.st_size and old[1] == st.st_mtime_ns:
+            return old
+        with open(krnpath, 'rb') as f:
+            return st.st_size, st.st_mtime_ns, hashlib.sha1(f.read()).hexdigest()
+
+    #True if the extraction of the song failed before, with the same .krn file and version
+    def quarantined(self, krnpath, version):
+        krnpath = os.path.abspath(krnpath)
+        row = self.conn.execute(
+            'SELECT krnsize, krnmtime, krnhash, version FROM failures WHERE krnpath=?',
+            (krnpath,)
+        ).fetchone()
+        if row is None or row[3] != version:
+            return False
+        key = self._fileKey(krnpath, old=row[:3])
+        #a missing file is not quarantined: it is cheap to find out again
+        return key[2] != '' and key[2] == row[2]
+
+    #Record a failure
+    def record(self, songid, krnpath, version, stage, error, message='', traceback=''):
+        krnpath = os.path.abspath(krnpath)
+        krnsize, krnmtime, krnhash = self._fileKey(krnpath)
+        self.conn.execute(
+            'INSERT OR REPLACE INTO failures VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (krnpath, str(songid), krnsize, krnmtime, krnhash, version, stage, error, message, traceback, time.time())
+        )
+        self.conn.commit()
+
+    #Remove the failure of a song (e.g. after a successful retry)
+    def clear(self, krnpath):
+        #commit also if nothing was deleted: the DELETE started a transaction that locks the
+        #database for the other processes
+        self.conn.execute('DELETE FROM failures WHERE krnpath=?', (os.path.abspath(krnpath),))
+        self.conn.commit()
+
+    #returns list of (stage, error, number of failures, example song ids), most frequent first
+    def summary(self, examples=5):
+        res = []
+        for stage, error, n in self.conn.execute(
+            'SELECT stage, error, COUNT(*) AS n FROM failures GROUP BY stage, error ORDER BY n DESC'
+        ).fetchall():
+            ids = [row[0] for row in self.conn.execute(
+                'SELECT songid FROM failures WHERE stage=? AND error=? ORDER BY songid LIMIT ?',
+                (stage, error, examples)
+            )]
+            res.append((stage, error, n, ids))
+        return res
+
+    #returns list of dicts with the failures, optionally of one error class
+    def failures(self, error=None):
+        fields = ('krnpath', 'songid', 'version', 'stage', 'error', 'message', 'traceback', 'time')
+        query = f'SELECT {", ".join(fields)} FROM failures'
+        params = ()
+        if error is not None:
+            query += ' WHERE error=?'
+            params = (error,)
+        return [dict(zip(fields, row)) for row in self.conn.execute(query + ' ORDER BY songid', params)]
@@ -0,0 +1,83 @@
+#Registry of features and the values they are computed from.
+#
+#Every node has a name, a function and the names of its inputs. compute() calls the
+#function with the values of the inputs. A node without function is a marker: it has no
+#value, but tells the caller which (expensive) preparation is needed (see needs()).
+#Values that are given to compute() (e.g. the song context) are not in the graph.
+#
+#Inputs must be added before the nodes that use them. Nodes are computed in the order
+#in which they were added, such that work that runs in the background (e.g. IMA) can be
+#started early and collected late. start() computes such nodes before the others, e.g.
+#for the next songs while the features of the current song are computed.
+class FeatureGraph():
+    #givens: names of the values that are given to compute()
+    def __init__(self, givens=()):
+        self.givens = set(givens)
+        self.nodes = {} #name -> (func, inputs, isfeature)
+
+    #add a node. isfeature: the value is a feature in the output
+    def add(self, name, func, inputs=(), isfeature=True):
+        for inp in inputs:
+            if inp not in self.nodes and inp not in self.givens:
+                raise ValueError(f'{name}: unknown input {inp}')
+        self.nodes[name] = (func, tuple(inputs), isfeature)
+
+    #value that is needed by features, but that is not a feature itself
+    def value(self, name, func, inputs=()):
+        self.add(name, func, inputs, isfeature=False)
+
+    def marker(self, name):
+        self.add(name, None, isfeature=False)
+
+    @property
+    def features(self):
+        return [name for name, (_, _, isfeature) in self.nodes.items() if isfeature]
+
+    #returns set of the names of the nodes needed for the features, including the features
+    def closure(self, features):
+        needed = set()
+        todo = list(features)
+        while todo:
+            name = todo.pop()
+            if name in needed or name in self.givens:
+                continue
+            if name not in self.nodes:
+                raise KeyError(name)
+            needed.add(name)
+            todo.extend(self.nodes[name][1])
+        return needed
+
+    #True if node (e.g. a marker) is needed for the features
+    def needs(self, features, node):
+        return node in self.closure(features)
+
+    #compute the nodes in needed that are not in values (yet), in the order in which they
+    #were added
+    def _computeNodes(self, needed, values, timer):
+        for name, (func, inputs, _) in self.nodes.items():
+            if name in needed and func is not None and name not in values:
+                if timer is None:
+                    values[name] = func(*[values.get(inp) for inp in inputs])
+                else:
+                    with timer(name):
+                        values[name] = func(*[values.get(inp) for inp in inputs])
+
+    #Compute the nodes in names (e.g. a value that starts work in the background) and their
+    #inputs, as far as they are needed for the features.
+    #returns the values, with the computed nodes added. Give these to compute() to compute
+    #the other nodes.
+    def start(self, features, values, names, timer=None):
+        needed = self.closure(features)
+        values = dict(values)
+        self._computeNodes(self.closure(name for name in names if name in needed), values, timer)
+        return values
+
+    #returns dict feature -> value, in the order in which the features were added
+    #values: dict with the given values (and the values computed by start())
+    #timer: function name -> context manager, that times the computation of every node
+    #(e.g. SongTimer.feature)
+    def compute(self, features, values, timer=None):
+        needed = self.closure(features)
+        values = dict(values)
+        self._computeNodes(needed, values, timer)
+        return {name: values[name] for name in self.nodes if name in features}
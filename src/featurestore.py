@@ -0,0 +1,247 @@
+import os
+import json
+import shutil
+
+import numpy as np
+
+from parquetwriter import SONG_TYPES, FEATURE_TYPES
+
+#Binary feature store: a directory with flat binary arrays, that are memory mapped by
+#the reader. Opening a store only reads meta.json; lookups of songs and features are
+#O(1) and return views on the mapped files without copying.
+#
+#Per feature in seq['features'] (all songs concatenated):
+#  <feature>.bin       values. int64, float64, uint8 (bool) or int32 codes (string).
+#                      String features are dictionary encoded, the vocabulary is in
+#                      meta.json. Code -1 is None.
+#  <feature>.mask.bin  uint8, 1 if the value is not None. Only for non-string features
+#                      with None values.
+#offsets.bin           int64, n_songs+1. The notes of song i are offsets[i]:offsets[i+1].
+#                      A song without a feature (e.g. without lyrics) has None values.
+#Per song-level field (one value per song), encoded as the features:
+#  song_<field>.bin, song_<field>.mask.bin
+#id -> index:
+#  ids.bin             the song ids (fixed width utf32), in order of the songs
+#  sortedids.bin       the song ids, sorted
+#  sortedix.bin        int64, index of the song of every sorted id
+#
+#The writer appends the values of every song to the files, such that memory use does
+#not depend on the size of the corpus. The store is written in a temporary directory,
+#which is renamed by close(). After an error the temporary directory is removed and an
+#existing store is not changed (discard()).
+
+#numpy dtype of the values per type
+DTYPES = {
+    'int64': np.int64,
+    'float64': np.float64,
+    'bool': np.uint8,
+    'string': np.int32,
+}
+
+#Values of one feature or field: a values file, an optional mask file, a vocabulary
+#for strings
+class _ColumnWriter():
+    def __init__(self, path, type):
+        self.path = path
+        self.type = type
+        self.dtype = DTYPES[type]
+        self.values = open(path + '.bin', 'wb')
+        self.masks = open(path + '.mask.bin', 'wb')
+        self.hasnone = False
+        self.vocabulary = {}
+
+    def write(self, values):
+        if self.type == 'string':
+            codes = [-1 if v is None else self.vocabulary.setdefault(v, len(self.vocabulary)) for v in values]
+            self.values.write(np.array(codes, dtype=self.dtype).tobytes())
+            return
+        mask = [v is not None for v in values]
+        if not all(mask):
+            self.hasnone = True
+            values = [v if m else 0 for v, m in zip(values, mask)]
+        self.values.write(np.array(values, dtype=self.dtype).tobytes())
+        self.masks.write(np.array(mask, dtype=np.uint8).tobytes())
+
+    #returns meta information
+    def close(self):
+        self.values.close()
+        self.masks.close()
+        if not self.hasnone:
+            os.remove(self.path + '.mask.bin')
+        meta = {'type': self.type, 'mask': self.hasnone}
+        if self.type == 'string':
+            meta['vocabulary'] = list(self.vocabulary)
+        return meta
+
+class FeatureStoreWriter():
+    def __init__(self, path):
+        self.path = str(path)
+        self.tmppath = self.path + '.tmp'
+        if os.path.exists(self.tmppath):
+            shutil.rmtree(self.tmppath)
+        os.makedirs(self.tmppath)
+        self.features = {name: _ColumnWriter(os.path.join(self.tmppath, name), t) for name, t in FEATURE_TYPES.items()}
+        self.fields = {name: _ColumnWriter(os.path.join(self.tmppath, 'song_'+name), t) for name, t in SONG_TYPES.items()}
+        self.offsets = [0]
+        self.ids = []
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def write(self, seq):
+        unknown = seq['features'].keys() - FEATURE_TYPES.keys()
+        if unknown:
+            raise ValueError(f"{seq['id']}: no store type for features: {', '.join(sorted(unknown))}")
+        #a song without features (e.g. only text features selected, and the song has no
+        #lyrics) has no notes in the store
+        length = max((len(values) for values in seq['features'].values()), default=0)
+        for name, column in self.features.items():
+            column.write(seq['features'].get(name, [None]*length))
+        for name, column in self.fields.items():
+            column.write([seq.get(name)])
+        self.offsets.append(self.offsets[-1] + length)
+        self.ids.append(seq['id'])
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        ids = np.array(self.ids, dtype=str)
+        order = np.argsort(ids, kind='stable')
+        ids.tofile(os.path.join(self.tmppath, 'ids.bin'))
+        ids[order].tofile(os.path.join(self.tmppath, 'sortedids.bin'))
+        order.astype(np.int64).tofile(os.path.join(self.tmppath, 'sortedix.bin'))
+        np.array(self.offsets, dtype=np.int64).tofile(os.path.join(self.tmppath, 'offsets.bin'))
+        meta = {
+            'n_songs': len(self.ids),
+            'n_notes': self.offsets[-1],
+            'iddtype': ids.dtype.str,
+            'features': {name: column.close() for name, column in self.features.items()},
+            'fields': {name: column.close() for name, column in self.fields.items()},
+        }
+        with open(os.path.join(self.tmppath, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        os.replace(self.tmppath, self.path)
+
+    #Remove the temporary directory, without changing the store at path (e.g. after an error)
+    def discard(self):
+        if self.closed:
+            return
+        self.closed = True
+        for column in list(self.features.values()) + list(self.fields.values()):
+            column.values.close()
+            column.masks.close()
+        shutil.rmtree(self.tmppath, ignore_errors=True)
+
+#Reader of a store written by FeatureStoreWriter
+#Files are mapped on first use.
+class FeatureStore():
+    def __init__(self, path):
+        self.path = str(path)
+        with open(os.path.join(self.path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.maps = {}
+        self.vocabularies = {}
+
+    def __len__(self):
+        return self.meta['n_songs']
+
+    def __contains__(self, songid):
+        return self.index(songid) is not None
+
+    def _map(self, name, dtype, shape=None):
+        if name not in self.maps:
+            path = os.path.join(self.path, name + '.bin')
+            #np.memmap cannot map an empty file
+            if os.path.getsize(path) == 0:
+                self.maps[name] = np.zeros(0, dtype=dtype)
+            else:
+                self.maps[name] = np.memmap(path, dtype=dtype, mode='r', shape=shape)
+        return self.maps[name]
+
+    @property
+    def ids(self):
+        return self._map('ids', self.meta['iddtype'])
+
+    @property
+    def features(self):
+        return list(self.meta['features'])
+
+    #returns index of the song, None if the song is not in the store
+    def index(self, songid):
+        sortedids = self._map('sortedids', self.meta['iddtype'])
+        i = np.searchsorted(sortedids, songid)
+        if i == len(sortedids) or sortedids[i] != songid:
+            return None
+        return int(self._map('sortedix', np.int64)[i])
+
+    def _index(self, songid):
+        ix = self.index(songid)
+        if ix is None:
+            raise KeyError(songid)
+        return ix
+
+    def _span(self, ix):
+        offsets = self._map('offsets', np.int64)
+        return offsets[ix], offsets[ix+1]
+
+    def vocabulary(self, feature):
+        if feature not in self.vocabularies:
+            self.vocabularies[feature] = np.array(self.meta['features'][feature]['vocabulary'] + [None], dtype=object)
+        return self.vocabularies[feature]
+
+    #returns view on the values of feature for the song: numbers, 0/1 for bool, codes
+    #for strings (see vocabulary())
+    def values(self, songid, feature):
+        start, end = self._span(self._index(songid))
+        return self._map(feature, DTYPES[self.meta['features'][feature]['type']])[start:end]
+
+    #returns view on the mask of feature for the song (1: not None), None if the feature
+    #has no None values in the store
+    def mask(self, songid, feature):
+        if not self.meta['features'][feature]['mask']:
+            return None
+        start, end = self._span(self._index(songid))
+        return self._map(feature + '.mask', np.uint8)[start:end]
+
+    #returns list of the values of feature for the song, as in seq['features']
+    def feature(self, songid, feature):
+        values = self.values(songid, feature)
+        t = self.meta['features'][feature]['type']
+        if t == 'string':
+            return self.vocabulary(feature)[values].tolist() #code -1 is None
+        res = values.astype(bool).tolist() if t == 'bool' else values.tolist()
+        mask = self.mask(songid, feature)
+        if mask is not None:
+            res = [v if m else None for v, m in zip(res, mask.tolist())]
+        return res
+
+    def _field(self, ix, name):
+        meta = self.meta['fields'][name]
+        value = self._map('song_'+name, DTYPES[meta['type']])[ix]
+        if meta['type'] == 'string':
+            return None if value < 0 else meta['vocabulary'][value]
+        if meta['mask'] and not self._map('song_'+name+'.mask', np.uint8)[ix]:
+            return None
+        return bool(value) if meta['type'] == 'bool' else value.item()
+
+    #returns the sequence as written by mtc_to_seqs.py
+    #features: list of features (default: all)
+    def sequence(self, songid, features=None):
+        ix = self._index(songid)
+        seq = {name: self._field(ix, name) for name in self.meta['fields']}
+        if seq.get('ann_bgcorpus') is None:
+            seq.pop('ann_bgcorpus', None)
+        if features is None:
+            features = self.features
+        seq['features'] = {feature: self.feature(songid, feature) for feature in features}
+        return seq
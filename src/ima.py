@@ -0,0 +1,98 @@
+import sys
+from collections import defaultdict
+
+import numpy as np
+
+#Inner Metric Analysis (Nestke & Noll 2001, Volk 2008)
+#
+#A local meter is a maximal sequence of equally spaced onsets s, s+d, ..., s+k*d with at
+#least minlength+1 onsets (k >= minlength). Maximal: it is not contained in another local meter,
+#i.e. it cannot be extended with the same period, and the onsets in between with a period
+#that is a divisor of d are not all present.
+#
+#Metric weight of an onset: sum of k**power over the local meters that contain the onset.
+#Spectral weight of a position: sum of k**power over the local meters of which the extension
+#over the whole piece (s + i*d for all integers i) contains the position.
+#
+#Meant to give the same results as the onsets2ima program. This has not been checked against
+#output of onsets2ima itself: use -imaengine compare of mtc_to_seqs.py on a collection.
+
+def primeFactors(n):
+    factors = []
+    p = 2
+    while p * p <= n:
+        if n % p == 0:
+            factors.append(p)
+            while n % p == 0:
+                n //= p
+        p += 1
+    if n > 1:
+        factors.append(n)
+    return factors
+
+#onsets: list of ints
+#returns list of local meters (s, d, k)
+def localMeters(onsets, minlength=2):
+    on = sorted(set(onsets))
+    #run[(o, d)]: number of steps of d from onset o for which all onsets are present
+    run = {}
+    for i in range(len(on) - 1, -1, -1):
+        o = on[i]
+        for o2 in on[i+1:]:
+            d = o2 - o
+            run[(o, d)] = run.get((o2, d), 0) + 1
+    meters = []
+    for (s, d), k in run.items():
+        if k < minlength:
+            continue
+        #start of the sequence?
+        if (s - d, d) in run:
+            continue
+        #contained in sequence with smaller period? Checking d/p for the primes p that divide d suffices.
+        if any(run.get((s, d // p), 0) >= k * p for p in primeFactors(d)):
+            continue
+        meters.append((s, d, k))
+    return meters
+
+#returns list with metric weight (float) for each onset
+def imaweight(onsets, minlength=2, power=2, meters=None):
+    if meters is None:
+        meters = localMeters(onsets, minlength=minlength)
+    weights = defaultdict(int)
+    for s, d, k in meters:
+        for o in range(s, s + k*d + 1, d):
+            weights[o] += k ** power
+    return [float(weights[o]) for o in onsets]
+
+#positions: ticks to compute the spectral weight for (default: the onsets)
+#returns list with spectral weight (float) for each position
+def imaweight_spectral(onsets, minlength=2, power=2, meters=None, positions=None):
+    if meters is None:
+        meters = localMeters(onsets, minlength=minlength)
+    if positions is None:
+        positions = onsets
+    positions = np.asarray(positions, dtype=np.int64)
+    #group the meters by period. Per period, the weight depends on position modulo period.
+    byperiod = defaultdict(list)
+    for s, d, k in meters:
+        byperiod[d].append((s % d, k ** power))
+    weights = np.zeros(len(positions), dtype=np.int64)
+    for d, phases in byperiod.items():
+        phaseweight = np.zeros(d, dtype=np.int64)
+        for phase, w in phases:
+            phaseweight[phase] += w
+        weights += phaseweight[positions % d]
+    return [float(w) for w in weights.tolist()]
+
+#Command line interface as onsets2ima: onsets as arguments after -onsets, or on stdin.
+#Prints the metric weights of the onsets and the spectral weights of all ticks from the
+#first to the last onset.
+if __name__ == '__main__':
+    argv = sys.argv[1:]
+    if argv and argv[0] == '-onsets':
+        onsets = [int(o) for o in argv[1:]]
+    else:
+        onsets = [int(o) for o in sys.stdin.read().split()]
+    meters = localMeters(onsets)
+    print(' '.join(str(w) for w in imaweight(onsets, meters=meters)))
+    print(' '.join(str(w) for w in imaweight_spectral(onsets, meters=meters, positions=range(onsets[0], onsets[-1]+1))))
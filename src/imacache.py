@@ -0,0 +1,166 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from math import gcd
+
+import numpy as np
+
+#Persistent cache of IMA weights in an SQLite database.
+#IMA weights only depend on the distances between the onsets. Therefore the onsets are
+#normalized before lookup: shifted to start at 0 and divided by the greatest common
+#divisor of the distances. Melodies with the same rhythm share one entry, regardless of
+#the resolution and of the onset of the first note.
+#The key includes the engine (e.g. name and version of the IMA implementation): weights
+#of another engine are not used.
+#Values are the ima and ima_spect lists (one value per onset) as float64 arrays.
+#
+#Hit and miss counts are kept per process (hits, misses) and in the database (stats()).
+#If the total size of the values exceeds maxbytes, the least recently used entries are
+#removed.
+#A hit does not write to the database: the new last use times and the counts are written
+#in batches (flush()), after flushevery hits or misses, after flushseconds, and by put(),
+#evict() and stats(). The counts of a process that is killed may miss the last batch.
+#Several processes can share the same database. A connection is opened per process
+#(an SQLite connection cannot be used after fork()).
+class IMACache():
+    def __init__(self, path, maxbytes=1024**3, flushevery=256, flushseconds=10.0):
+        self.path = str(path)
+        self.maxbytes = maxbytes
+        self.flushevery = flushevery
+        self.flushseconds = flushseconds
+        self.hits = 0
+        self.misses = 0
+        #not yet written to the database
+        self.used = {} #key -> last use time
+        self.newhits = 0
+        self.newmisses = 0
+        self.flushed = time.monotonic()
+        self.lock = threading.Lock()
+        self.pid = None
+        self.conn = None
+        conn = self._connection()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS ima (
+                key TEXT PRIMARY KEY,
+                ima BLOB NOT NULL,
+                ima_spect BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                lastused REAL NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS ima_lastused ON ima (lastused)')
+        conn.execute('CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        conn.execute("INSERT OR IGNORE INTO stats (name, value) VALUES ('hits', 0), ('misses', 0)")
+        self.size = conn.execute('SELECT COALESCE(SUM(size), 0) FROM ima').fetchone()[0]
+        if self.size > self.maxbytes: #maxbytes might have been lowered
+            self.evict()
+
+    def _connection(self):
+        if self.pid != os.getpid():
+            #use times and counts of the parent are written by the parent
+            self.used = {}
+            self.newhits = self.newmisses = 0
+            #isolation_level=None: autocommit. Used from the thread that collects IMA results as well.
+            self.conn = sqlite3.connect(self.path, timeout=120, isolation_level=None, check_same_thread=False)
+            self.pid = os.getpid()
+        return self.conn
+
+    #onsets: list of ints
+    #engine: str, identifies the IMA implementation and its parameters
+    def key(self, onsets, engine=''):
+        onsets = np.asarray(onsets, dtype=np.int64)
+        normalized = onsets - onsets[0]
+        divisor = 0
+        for d in np.unique(normalized).tolist():
+            divisor = gcd(divisor, d)
+        if divisor > 1:
+            normalized = normalized // divisor
+        return hashlib.sha1(engine.encode('utf8') + b'\0' + normalized.tobytes()).hexdigest()
+
+    #returns (ima, ima_spect), or None
+    def get(self, key):
+        with self.lock:
+            conn = self._connection()
+            row = conn.execute('SELECT ima, ima_spect FROM ima WHERE key=?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                self.newmisses += 1
+            else:
+                self.hits += 1
+                self.newhits += 1
+                self.used[key] = time.time() #mark as recently used
+            if self.newhits + self.newmisses >= self.flushevery or time.monotonic() - self.flushed > self.flushseconds:
+                self._flush()
+        if row is None:
+            return None
+        return np.frombuffer(row[0]).tolist(), np.frombuffer(row[1]).tolist()
+
+    #write the last use times and the counts to the database
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        self.flushed = time.monotonic()
+        if not (self.used or self.newhits or self.newmisses):
+            return
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany('UPDATE ima SET lastused=? WHERE key=?', [(t, key) for key, t in self.used.items()])
+            conn.execute("UPDATE stats SET value=value+? WHERE name='hits'", (self.newhits,))
+            conn.execute("UPDATE stats SET value=value+? WHERE name='misses'", (self.newmisses,))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        self.used = {}
+        self.newhits = self.newmisses = 0
+
+    def put(self, key, ima, ima_spect):
+        ima = np.asarray(ima, dtype=np.float64).tobytes()
+        ima_spect = np.asarray(ima_spect, dtype=np.float64).tobytes()
+        size = len(ima) + len(ima_spect)
+        with self.lock:
+            self._flush()
+            cur = self._connection().execute(
+                'INSERT OR IGNORE INTO ima (key, ima, ima_spect, size, lastused) VALUES (?, ?, ?, ?, ?)',
+                (key, ima, ima_spect, size, time.time())
+            )
+            self.size += size * cur.rowcount
+            if self.size > self.maxbytes:
+                self._evict()
+
+    #remove least recently used entries until the cache is at 90% of maxbytes
+    def evict(self):
+        with self.lock:
+            self._evict()
+
+    def _evict(self):
+        self._flush()
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('''
+                DELETE FROM ima WHERE key IN (
+                    SELECT key FROM (
+                        SELECT key, SUM(size) OVER (ORDER BY lastused DESC, key) AS cumsize FROM ima
+                    ) WHERE cumsize > ?
+                )
+            ''', (0.9 * self.maxbytes,))
+            self.size = conn.execute('SELECT COALESCE(SUM(size), 0) FROM ima').fetchone()[0]
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    #returns dict with hits and misses of all processes, number of entries and size in bytes
+    def stats(self):
+        with self.lock:
+            self._flush()
+            conn = self._connection()
+            stats = dict(conn.execute('SELECT name, value FROM stats').fetchall())
+            stats['entries'], stats['size'] = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM ima').fetchone()
+        return stats
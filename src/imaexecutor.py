@@ -0,0 +1,131 @@
+import os
+import signal
+import asyncio
+import threading
+
+#onsets2ima takes too long
+class IMATimeoutError(Exception):
+    def __init__(self, message):
+        self.message = message
+    def __str__(self):
+        return repr(self.message)
+
+#onsets2ima fails or gives no usable output
+class IMAError(Exception):
+    def __init__(self, message):
+        self.message = message
+    def __str__(self):
+        return repr(self.message)
+
+#Runs onsets2ima in subprocesses, concurrently with the calling thread.
+#The subprocesses are managed by an asyncio event loop in a background thread. At most
+#maxprocs run at the same time. submit() returns a concurrent.futures.Future, such that
+#the caller can compute other things while onsets2ima is running (mtc_to_seqs.py submits
+#the onsets of the next songs before it computes the features of a song).
+#A run that takes longer than timeout seconds is killed and started again, at most
+#retries times.
+#If the onsets do not fit on the command line, they are written to stdin of onsets2ima.
+#
+#The event loop thread does not survive fork(). Use getExecutor() to get an executor
+#for the current process.
+class IMAExecutor():
+    def __init__(self, program='onsets2ima', maxprocs=4, timeout=5.0, retries=0, maxarglength=None):
+        self.program = program
+        self.maxprocs = maxprocs
+        self.timeout = timeout
+        self.retries = retries
+        if maxarglength is None:
+            #leave room for the environment
+            maxarglength = os.sysconf('SC_ARG_MAX') // 4
+        self.maxarglength = maxarglength
+        self.pid = os.getpid()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='IMAExecutor', daemon=True)
+        self.thread.start()
+        self.semaphore = asyncio.run_coroutine_threadsafe(self._newSemaphore(), self.loop).result()
+
+    async def _newSemaphore(self):
+        return asyncio.Semaphore(self.maxprocs)
+
+    #returns Future with (ima, ima_spect)
+    def submit(self, onsets):
+        return asyncio.run_coroutine_threadsafe(self._run(list(onsets)), self.loop)
+
+    #returns ima, ima_spect
+    def getIMA(self, onsets):
+        return self.submit(onsets).result()
+
+    #stop the event loop thread, after the submitted runs are done
+    def shutdown(self):
+        asyncio.run_coroutine_threadsafe(self._drain(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    async def _drain(self):
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self, onsets):
+        onsets_str = [str(o) for o in onsets]
+        cmd = [self.program, '-onsets'] + onsets_str
+        stdin = None
+        if sum(len(a) + 1 for a in cmd) > self.maxarglength:
+            cmd = [self.program]
+            stdin = ' '.join(onsets_str).encode('ascii')
+        async with self.semaphore:
+            for attempt in range(self.retries + 1):
+                proc = await asyncio.create_subprocess_exec(
+                    *cmd,
+                    stdin=asyncio.subprocess.PIPE if stdin is not None else asyncio.subprocess.DEVNULL,
+                    stdout=asyncio.subprocess.PIPE,
+                    start_new_session=True,
+                )
+                try:
+                    outs, _ = await asyncio.wait_for(proc.communicate(stdin), timeout=self.timeout)
+                except asyncio.TimeoutError:
+                    #kill the process group, in case program is a wrapper script
+                    try:
+                        os.killpg(proc.pid, signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+                    await proc.wait()
+                    continue
+                return parseIMAOutput(outs.decode('ascii'), onsets)
+        raise IMATimeoutError(f'{self.program} did not finish within {self.timeout}s ({self.retries + 1} attempts, {len(onsets)} onsets)')
+
+#output of onsets2ima: line with ima weights of the onsets, line with spectral weights
+#of all ticks from the first onset to the last
+#returns ima, ima_spect
+def parseIMAOutput(output, onsets):
+    lines = output.split('\n')
+    if len(lines) < 2:
+        raise IMAError(f'No output from onsets2ima for {len(onsets)} onsets')
+
+    ima_str = lines[0].strip()
+    ima_spect_str = lines[1].strip()
+
+    ima = [float(w) for w in ima_str.split(' ')]
+    ima_spect = [float(w) for w in ima_spect_str.split(' ')]
+
+    #if onset of first note != 0 (start with rest), add zeros to ima_spect
+    ima_spect = [0.0]*onsets[0] + ima_spect
+
+    ima_spect = [ima_spect[o] for o in onsets]
+
+    return ima, ima_spect
+
+_executor = None
+_executorArgs = None
+
+#returns the IMAExecutor of the current process with the arguments (see IMAExecutor).
+#A new one is made after fork(), and if the arguments differ from those of the last call.
+def getExecutor(**kwargs):
+    global _executor, _executorArgs
+    if _executor is not None and _executor.pid == os.getpid() and kwargs != _executorArgs:
+        _executor.shutdown()
+        _executor = None
+    if _executor is None or _executor.pid != os.getpid():
+        _executor = IMAExecutor(**kwargs)
+        _executorArgs = kwargs
+    return _executor
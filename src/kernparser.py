@@ -0,0 +1,382 @@
+import re
+from fractions import Fraction
+
+#Parser for the subset of **kern that is used for monophonic melodies:
+#one **kern spine, notes, rests, ties, grace notes, chords, barlines,
+#key (*G:, *e-:) and meter (*M3/4) interpretations, and global comments.
+#
+#The result is the same as what parseMelody() in mtc_to_seqs.py produces with music21:
+#- ties are merged into one note
+#- grace notes are removed
+#- chords are replaced by their highest note
+#- the first measure is padded if it is a pickup, and a measure that is split by a
+#  repeat sign in the middle of a bar is padded as in padSplittedBars()
+#
+#For everything outside this subset KernUnsupportedError is raised, and the caller
+#should use music21 instead.
+
+#file cannot be handled by this parser
+class KernUnsupportedError(Exception):
+    def __init__(self, message):
+        self.message = message
+    def __str__(self):
+        return repr(self.message)
+
+#characters in a note token that do not affect pitch or duration
+#(beams, stems, slurs, phrases, articulations, ornaments, editorial marks)
+ignorable_signifiers = set("LJKk/\\(){}&;'\"`~^,:|<>TtMmWwSsRO$vuoNxXyIiU")
+
+step2diatonic = {'C':0, 'D':1, 'E':2, 'F':3, 'G':4, 'A':5, 'B':6}
+step2pitchclass = {'C':0, 'D':2, 'E':4, 'F':5, 'G':7, 'A':9, 'B':11}
+
+#durations of the note values from 128th to maxima, in quarterLength
+notevalues = set(Fraction(2)**i for i in range(-5, 6))
+
+key_re = re.compile(r'^\*([A-Ga-g][#-]*):$')
+meter_re = re.compile(r'^\*M(\d+)/(\d+)$')
+pitch_re = re.compile(r'^([a-gA-G])\1*$')
+recip_re = re.compile(r'^(\d+)(\.*)$')
+
+#A note or rest after normalization
+class KernEvent():
+    __slots__ = ('isRest', 'step', 'alter', 'octave', 'offset', 'quarterLength', 'measure', 'tie')
+
+    def __init__(self, isRest, step, alter, octave, offset, quarterLength, measure, tie):
+        self.isRest = isRest
+        self.step = step
+        self.alter = alter
+        self.octave = octave
+        self.offset = offset
+        self.quarterLength = quarterLength
+        self.measure = measure #index in KernMelody.measures
+        self.tie = tie # None, 'start', 'continue', 'stop'
+
+    @property
+    def isNote(self):
+        return not self.isRest
+
+    #e.g. 'E-', 'F#'
+    @property
+    def name(self):
+        if self.alter > 0:
+            return self.step + '#' * self.alter
+        return self.step + '-' * -self.alter
+
+    @property
+    def nameWithOctave(self):
+        return self.name + str(self.octave)
+
+    @property
+    def midi(self):
+        return 12 * (self.octave + 1) + step2pitchclass[self.step] + self.alter
+
+    #C0 is 1, as in music21
+    @property
+    def diatonicNoteNum(self):
+        return 7 * self.octave + step2diatonic[self.step] + 1
+
+#A measure as delimited by barlines
+class KernMeasure():
+    __slots__ = ('offset', 'quarterLength', 'paddingLeft')
+
+    def __init__(self, offset):
+        self.offset = offset
+        self.quarterLength = Fraction(0)
+        self.paddingLeft = Fraction(0)
+
+class KernMelody():
+    def __init__(self, path):
+        self.path = str(path)
+        self.events = []         # KernEvent, notes and rests
+        self.measures = []       # KernMeasure
+        self.timesignatures = [] # (offset, numerator, denominator)
+        self.keys = []           # (offset, key string as in *X:, e.g. 'G', 'e-')
+        self.comments = []       # (offset, text) of the global comments
+
+    @property
+    def notes(self):
+        return [e for e in self.events if not e.isRest]
+
+    #duration of the bar in quarterLength for a time signature
+    @staticmethod
+    def barDuration(numerator, denominator):
+        return Fraction(4 * numerator, denominator)
+
+    #(numerator, denominator) of time signature at offset, or None
+    def timesignatureAt(self, offset):
+        res = None
+        for ts_offset, numerator, denominator in self.timesignatures:
+            if ts_offset <= offset:
+                res = (numerator, denominator)
+        return res
+
+#returns (step, alter, octave)
+def _parsePitch(letters, accidentals):
+    if not pitch_re.match(letters):
+        raise KernUnsupportedError(f'pitch {letters}')
+    step = letters[0].upper()
+    if letters[0].islower():
+        octave = 3 + len(letters)
+    else:
+        octave = 4 - len(letters)
+    alter = accidentals.count('#') - accidentals.count('-')
+    if accidentals.count('#') and accidentals.count('-'):
+        raise KernUnsupportedError(f'accidental {accidentals}')
+    return step, alter, octave
+
+#returns (quarterLength, isRest, isGrace, pitch, tie)
+#pitch is (step, alter, octave) or None for rests
+def _parseSubtoken(token):
+    digits, dots, letters, accidentals, tie = '', '', '', '', None
+    isRest, isGrace = False, False
+    for c in token:
+        if c.isdigit():
+            if dots or letters: #recip should come first
+                raise KernUnsupportedError(f'token {token}')
+            digits += c
+        elif c == '.':
+            dots += c
+        elif c in 'abcdefgABCDEFG':
+            letters += c
+        elif c in '#-n':
+            accidentals += c
+        elif c == 'r':
+            isRest = True
+        elif c in 'qQ':
+            isGrace = True
+        elif c in '[_]':
+            if tie is not None:
+                raise KernUnsupportedError(f'token {token}')
+            tie = {'[':'start', '_':'continue', ']':'stop'}[c]
+        elif c in ignorable_signifiers:
+            pass
+        else:
+            raise KernUnsupportedError(f'token {token}')
+    if isRest and (letters or accidentals or isGrace or tie):
+        raise KernUnsupportedError(f'token {token}')
+    if not isRest and not letters:
+        raise KernUnsupportedError(f'token {token}')
+    if isGrace:
+        return Fraction(0), False, True, _parsePitch(letters, accidentals), tie
+    m = recip_re.match(digits + dots)
+    if not m:
+        raise KernUnsupportedError(f'duration in {token}')
+    recip = m.group(1)
+    if recip == '0':
+        base = Fraction(8)
+    elif recip == '00':
+        base = Fraction(16)
+    elif recip == '000':
+        base = Fraction(32)
+    elif recip.startswith('0'):
+        raise KernUnsupportedError(f'duration in {token}')
+    else:
+        base = Fraction(4, int(recip))
+    if base not in notevalues and dots:
+        #music21 gives dotted tuplets another duration type than a plain Duration
+        raise KernUnsupportedError(f'dotted tuplet {token}')
+    ql = base
+    for i in range(len(dots)):
+        ql += base / (2 ** (i+1))
+    if isRest:
+        return ql, True, False, None, None
+    return ql, False, False, _parsePitch(letters, accidentals), tie
+
+#duration is not a (dotted) note value
+def _isTuplet(ql):
+    return not any(ql / (2 - Fraction(1, 2**dots)) in notevalues for dots in range(3))
+
+#pitch with highest midi number (as music21's Chord.sortAscending(), which keeps
+#the order of enharmonic pitches)
+def _topPitch(pitches):
+    def midi(p):
+        step, alter, octave = p
+        return 12 * (octave + 1) + step2pitchclass[step] + alter
+    top = pitches[0]
+    for p in pitches[1:]:
+        if midi(p) >= midi(top):
+            top = p
+    return top
+
+def parseKern(path):
+    km = KernMelody(path)
+    with open(path, 'r', encoding='utf8', errors='replace') as f:
+        lines = f.read().splitlines()
+
+    in_kern = False
+    offset = Fraction(0)
+    measure = KernMeasure(offset)
+    measure_events = 0
+    measures = [] # (KernMeasure, number of events)
+    open_tie = None # KernEvent that is tied to the next note
+    #In measures without number (e.g. before the first barline, or after =:|!|:), music21
+    #puts interpretations and grace notes at the start of the measure.
+    unnumbered = True
+    #A global comment gets the offset of the next object in the spine.
+    pending_comments = []
+    def placeComments(object_offset):
+        km.comments.extend((object_offset, text) for text in pending_comments)
+        pending_comments.clear()
+
+    for line in lines:
+        if line == '':
+            continue
+        if '\t' in line:
+            raise KernUnsupportedError('more than one spine')
+        if line.startswith('!!!'): #reference record
+            continue
+        if line.startswith('!!'):
+            pending_comments.append(line[2:].strip())
+            continue
+        zero_offset = measure.offset if unnumbered else offset
+        if line.startswith('!'): #local comment
+            if line.lstrip('!').strip() != '':
+                placeComments(zero_offset)
+            continue
+        if line.startswith('**'):
+            if line != '**kern' or in_kern:
+                raise KernUnsupportedError(f'spine {line}')
+            in_kern = True
+            continue
+        if not in_kern:
+            raise KernUnsupportedError(f'data before **kern: {line}')
+        if line.startswith('*'):
+            if line == '*-':
+                in_kern = False
+                continue
+            if line in ('*^', '*v', '*+', '*x'):
+                raise KernUnsupportedError(f'spine manipulator {line}')
+            placeComments(zero_offset)
+            if line.startswith('*MM'): #tempo
+                continue
+            if line.startswith('*M'):
+                m = meter_re.match(line)
+                if not m or m.group(2).startswith('0'):
+                    raise KernUnsupportedError(f'meter {line}')
+                if offset != measure.offset:
+                    raise KernUnsupportedError(f'meter change within measure')
+                if km.timesignatures and unnumbered:
+                    #music21 gives other beats after a meter change after a barline without number
+                    raise KernUnsupportedError(f'meter change in unnumbered measure')
+                km.timesignatures.append((offset, int(m.group(1)), int(m.group(2))))
+                continue
+            if line.endswith(':'):
+                m = key_re.match(line)
+                if not m:
+                    raise KernUnsupportedError(f'key {line}')
+                if unnumbered and offset != measure.offset:
+                    #the key is put before the first note of the measure, but that note is not in its context
+                    raise KernUnsupportedError(f'key change within unnumbered measure')
+                km.keys.append((offset, m.group(1)))
+                continue
+            #other tandem interpretations (clef, key signature, instrument, ...) are not needed
+            continue
+        if line.startswith('='):
+            placeComments(offset)
+            measures.append((measure, measure_events))
+            number = re.search(r'(\d+)', line)
+            unnumbered = number is None or int(number.group(1)) == 0
+            measure = KernMeasure(offset)
+            measure_events = 0
+            continue
+        if line == '.':
+            continue
+
+        #note, rest or chord
+        subtokens = [parsed for parsed in (_parseSubtoken(t) for t in line.split(' ') if t != '')]
+        if len(subtokens) == 0:
+            raise KernUnsupportedError(f'token {line}')
+        ql, isRest, isGrace, pitch, tie = subtokens[0]
+        if len(subtokens) > 1:
+            if any(st[1] or st[4] is not None or st[0] != ql or st[2] != isGrace for st in subtokens):
+                raise KernUnsupportedError(f'chord {line}')
+            pitch = _topPitch([st[3] for st in subtokens])
+        if isGrace:
+            if tie is not None or open_tie is not None:
+                raise KernUnsupportedError(f'tied grace note {line}')
+            placeComments(zero_offset)
+            continue
+        placeComments(offset)
+
+        measure.quarterLength += ql
+        measure_events += 1
+
+        if tie is not None and _isTuplet(ql):
+            #music21 keeps the tuplet of the first note in the duration of merged notes
+            raise KernUnsupportedError(f'tied tuplet {line}')
+        if tie in ('continue', 'stop'):
+            if open_tie is None or (open_tie.step, open_tie.alter, open_tie.octave) != pitch:
+                raise KernUnsupportedError(f'tie {line}')
+            open_tie.quarterLength += ql
+            if tie == 'stop':
+                open_tie.tie = None #as stripTies()
+                open_tie = None
+        else:
+            if open_tie is not None:
+                raise KernUnsupportedError(f'unterminated tie before {line}')
+            if isRest:
+                event = KernEvent(True, None, 0, None, offset, ql, len(measures), None)
+            else:
+                step, alter, octave = pitch
+                event = KernEvent(False, step, alter, octave, offset, ql, len(measures), tie)
+            km.events.append(event)
+            if tie == 'start':
+                open_tie = event
+        offset += ql
+
+    if open_tie is not None:
+        raise KernUnsupportedError('unterminated tie')
+    #music21 appends global comments after the last note at another offset
+    if pending_comments or (km.comments and km.comments[-1][0] == offset):
+        raise KernUnsupportedError('comment after last note')
+    if measure_events > 0:
+        measures.append((measure, measure_events))
+
+    #a measure without events before the first barline does not count
+    if len(measures) > 0 and measures[0][1] == 0:
+        measures = measures[1:]
+        for e in km.events:
+            e.measure -= 1
+    #neither do empty measures at the end
+    while len(measures) > 0 and measures[-1][1] == 0:
+        measures = measures[:-1]
+    #music21 pads empty measures in between in padSplittedBars()
+    if any(n == 0 for _, n in measures):
+        raise KernUnsupportedError('empty measure')
+    km.measures = [m for m, _ in measures]
+
+    #no timesignature before the first note: music21 does not find a meter for the first note
+    if km.timesignatures and km.events and km.timesignatures[0][0] > km.events[0].offset:
+        raise KernUnsupportedError('meter after first note')
+    if km.keys and km.events and km.keys[0][0] > km.events[0].offset:
+        raise KernUnsupportedError('key after first note')
+
+    #pickup: pad the first measure if it is shorter than a bar
+    if km.measures:
+        first = km.measures[0]
+        ts = km.timesignatures[0] if km.timesignatures and km.timesignatures[0][0] == first.offset else None
+        if ts is not None:
+            barduration = KernMelody.barDuration(ts[1], ts[2])
+            if first.quarterLength < barduration:
+                #float, as in music21. Not exact for tuplets.
+                first.paddingLeft = float(barduration) - float(first.quarterLength)
+
+    #music21 computes the beat of some notes from the offset in the score instead of the
+    #offset in the measure: after a measure that is too long, and in measures that start at
+    #a tuplet offset
+    for m in km.measures:
+        ts = km.timesignatureAt(m.offset)
+        if ts is not None and m.quarterLength > KernMelody.barDuration(ts[0], ts[1]):
+            raise KernUnsupportedError('measure longer than time signature')
+        if m.offset.denominator & (m.offset.denominator - 1):
+            raise KernUnsupportedError('measure starts at tuplet offset')
+
+    #padSplittedBars(): pad the second part of a measure that is split by a repeat sign
+    for m0, m1 in zip(km.measures, km.measures[1:]):
+        ts = km.timesignatureAt(m0.offset)
+        if ts is None:
+            continue
+        if m0.quarterLength + m0.paddingLeft + m1.quarterLength == KernMelody.barDuration(ts[0], ts[1]):
+            m1.paddingLeft = m0.quarterLength
+
+    return km
@@ -0,0 +1,23 @@
+import importlib
+
+#Module that is imported on first use of one of its attributes, such that importing a
+#module that needs it (e.g. music21, pandas) does not pay for the import until it is
+#actually used.
+#onimport: function module -> None, called after the import (e.g. to configure it)
+class LazyModule():
+    def __init__(self, name, onimport=None):
+        self.__dict__['_name'] = name
+        self.__dict__['_onimport'] = onimport
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            module = importlib.import_module(self._name)
+            self.__dict__['_module'] = module
+            if self._onimport is not None:
+                self._onimport(module)
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
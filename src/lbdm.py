@@ -0,0 +1,117 @@
+import numpy as np
+
+#Local Boundary Detection Model (Cambouropoulos 2001), computed with NumPy for one or
+#more songs at once.
+#
+#For each parameter (pitch, IOI, rest), take the interval AFTER the note:
+#note:       n0    n1    n2    n3    n4    n5
+#            |  \  |  \  |  \  |  \  |  \
+#interval    i0    i1    i2    i3    i4    i5
+#            |  \  |  \  |  \  |  \  |  \  |
+#change      None  r1    r2    r3    r4    r5
+#                  |  /  |  /  |  /  |  /  |  /
+#strength    None  s1    s2    s3    s4    s5
+#
+#  r1 is the degree of change between i0 and i1
+#  s1 is computed from r1 and r2, and normalized by the maximum strength in the song
+#
+#The output is the same as that of the lbdm functions in mtc_to_seqs.py: lists with
+#None for the positions where the value is not defined.
+
+features = ['lbdm_spitch', 'lbdm_sioi', 'lbdm_srest', 'lbdm_rpitch', 'lbdm_rioi', 'lbdm_rrest', 'lbdm_boundarystrength']
+
+#Degree of change between x[i-1] and x[i] (intervals after the notes)
+#valid: positions where both intervals exist
+#returns (r, mask)
+def degreeChange(x, valid, const_add=0.0):
+    x1 = np.roll(x, 1) + const_add
+    x2 = x + const_add
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = np.where(x1 == x2, 0.0, np.abs(x1 - x2) / (x1 + x2))
+    mask = valid & ((x1 == x2) | (((x1 + x2) != 0) & (x1 >= 0) & (x2 >= 0)))
+    return r, mask
+
+#Boundary strength for the interval after the note: x[i] * (r[i] + r[i+1]),
+#normalized per song by the maximum strength.
+#starts: index of the first note of each song
+#returns (s, mask)
+def boundaryStrength(r, x, valid, starts):
+    s = np.where(valid, x * (r + np.roll(r, -1)), 0.0)
+    if len(s) > 0:
+        maxs = np.maximum.reduceat(np.where(valid, s, -np.inf), starts)
+        maxs = np.repeat(maxs, np.diff(np.append(starts, len(s))))
+        s = np.where(maxs > 0, s / np.where(maxs > 0, maxs, 1.0), s)
+    return s, valid
+
+#midipitch, ioi, restafter: arrays of equal length with one value per note of all songs
+#  ioi: inter onset interval after the note. The value for the last note is not used.
+#  restafter: duration of the rest after the note (0.0 for none)
+#lengths: number of notes per song
+#returns dict feature -> (values, mask), with arrays for all songs
+def lbdmArrays(midipitch, ioi, restafter, lengths, pitchthreshold=12, ioithreshold=4.0, restthreshold=4.0):
+    lengths = np.asarray(lengths, dtype=int)
+    total = int(lengths.sum())
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1])).astype(int)
+    #position of each note in its song, and the length of its song
+    songlength = np.repeat(lengths, lengths)
+    pos = np.arange(total) - np.repeat(starts, lengths)
+    #for lbdm we need at least 3 notes
+    long_enough = songlength >= 3
+    #change is defined for n1 .. n(N-2), strength for n1 .. n(N-3)
+    valid_r = long_enough & (pos >= 1) & (pos <= songlength - 2)
+    valid_s = long_enough & (pos >= 1) & (pos <= songlength - 3)
+
+    #thresholded intervals after the notes. The last note of each song has none, 0.0 is never used.
+    midipitch = np.asarray(midipitch, dtype=float)
+    x_pitch = np.minimum(pitchthreshold, np.abs(np.roll(midipitch, -1) - midipitch))
+    x_ioi = np.minimum(ioithreshold, np.nan_to_num(np.asarray(ioi, dtype=float)))
+    x_rest = np.minimum(restthreshold, np.asarray(restafter, dtype=float))
+    last = pos == songlength - 1
+    for x in (x_pitch, x_ioi, x_rest):
+        x[last] = 0.0
+
+    r_pitch, m_rpitch = degreeChange(x_pitch, valid_r, const_add=1)
+    r_ioi, m_rioi = degreeChange(x_ioi, valid_r)
+    r_rest, m_rrest = degreeChange(x_rest, valid_r)
+
+    s_starts = starts[lengths > 0]
+    s_pitch, m_spitch = boundaryStrength(r_pitch, x_pitch, valid_s, s_starts)
+    s_ioi, m_sioi = boundaryStrength(r_ioi, x_ioi, valid_s, s_starts)
+    s_rest, m_srest = boundaryStrength(r_rest, x_rest, valid_s, s_starts)
+
+    boundarystrength = 0.25*s_pitch + 0.5*s_ioi + 0.25*s_rest
+
+    return {
+        'lbdm_spitch': (s_pitch, m_spitch),
+        'lbdm_sioi': (s_ioi, m_sioi),
+        'lbdm_srest': (s_rest, m_srest),
+        'lbdm_rpitch': (r_pitch, m_rpitch),
+        'lbdm_rioi': (r_ioi, m_rioi),
+        'lbdm_rrest': (r_rest, m_rrest),
+        'lbdm_boundarystrength': (boundarystrength, valid_s),
+    }
+
+#values where mask is True, None elsewhere
+def _tolist(values, mask):
+    return [v if m else None for v, m in zip(values.tolist(), mask.tolist())]
+
+#LBDM for one song.
+#returns dict feature -> list
+def lbdm(midipitch, ioi, restafter, **thresholds):
+    return lbdmBatch([(midipitch, ioi, restafter)], **thresholds)[0]
+
+#LBDM for a list of songs, each (midipitch, ioi, restafter). ioi may contain None.
+#All songs are computed in one pass.
+#returns list of dict feature -> list
+def lbdmBatch(songs, **thresholds):
+    lengths = [len(midipitch) for midipitch, _, _ in songs]
+    midipitch = np.concatenate([np.asarray(song[0], dtype=float) for song in songs] + [np.zeros(0)])
+    ioi = np.concatenate([np.array([i if i is not None else np.nan for i in song[1]], dtype=float) for song in songs] + [np.zeros(0)])
+    restafter = np.concatenate([np.asarray(song[2], dtype=float) for song in songs] + [np.zeros(0)])
+    res = lbdmArrays(midipitch, ioi, restafter, lengths, **thresholds)
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    return [
+        {feature: _tolist(values[start:end], mask[start:end]) for feature, (values, mask) in res.items()}
+        for start, end in zip(starts, ends)
+    ]
@@ -0,0 +1,97 @@
+import os
+import hashlib
+import tempfile
+
+#On-disk cache for parsed melodies.
+#Entries are files in cachedir, named after the key. The key is a hash of the
+#contents of the input file and a version string, so an edited file or a change
+#in the parsing code results in a new entry.
+#If the total size exceeds maxbytes, the least recently used entries are removed.
+#Recency is the modification time of the entry, which is updated on every hit.
+#Several processes can share the same cachedir. The size is the size of cachedir when it
+#was last scanned, plus the size of the entries this process added since. The directory
+#is scanned again after this process added rescanfraction*maxbytes, such that the
+#entries of the other processes are counted as well.
+class MelodyCache():
+    def __init__(self, cachedir, maxbytes=2*1024**3, rescanfraction=0.01):
+        self.cachedir = str(cachedir)
+        self.maxbytes = maxbytes
+        self.rescanbytes = rescanfraction * maxbytes
+        os.makedirs(self.cachedir, exist_ok=True)
+        self.size = sum(size for _, _, size in self._entries())
+        self.added = 0 #since the last scan
+        if self.size > self.maxbytes: #maxbytes might have been lowered
+            self.evict()
+
+    #path: input file, version: string that identifies the parsing code
+    def key(self, path, version):
+        h = hashlib.sha1(version.encode('utf8'))
+        with open(path, 'rb') as f:
+            h.update(f.read())
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cachedir, key[:2], key + '.pickle')
+
+    #returns list of (path, mtime, size)
+    def _entries(self):
+        entries = []
+        for dirpath, _, filenames in os.walk(self.cachedir):
+            for filename in filenames:
+                if not filename.endswith('.pickle'):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError: #removed by other process
+                    continue
+                entries.append((path, st.st_mtime, st.st_size))
+        return entries
+
+    #returns the cached bytes, or None
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path) #mark as recently used
+        except FileNotFoundError:
+            return None
+        return data
+
+    #Remove an entry that cannot be used (e.g. a corrupt file)
+    def discard(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def put(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        #write to temporary file and rename, such that other processes never see partial entries
+        fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmppath, path)
+        self.size += len(data)
+        self.added += len(data)
+        if self.added > self.rescanbytes:
+            self.size = sum(size for _, _, size in self._entries())
+            self.added = 0
+        if self.size > self.maxbytes:
+            self.evict()
+
+    #remove least recently used entries until the cache is at 90% of maxbytes
+    def evict(self):
+        entries = sorted(self._entries(), key=lambda e: e[1])
+        self.size = sum(size for _, _, size in entries)
+        self.added = 0
+        for path, _, size in entries:
+            if self.size <= 0.9 * self.maxbytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.size -= size
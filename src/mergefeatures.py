@@ -1,10 +1,7 @@
-from MTCFeatures.MTCFeatureLoader import MTCFeatureLoader
+from mergestream import mergeFiles
 
-#fl = MTCFeatureLoader('mtcfsinst_sequences.jsonl.gz')
-#seq_iter = fl.merge_sequences('mtcfsinst_textfeatures.jsonl')
-#fl.writeJSON('mtcfsinst_sequences_merged.jsonl.gz', seq_iter)
-
-fl = MTCFeatureLoader('essen_sequences.jsonl.gz')
-seq_iter = fl.merge_sequences('essen_nextisrest.jsonl')
-fl.writeJSON('essen_sequences_merged.jsonl', seq_iter)
+#mergeFiles('mtcfsinst_sequences.jsonl.gz', 'mtcfsinst_textfeatures.jsonl', 'mtcfsinst_sequences_merged.jsonl.gz')
 
+if __name__ == '__main__':
+    seqsonly, featuresonly = mergeFiles('essen_sequences.jsonl.gz', 'essen_nextisrest.jsonl', 'essen_sequences_merged.jsonl')
+    print(f'{len(seqsonly)} sequences without features, {len(featuresonly)} features without sequence')
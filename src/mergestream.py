@@ -0,0 +1,136 @@
+import os
+import gzip
+import json
+import queue
+import sqlite3
+import argparse
+import threading
+import multiprocessing
+from collections import deque
+
+from textindex import TextIndex
+
+#Per-process state of the workers
+_mergeWorker = {}
+
+def initMergeWorker(featurepath, compress):
+    _mergeWorker['index'] = TextIndex(featurepath)
+    _mergeWorker['compress'] = compress
+
+def mergeChunk(lines):
+    index = _mergeWorker['index']
+    out = []
+    ids = []
+    missing = []
+    for line in lines:
+        seq = json.loads(line)
+        ids.append(seq['id'])
+        try:
+            seq['features'].update(index[seq['id']]['features'])
+        except KeyError:
+            missing.append(seq['id'])
+        out.append(json.dumps(seq)+'\n')
+    data = ''.join(out).encode('utf8')
+    if _mergeWorker['compress']:
+        data = gzip.compress(data, 6, mtime=0)
+    return data, ids, missing
+
+#Chunks of lines of path, read and decompressed in a background thread
+#An error in the thread (e.g. a truncated .gz file) is raised by the iterator.
+def readChunks(path, chunklines, maxpending=8):
+    chunks = queue.Queue(maxpending)
+    def read():
+        try:
+            opener = gzip.open if str(path).endswith('.gz') else open
+            with opener(path, 'rt', encoding='utf8') as f:
+                chunk = []
+                for line in f:
+                    if line.strip():
+                        chunk.append(line)
+                    if len(chunk) >= chunklines:
+                        chunks.put(chunk)
+                        chunk = []
+                if chunk:
+                    chunks.put(chunk)
+        except Exception as e:
+            chunks.put(e)
+        else:
+            chunks.put(None)
+    threading.Thread(target=read, daemon=True).start()
+    while True:
+        chunk = chunks.get()
+        if chunk is None:
+            return
+        if isinstance(chunk, Exception):
+            raise chunk
+        yield chunk
+
+#Merge the features of the records in featurepath into the sequences in seqpath, and write
+#the result to outpath (.jsonl or .jsonl.gz).
+#
+#Indexed join on id: featurepath is indexed with TextIndex, and the sequences are streamed.
+#Memory use does not depend on the size of the files:
+#- A thread reads and decompresses seqpath in chunks of lines.
+#- Worker processes decode the sequences of a chunk, look up and merge the features,
+#  encode them and compress the chunk (as a separate gzip member).
+#- The main process writes the chunks in order.
+#- The ids that were seen are kept in a temporary SQLite table, to find the records in
+#  featurepath without sequence.
+#
+#Features in featurepath replace features with the same name in the sequences.
+#The output is written to outpath.tmp, and renamed when it is complete. On an error,
+#outpath.tmp is removed and outpath is not changed.
+#returns (ids of sequences without features, ids of features without sequence)
+def mergeFiles(seqpath, featurepath, outpath, jobs=4, chunklines=500):
+    outpath = str(outpath)
+    compress = outpath.endswith('.gz')
+    TextIndex(featurepath)._connection() #build the index once, before the workers start
+    #temporary table for the seen ids: on disk, not in memory
+    seen = sqlite3.connect('')
+    seen.execute('CREATE TABLE seen (id TEXT PRIMARY KEY)')
+    seqsonly = []
+    pool = multiprocessing.Pool(jobs, initializer=initMergeWorker, initargs=(str(featurepath), compress))
+    #Pool.imap() would read all chunks at once. At most 2*jobs chunks are in the pool.
+    pending = deque()
+    def writeOldest():
+        data, ids, missing = pending.popleft().get()
+        outfile.write(data)
+        seen.executemany('INSERT OR IGNORE INTO seen VALUES (?)', [(songid,) for songid in ids])
+        seqsonly.extend(missing)
+    try:
+        with open(outpath + '.tmp', 'wb') as outfile:
+            for chunk in readChunks(seqpath, chunklines):
+                pending.append(pool.apply_async(mergeChunk, (chunk,)))
+                if len(pending) > 2 * jobs:
+                    writeOldest()
+            while pending:
+                writeOldest()
+    except BaseException:
+        #incomplete output
+        if os.path.exists(outpath + '.tmp'):
+            os.remove(outpath + '.tmp')
+        seen.close()
+        raise
+    finally:
+        pool.terminate()
+    os.replace(outpath + '.tmp', outpath)
+    seen.execute('ATTACH DATABASE ? AS ix', (str(featurepath) + '.idx.sqlite',))
+    featuresonly = [row[0] for row in seen.execute('SELECT id FROM ix.records WHERE id NOT IN (SELECT id FROM seen)')]
+    seen.close()
+    return seqsonly, featuresonly
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='Merge the features in a .jsonl(.gz) file into a sequences file.')
+    argparser.add_argument('seqpath', type=str, help='sequences (.jsonl or .jsonl.gz)')
+    argparser.add_argument('featurepath', type=str, help='features to add (.jsonl or .jsonl.gz, see textindex.py)')
+    argparser.add_argument('outpath', type=str, help='output (.jsonl or .jsonl.gz)')
+    argparser.add_argument('-jobs', type=int, help='Number of worker processes.', default=4)
+    argparser.add_argument('-chunklines', type=int, help='Number of sequences sent to a worker at once.', default=500)
+    cmdargs = argparser.parse_args()
+    seqsonly, featuresonly = mergeFiles(cmdargs.seqpath, cmdargs.featurepath, cmdargs.outpath, jobs=cmdargs.jobs, chunklines=cmdargs.chunklines)
+    print(f'{len(seqsonly)} sequences without features:')
+    for songid in seqsonly:
+        print(' ', songid)
+    print(f'{len(featuresonly)} features without sequence:')
+    for songid in featuresonly:
+        print(' ', songid)
@@ -1,10 +1,7 @@
-from MTCFeatures.MTCFeatureLoader import MTCFeatureLoader
+from mergestream import mergeFiles
 
-#fl = MTCFeatureLoader('mtcfsinst_sequences.jsonl.gz')
-#seq_iter = fl.merge_sequences('mtcfsinst_textfeatures_nopunctuation.jsonl')
-#fl.writeJSON('mtcfsinst_sequences_merged.jsonl.gz', seq_iter)
-
-fl = MTCFeatureLoader('mtcann_sequences.jsonl.gz')
-seq_iter = fl.merge_sequences('mtcann_textfeatures_nopunctuation.jsonl')
-fl.writeJSON('mtcann_sequences_merged.jsonl.gz', seq_iter)
+#mergeFiles('mtcfsinst_sequences.jsonl.gz', 'mtcfsinst_textfeatures_nopunctuation.jsonl', 'mtcfsinst_sequences_merged.jsonl.gz')
 
+if __name__ == '__main__':
+    seqsonly, featuresonly = mergeFiles('mtcann_sequences.jsonl.gz', 'mtcann_textfeatures_nopunctuation.jsonl', 'mtcann_sequences_merged.jsonl.gz')
+    print(f'{len(seqsonly)} sequences without features, {len(featuresonly)} features without sequence')
@@ -0,0 +1,41 @@
+import os
+import pickle
+import hashlib
+
+#On-disk cache for the metadata tables of the collections.
+#An entry is a pickle of the result of build(). The key is a hash of the name of the table,
+#a version string and the size and modification time of the input files (e.g. the CSVs),
+#so a changed input or a change in the building code results in a new entry. Older
+#entries of the same table are removed.
+class MetadataCache():
+    def __init__(self, cachedir):
+        self.cachedir = str(cachedir)
+        os.makedirs(self.cachedir, exist_ok=True)
+
+    def key(self, paths, version):
+        h = hashlib.sha1(version.encode('utf8'))
+        for path in paths:
+            st = os.stat(path)
+            h.update(f'{path} {st.st_size} {st.st_mtime_ns}\n'.encode('utf8'))
+        return h.hexdigest()
+
+    #returns the table: from the cache if the input files did not change, otherwise build()
+    def get(self, name, paths, version, build):
+        filename = os.path.join(self.cachedir, f'{name}-{self.key(paths, version)}.pickle')
+        try:
+            with open(filename, 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            pass
+        table = build()
+        #write to a temporary file first, such that other processes never see a partial entry
+        with open(filename + f'.{os.getpid()}.tmp', 'wb') as f:
+            pickle.dump(table, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(filename + f'.{os.getpid()}.tmp', filename)
+        for entry in os.listdir(self.cachedir):
+            if entry.startswith(name + '-') and entry.endswith('.pickle') and entry != os.path.basename(filename):
+                try:
+                    os.remove(os.path.join(self.cachedir, entry))
+                except FileNotFoundError:
+                    pass
+        return table
@@ -1,22 +1,40 @@
-import music21 as m21
-m21.humdrum.spineParser.flavors['JRP'] = True
+from lazymodule import LazyModule
 
-import pandas as pd
+#music21 and pandas take seconds to import. They are imported on first use.
+m21 = LazyModule('music21', onimport=lambda m21: m21.humdrum.spineParser.flavors.__setitem__('JRP', True))
+pd = LazyModule('pandas')
 import numpy as np
 import json
 import os
 import argparse
 from fractions import Fraction
-from collections import defaultdict
+from collections import deque
 from pathlib import Path
-from itertools import zip_longest
-from math import gcd
-import subprocess
-from subprocess import TimeoutExpired
+from itertools import chain
+from bisect import bisect_left
 import sys, traceback
+import multiprocessing
 import tempfile
-
-from MTCFeatures.MTCFeatureLoader import MTCFeatureLoader
+import time
+import concurrent.futures
+from contextlib import nullcontext
+
+from workqueue import WorkQueue, DeferredDoneQueue
+from melodycache import MelodyCache
+from kernparser import parseKern, KernMelody, KernUnsupportedError
+from songcontext import SongContext, fraction_str, lcm
+from lbdm import lbdm
+from ima import localMeters, imaweight, imaweight_spectral
+from imaexecutor import getExecutor
+from imacache import IMACache
+from shardwriter import ShardWriter, shardedIds, shardPrefix, latestGeneration, removeOldGenerations
+from songmanifest import SongManifest, hashString
+from featuregraph import FeatureGraph
+from textindex import TextIndex
+from metadatacache import MetadataCache
+from songtimings import SongTimer, TimingReport
+from failureledger import FailureLedger
+from songsupervisor import SongSupervisor
 
 epsilon = 0.0001
 
@@ -210,74 +228,379 @@ parser.add_argument(
     action='store_true'
 )
 
-args = parser.parse_args()
+### JOBS
+parser.add_argument(
+    '-jobs',
+    type=int,
+    help='Number of worker processes. Output order is the same as with a single process.',
+    default=1
+)
+parser.add_argument(
+    '-chunksize',
+    type=int,
+    help='Number of songs sent to a worker at once (default: computed from the number of songs and jobs).',
+    default=0
+)
 
-mtcfsroot = Path(args.mtcroot, 'MTC-FS-INST-2.0')
-mtcannroot = Path(args.mtcroot, 'MTC-ANN-2.0.1')
-mtclcroot = Path(args.mtcroot, 'MTC-LC-1.0')
+### SUPERVISED EXTRACTION
+parser.add_argument(
+    '-songtimeout',
+    type=float,
+    help='Kill the extraction of a song that takes longer than this number of seconds, and record it as failed. Songs are extracted in supervised worker processes (also with -jobs 1).',
+    default=0
+)
+parser.add_argument(
+    '-songmaxrss',
+    type=int,
+    help='Kill the extraction of a song if its worker process uses more than this number of MB, and record it as failed.',
+    default=0
+)
+parser.add_argument(
+    '-recycleafter',
+    type=int,
+    help='Replace a worker process by a new one after this number of songs.',
+    default=0
+)
+parser.add_argument(
+    '-recyclerss',
+    type=int,
+    help='Replace a worker process by a new one if it uses more than this number of MB after a song.',
+    default=0
+)
 
-mtcfskrndir = Path(args.mtcroot, 'MTC-FS-INST-2.0','krn')
-mtcannkrndir = Path(args.mtcroot, 'MTC-ANN-2.0.1','krn')
-mtclckrndir = Path(args.mtcroot, 'MTC-LC-1.0','krn')
+### QUEUE
+parser.add_argument(
+    '-queue',
+    type=str,
+    help='SQLite database (on a shared filesystem) with a work queue. Any number of workers on any host can process a collection together.',
+    default=''
+)
+parser.add_argument(
+    '-batchsize',
+    type=int,
+    help='Number of songs a worker claims from the queue at once.',
+    default=50
+)
+parser.add_argument(
+    '-leaseseconds',
+    type=int,
+    help='Time in seconds a worker may take to process a claimed batch before the songs are given to another worker.',
+    default=1800
+)
+parser.add_argument(
+    '-requeuefailed',
+    help='Put the failed songs in the queue back in the queue.',
+    default=False,
+    action='store_true'
+)
+parser.add_argument(
+    '-queuestatus',
+    help='Print the number of pending, leased, done and failed songs in the queue and exit.',
+    default=False,
+    action='store_true'
+)
 
-essenroot = Path(args.essenroot)
-essenkrndir = Path(args.essenroot, 'krn')
-essenmetadatapath = Path(args.essenroot, 'metadata.csv')
+### SHARDED OUTPUT
+parser.add_argument(
+    '-shards',
+    help='For the collections that write one .json file per song: write the sequences to compressed .jsonl.gz shards in outputpath, with a manifest per run. A run of the whole collection replaces the shards of earlier runs; runs with -missing, -startat, -stopat or -only add shards.',
+    default=False,
+    action='store_true'
+)
+parser.add_argument(
+    '-shardsize',
+    type=int,
+    help='Maximum size of a shard in MB (compressed).',
+    default=256
+)
+parser.add_argument(
+    '-compressthreads',
+    type=int,
+    help='Number of threads that compress the shards.',
+    default=4
+)
 
-choraleroot = Path(args.choraleroot)
-choralekrndir = Path(args.choraleroot, 'allkrn')
-choralemetadatapath = Path(args.choraleroot, 'metadata.csv')
+### PARQUET OUTPUT
+parser.add_argument(
+    '-parquet',
+    help='Write the sequences of a collection to one Parquet file (needs pyarrow) instead of .json or .jsonl files. Every feature is a list column.',
+    default=False,
+    action='store_true'
+)
+parser.add_argument(
+    '-rowgroupsize',
+    type=int,
+    help='Number of songs per row group in the Parquet file.',
+    default=1000
+)
 
-thesessionroot = Path(args.thesessionroot)
-thesessionkrndir = Path(args.thesessionroot, 'krn_mono_withkey')
-thesessionmeatadatapath = Path(args.thesessionroot, 'ses_id2title.csv')
+### BINARY FEATURE STORE
+parser.add_argument(
+    '-store',
+    help='Write the sequences of a collection to a binary feature store (a .mtcstore directory, see featurestore.py) instead of .json or .jsonl files.',
+    default=False,
+    action='store_true'
+)
+
+### FEATURES
+parser.add_argument(
+    '-features',
+    type=str,
+    help='Comma separated list of the features to compute (default: all). Features that are not requested, but needed by requested features, are computed but not written.',
+    default=''
+)
 
-kolbergroot = Path(args.kolbergroot)
-kolbergkrndir = Path(args.kolbergroot, 'krn')
-kolbergmeatadatapath = Path(args.kolbergroot, 'kb_id2title.csv')
+### INCREMENTAL
+parser.add_argument(
+    '-incremental',
+    help='For the collections that write one .json file per song: keep a manifest (<collection>_manifest.sqlite in outputpath) with hashes of the .krn file, metadata and text features of every song. Only extract songs that are new or changed, and remove the .json files of songs that are no longer in the collection or that fail. Not with -mtcann and -chorales. With -queue, use a new queue for every run.',
+    default=False,
+    action='store_true'
+)
+
+### FAILURES
+parser.add_argument(
+    '-failures',
+    type=str,
+    help='SQLite database with a ledger of the songs that could not be extracted (stage, exception, traceback). These songs are skipped in later runs until their .krn file or the extractor changes.',
+    default=''
+)
+parser.add_argument(
+    '-retryfailed',
+    help='With -failures: extract the songs in the ledger again.',
+    default=False,
+    action='store_true'
+)
+parser.add_argument(
+    '-failuresummary',
+    help='With -failures: print the failures by stage and exception and exit.',
+    default=False,
+    action='store_true'
+)
 
-creroot = Path(args.creroot)
-crekrndir = Path(args.creroot, 'krn_withkey')
-cremetadatapath = Path(args.creroot, 'cre_id2title.csv')
+### TIMINGS
+parser.add_argument(
+    '-timings',
+    type=str,
+    help='Write a report (json) with the wall and CPU time per stage and per feature (histograms per collection) and the slowest songs to this file.',
+    default=''
+)
+parser.add_argument(
+    '-slowest',
+    type=int,
+    help='Number of slowest songs per collection in the timing report.',
+    default=20
+)
+parser.add_argument(
+    '-profileslow',
+    type=str,
+    help='With -timings: extract the slowest songs of every collection again with cProfile and write the profiles (<collection>-<id>.prof) to this directory.',
+    default=''
+)
 
-rismroot = Path(args.rismroot)
-rismkrndir = Path(args.rismroot, 'krn')
-rismmetadatapath = Path(args.rismroot, 'metadata.csv')
+### METADATA CACHE
+parser.add_argument(
+    '-metadatacache',
+    type=str,
+    help='Directory for a cache of the joined metadata of the collections. The metadata files are only read again if they changed.',
+    default=''
+)
 
-eyckroot = Path(args.eyckroot)
-eyckkrndir = Path(args.eyckroot, 'krn')
-eyckmetadatapath = Path(args.eyckroot, 'metadata.csv')
+### MELODY CACHE
+parser.add_argument(
+    '-melodycache',
+    type=str,
+    help='Directory for a cache of parsed melodies. Unchanged .krn files are not parsed again.',
+    default=''
+)
+parser.add_argument(
+    '-melodycachesize',
+    type=int,
+    help='Maximum size of the melody cache in MB. Least recently used melodies are removed.',
+    default=2048
+)
 
-mtcfsinsttextfeatspath = Path(args.mtcfsinsttextfeatspath)
-mtcanntextfeatspath = Path(args.mtcanntextfeatspath)
+### KERN PARSER
+parser.add_argument(
+    '-fastparse',
+    help='Parse monophonic **kern with the parser in kernparser.py instead of music21. Files that it cannot handle are parsed with music21.',
+    default=False,
+    action='store_true'
+)
 
-outputpath = '' #will be overridden with Path object, below
+### IMA
+parser.add_argument(
+    '-imaengine',
+    type=str,
+    choices=['onsets2ima', 'python', 'compare'],
+    help='Compute Inner Metric Analysis weights with the onsets2ima program, or in-process with ima.py. compare: use onsets2ima and report songs for which ima.py differs.',
+    default='onsets2ima'
+)
+parser.add_argument(
+    '-imatimeout',
+    type=float,
+    help='Time in seconds onsets2ima may take for one song.',
+    default=5.0
+)
+parser.add_argument(
+    '-imaretries',
+    type=int,
+    help='Number of times onsets2ima is started again for a song after a timeout.',
+    default=0
+)
+parser.add_argument(
+    '-imaprocs',
+    type=int,
+    help='Number of songs per worker process for which onsets2ima runs at the same time: onsets2ima is started for the next songs while the features of a song are computed. Not with -songtimeout, -songmaxrss, -recycleafter and -recyclerss (one song per task).',
+    default=4
+)
+parser.add_argument(
+    '-imacache',
+    type=str,
+    help='SQLite database with a cache of IMA weights. Melodies with the same rhythm are computed once.',
+    default=''
+)
+parser.add_argument(
+    '-imacachesize',
+    type=int,
+    help='Maximum size of the IMA cache in MB. Least recently used entries are removed.',
+    default=1024
+)
 
-if args.outputpath == '':
-    #set default
-    outputpath = tempfile.gettempdir()
-    #check command line
-    if args.gen_mtcann:
-        outputpath = '.'
-    if args.gen_mtcfsinst:
-        outputpath = '.'
-    if args.gen_essen:
-        outputpath = os.path.join(essenroot, 'mtcjson')
-    if args.gen_chorales:
-        outputpath = '.'
-    if args.gen_thesession:
-        outputpath = os.path.join(thesessionroot, 'mtcjson')
-    if args.gen_kolberg:
-        outputpath = os.path.join(kolbergroot, 'mtcjson')
-    if args.gen_cre:
-        outputpath = os.path.join(creroot, 'mtcjson')
-    if args.gen_rism:
-        outputpath = os.path.join(rismroot, 'mtcjson')
-    if args.gen_eyck:
-        outputpath = os.path.join(eyckroot, 'mtcjson')
-else: #outputpath provided at command line
-    outputpath = args.outputpath
+#Options (parsed command line arguments). Set by configure().
+args = None
+
+#Set the options (args) and everything that depends on them: the paths of the
+#collections, the output path, the caches and the selected features.
+#cmdargs: list of command line arguments (e.g. ['-mtcroot', '/data/MTC']) or the result of
+#parser.parse_args(). Default: the defaults of all options.
+#Invalid options: with a list of command line arguments parser.error() (which exits),
+#otherwise ValueError.
+def configure(cmdargs=None):
+    global args
+    global mtcfsroot, mtcannroot, mtclcroot, mtcfskrndir, mtcannkrndir, mtclckrndir, mtcfsinsttextfeatspath, mtcanntextfeatspath
+    global essenroot, essenkrndir, essenmetadatapath
+    global choraleroot, choralekrndir, choralemetadatapath
+    global thesessionroot, thesessionkrndir, thesessionmeatadatapath
+    global kolbergroot, kolbergkrndir, kolbergmeatadatapath
+    global creroot, crekrndir, cremetadatapath
+    global rismroot, rismkrndir, rismmetadatapath
+    global eyckroot, eyckkrndir, eyckmetadatapath
+    global melodyCache, failureLedger, timingReport, metadataCache, imaCache
+    global outputpath
+
+    if cmdargs is None:
+        cmdargs = []
+    if isinstance(cmdargs, list):
+        cmdargs = parser.parse_args(cmdargs)
+        fail = parser.error
+    else:
+        def fail(message):
+            raise ValueError(message)
+    args = cmdargs
+
+    if args.profileslow and not args.timings:
+        fail('-profileslow needs -timings.')
+    if (args.retryfailed or args.failuresummary) and not args.failures:
+        fail('-retryfailed and -failuresummary need -failures.')
+
+    if args.shards + args.parquet + args.store > 1:
+        fail('Only one of -shards, -parquet and -store can be given.')
+    if args.incremental and (args.shards or args.parquet or args.store):
+        fail('-incremental only works with one .json file per song.')
+    if args.incremental and (args.gen_mtcann or args.gen_chorales):
+        fail('-incremental does not work with -mtcann and -chorales (one .jsonl file).')
+
+    mtcfsroot = Path(args.mtcroot, 'MTC-FS-INST-2.0')
+    mtcannroot = Path(args.mtcroot, 'MTC-ANN-2.0.1')
+    mtclcroot = Path(args.mtcroot, 'MTC-LC-1.0')
+
+    mtcfskrndir = Path(args.mtcroot, 'MTC-FS-INST-2.0','krn')
+    mtcannkrndir = Path(args.mtcroot, 'MTC-ANN-2.0.1','krn')
+    mtclckrndir = Path(args.mtcroot, 'MTC-LC-1.0','krn')
+
+    essenroot = Path(args.essenroot)
+    essenkrndir = Path(args.essenroot, 'krn')
+    essenmetadatapath = Path(args.essenroot, 'metadata.csv')
+
+    choraleroot = Path(args.choraleroot)
+    choralekrndir = Path(args.choraleroot, 'allkrn')
+    choralemetadatapath = Path(args.choraleroot, 'metadata.csv')
+
+    thesessionroot = Path(args.thesessionroot)
+    thesessionkrndir = Path(args.thesessionroot, 'krn_mono_withkey')
+    thesessionmeatadatapath = Path(args.thesessionroot, 'ses_id2title.csv')
+
+    kolbergroot = Path(args.kolbergroot)
+    kolbergkrndir = Path(args.kolbergroot, 'krn')
+    kolbergmeatadatapath = Path(args.kolbergroot, 'kb_id2title.csv')
+
+    creroot = Path(args.creroot)
+    crekrndir = Path(args.creroot, 'krn_withkey')
+    cremetadatapath = Path(args.creroot, 'cre_id2title.csv')
+
+    rismroot = Path(args.rismroot)
+    rismkrndir = Path(args.rismroot, 'krn')
+    rismmetadatapath = Path(args.rismroot, 'metadata.csv')
+
+    eyckroot = Path(args.eyckroot)
+    eyckkrndir = Path(args.eyckroot, 'krn')
+    eyckmetadatapath = Path(args.eyckroot, 'metadata.csv')
+
+    mtcfsinsttextfeatspath = Path(args.mtcfsinsttextfeatspath)
+    mtcanntextfeatspath = Path(args.mtcanntextfeatspath)
+
+    melodyCache = None
+    if args.melodycache:
+        melodyCache = MelodyCache(args.melodycache, maxbytes=args.melodycachesize*1024**2)
+
+    failureLedger = None
+    if args.failures:
+        failureLedger = FailureLedger(args.failures)
+
+    timingReport = None
+    if args.timings:
+        timingReport = TimingReport(slowest=args.slowest)
+
+    metadataCache = None
+    if args.metadatacache:
+        metadataCache = MetadataCache(args.metadatacache)
+
+    imaCache = None
+    if args.imacache:
+        imaCache = IMACache(args.imacache, maxbytes=args.imacachesize*1024**2)
+
+    outputpath = '' #will be overridden with Path object, below
+
+    if args.outputpath == '':
+        #set default
+        outputpath = tempfile.gettempdir()
+        #check command line
+        if args.gen_mtcann:
+            outputpath = '.'
+        if args.gen_mtcfsinst:
+            outputpath = '.'
+        if args.gen_essen:
+            outputpath = os.path.join(essenroot, 'mtcjson')
+        if args.gen_chorales:
+            outputpath = '.'
+        if args.gen_thesession:
+            outputpath = os.path.join(thesessionroot, 'mtcjson')
+        if args.gen_kolberg:
+            outputpath = os.path.join(kolbergroot, 'mtcjson')
+        if args.gen_cre:
+            outputpath = os.path.join(creroot, 'mtcjson')
+        if args.gen_rism:
+            outputpath = os.path.join(rismroot, 'mtcjson')
+        if args.gen_eyck:
+            outputpath = os.path.join(eyckroot, 'mtcjson')
+    else: #outputpath provided at command line
+        outputpath = args.outputpath
 
+    try:
+        featureSelection(args.features.split(',') if args.features else None)
+    except ValueError as e:
+        fail(str(e))
 
 #these are indicated as 'vocal' in MTC-FS-INST-2.0 metadata, but are NOT
 nlbids_notvocal = [
@@ -612,12 +935,6 @@ class MelodyTooShorError(Exception):
     def __str__(self):
         return repr(self.message)
 
-#onsets2ima takes too long
-class IMATimeoutError(Exception):
-    def __init__(self, message):
-        self.message = message
-    def __str__(self):
-        return repr(self.message)
 
 # add left padding to partial measure after repeat bar
 def padSplittedBars(s):
@@ -637,14 +954,39 @@ def replaceChord(s):
         n.pitch = c.pitches[-1]
     return s
 
+#Increment if the normalization in parseMelody() changes. Invalidates the melody cache.
+PARSEVERSION = 1
+
+#returns flat music21 stream, or KernMelody with -fastparse
 def parseMelody(path):
-    try:
-        s = m21.converter.parse(path)
-    except m21.converter.ConverterException:
-        raise ParseError(path)
-    #add padding to partial measure caused by repeat bar in middle of measure
-    s = padSplittedBars(s)
-    s_noties = s.stripTies()
+    if args.fastparse:
+        try:
+            return parseMelodyFast(path)
+        except KernUnsupportedError as e:
+            print(path, 'not supported by kernparser:', e)
+    #the cache contains the score after padding and stripping ties.
+    #Flattening the score before freezing would lose the measures, which are needed for the metric features.
+    s_noties = None
+    if melodyCache is not None:
+        key = melodyCache.key(path, f'{PARSEVERSION} {m21.__version__}')
+        data = melodyCache.get(key)
+        if data is not None:
+            try:
+                s_noties = m21.converter.thawStr(data)
+            except Exception as e:
+                #e.g. truncated file: parse again
+                print(path, 'corrupt entry in melody cache:', type(e).__name__, e)
+                melodyCache.discard(key)
+    if s_noties is None:
+        try:
+            s = m21.converter.parse(path)
+        except m21.converter.ConverterException:
+            raise ParseError(path)
+        #add padding to partial measure caused by repeat bar in middle of measure
+        s = padSplittedBars(s)
+        s_noties = s.stripTies()
+        if melodyCache is not None:
+            melodyCache.put(key, m21.converter.freezeStr(s_noties, fmt='pickle'))
     m = s_noties.flat
     removeGrace(m)
     replaceChord(m)
@@ -653,6 +995,17 @@ def parseMelody(path):
         raise NoNotesError("")
     return m
 
+#returns KernMelody (see kernparser.py), of which the SongContext is built without a music21
+#stream (SongContext.fromKern())
+def parseMelodyFast(path):
+    try:
+        km = parseKern(path)
+    except FileNotFoundError:
+        raise ParseError(path)
+    if len(km.notes) == 0:
+        raise NoNotesError("")
+    return km
+
 # s : flat music21 stream without ties and without grace notes
 def removeGrace(s):
     ixs = [s.index(n) for n in s.notes if n.quarterLength == 0.0]
@@ -660,147 +1013,150 @@ def removeGrace(s):
         s.pop(ix)
     return s
 
-# n: Note
+# dnn: diatonicNoteNum of the notes (array)
 # t: Pitch (tonic)
-def pitch2scaledegree(n, t):
+def pitch2scaledegree(dnn, t):
     tonicshift = t.diatonicNoteNum % 7
-    return ( n.pitch.diatonicNoteNum - tonicshift ) % 7 + 1
-
-# expect tonic in zeroth (or other very low) octave
-def pitch2scaledegreeSpecifer(n, t):
-    interval = m21.interval.Interval(noteStart=t, noteEnd=n)
-    return m21.interval.prefixSpecs[interval.specifier]
+    return ( dnn - tonicshift ) % 7 + 1
+
+#semitones of the perfect and major intervals, by number of diatonic steps (simple interval)
+perfectSemitones = {0: 0, 3: 5, 4: 7}
+majorSemitones = {1: 2, 2: 4, 5: 9, 6: 11}
+perfectSpecifiers = {0: 'P', 1: 'A', -1: 'd', 2: 'AA', -2: 'dd', 3: 'AAA', -3: 'ddd', 4: 'AAAA', -4: 'dddd'}
+majorSpecifiers = {0: 'M', -1: 'm', 1: 'A', -2: 'd', 2: 'AA', -3: 'dd', 3: 'AAA', -4: 'ddd', 4: 'AAAA', -5: 'dddd'}
+
+# dnn, midi: diatonicNoteNum and midi of the pitch
+# tdnn, tmidi: diatonicNoteNum and midi of the tonic, in zeroth (or other very low) octave
+# returns the specifier of the interval from the tonic to the pitch, as
+# music21.interval.prefixSpecs[Interval(pitchStart=tonic, pitchEnd=pitch).specifier]
+def pitch2scaledegreeSpecifer(dnn, midi, tdnn, tmidi):
+    steps = dnn - tdnn
+    semitones = midi - tmidi
+    if steps < 0: #descending: the quality of the ascending interval
+        steps, semitones = -steps, -semitones
+    semitones -= 12 * (steps // 7)
+    steps = steps % 7
+    if steps in perfectSemitones:
+        return perfectSpecifiers[semitones - perfectSemitones[steps]]
+    return majorSpecifiers[semitones - majorSemitones[steps]]
 
 # Tonic in 0-octave has value 0
-def pitch2diatonicPitch(n, t):
+def pitch2diatonicPitch(dnn, t):
     tonicshift = t.diatonicNoteNum % 7
     if tonicshift == 0:
         tonicshift = 7
-    return ( n.pitch.diatonicNoteNum - tonicshift )
+    return ( dnn - tonicshift )
 
+# midi: midi pitches of the notes (array)
 # Tonic in 0-octave has value 0
-def pitch2diatonicPitch12(n, t):
-    tonicshift = t.pitch.midi % 12
-    return ( n.pitch.midi - tonicshift )
+def pitch2diatonicPitch12(midi, t):
+    tonicshift = t.midi % 12
+    return ( midi - tonicshift )
 
+# name: pitch name of the note, e.g. 'E-'
 # Tonic in 0-octave has value 0
-def pitch2diatonicPitch40(n, t):
-    tonicshift = pitch2base40_sapp[t.pitch.name]
-    return ( pitch2base40_sapp[n.pitch.name] + 40*n.octave - tonicshift)
+def pitch2diatonicPitch40(name, octave, t):
+    tonicshift = pitch2base40_sapp[t.name]
+    return ( pitch2base40_sapp[name] + 40*octave - tonicshift)
 
-# s : flat music21 stream without ties and without grace notes
-def hasmeter(s):
-    #no time signature at all
-    if not s.getElementsByClass('TimeSignature'): return False
-    #maybe it is an Essen song with Mixed meter.
-    #---> that has meter!
-    #mixedmetercomments = [c.comment for c in s.getElementsByClass('GlobalComment') if c.comment.startswith('Mixed meters:')]
-    #if len(mixedmetercomments) > 0:
-    #    return False
-    return True
-
-def notes2metriccontour(n1, n2):
-    if n1.beatStrength > n2.beatStrength: return '-'
-    if n1.beatStrength < n2.beatStrength: return '+'
+# sc : SongContext
+def hasmeter(sc):
+    return sc.hasmeter
+
+def notes2metriccontour(beatstrength1, beatstrength2):
+    if beatstrength1 > beatstrength2: return '-'
+    if beatstrength1 < beatstrength2: return '+'
     return '='
 
-# s : flat music21 stream without ties and without grace notes
-def m21TObeatstrength(s):
-    if not hasmeter(s):
+# sc : SongContext
+def m21TObeatstrength(sc):
+    if not hasmeter(sc):
         raise NoMeterError("No Meter")
-    return [n.beatStrength for n in s.notes]
+    return sc.beatstrength.tolist()
  
-# s : flat music21 stream without ties and without grace notes
-def m21TOmetriccontour(s):
-    if not hasmeter(s):
+# sc : SongContext
+def m21TOmetriccontour(sc):
+    if not hasmeter(sc):
         raise NoMeterError("No Meter")
-    metriccontour = [notes2metriccontour(x[0], x[1]) for x in zip(s.notes,s.notes[1:])]
+    metriccontour = [notes2metriccontour(x[0], x[1]) for x in zip(sc.beatstrength,sc.beatstrength[1:])]
     metriccontour.insert(0,None)
     return metriccontour
 
-def getTonic(s):
-    tonics = list(s.flat.getElementsByClass('Key'))
-    if len(tonics) == 0:
-        raise NoKeyError(str(s.metadata.filePath))
-    else:
-        tonic = s.flat.getElementsByClass('Key')[0].tonic
-    return tonic
+def getTonic(sc):
+    if sc.tonic is None:
+        raise NoKeyError(sc.filePath)
+    return sc.tonic
 
-# s : flat music21 stream without ties and without grace notes
-def m21TOscaledegrees(s):
+# sc : SongContext
+def m21TOscaledegrees(sc):
     try:
-        tonic = getTonic(s)
+        tonic = getTonic(sc)
     except NoKeyError as e:
         print("No Key in ", e)
-        return [None for x in s.notes]
-    scaledegrees = [pitch2scaledegree(x, tonic) for x in s.notes]
-    return scaledegrees
+        return [None] * sc.n_notes
+    return pitch2scaledegree(sc.diatonicNoteNum, tonic).tolist()
 
-# s : flat music21 stream without ties and without grace notes
-def m21TOChromaticScaleDegree(s):
+# sc : SongContext
+def m21TOChromaticScaleDegree(sc):
     try:
-        tonic = getTonic(s)
+        tonic = getTonic(sc)
     except NoKeyError as e:
         print("No Key in ", e)
-        return [None for x in s.notes]
+        return [None] * sc.n_notes
     miditonic = tonic.midi % 12
-    scaledegrees12 = [(n.pitch.midi - miditonic) % 12 + 1 for n in s.notes]
-    return scaledegrees12
+    return ((sc.midi - miditonic) % 12 + 1).tolist()
 
-# s : flat music21 stream without ties and without grace notes
+# sc : SongContext
 # output: M: major, m: minor, P: perfect, A: augmented, d: diminished
-def m21TOscaleSpecifiers(s):
+def m21TOscaleSpecifiers(sc):
     try:
-        tonic = getTonic(s)
+        tonic = getTonic(sc)
     except NoKeyError as e:
         print("No Key in ", e)
-        return [None for x in s.notes]
-    #put A COPY of the tonic in 0th octave
-    lowtonic = m21.note.Note(tonic.name)
-    lowtonic.octave = 0
-    return [pitch2scaledegreeSpecifer(x, lowtonic) for x in s.notes] 
+        return [None] * sc.n_notes
+    #the tonic in 0th octave
+    tdnn = (tonic.diatonicNoteNum - 1) % 7 + 1
+    tmidi = tonic.midi - 12 * ((tonic.diatonicNoteNum - 1) // 7)
+    return [pitch2scaledegreeSpecifer(dnn, midi, tdnn, tmidi) for dnn, midi in zip(sc.diatonicNoteNum.tolist(), sc.midi.tolist())]
 
-# s : flat music21 stream without ties and without grace notes
+# sc : SongContext
 # Tonic in 0-octave has value 0
-def m21TOdiatonicPitches(s):
+def m21TOdiatonicPitches(sc):
     try:
-        tonic = getTonic(s)
+        tonic = getTonic(sc)
     except NoKeyError as e:
         print("No Key in ", e)
-        return [None for x in s.notes]
-    scaledegrees = [pitch2diatonicPitch(x, tonic) for x in s.notes]
-    return scaledegrees
+        return [None] * sc.n_notes
+    return pitch2diatonicPitch(sc.diatonicNoteNum, tonic).tolist()
 
-# s : flat music21 stream without ties and without grace notes
+# sc : SongContext
 # Tonic in 0-octave has value 0
-def m21TOdiatonicPitches12(s):
+def m21TOdiatonicPitches12(sc):
     try:
-        tonic = getTonic(s)
+        tonic = getTonic(sc)
     except NoKeyError as e:
         print("No Key in ", e)
-        return [None for x in s.notes]
-    scaledegrees = [pitch2diatonicPitch12(x, tonic) for x in s.notes]
-    return scaledegrees
+        return [None] * sc.n_notes
+    return pitch2diatonicPitch12(sc.midi, tonic).tolist()
 
-# s : flat music21 stream without ties and without grace notes
+# sc : SongContext
 # Tonic in 0-octave has value 0
-def m21TOdiatonicPitches40(s):
+def m21TOdiatonicPitches40(sc):
     try:
-        tonic = getTonic(s)
+        tonic = getTonic(sc)
     except NoKeyError as e:
         print("No Key in ", e)
-        return [None for x in s.notes]
-    scaledegrees = [pitch2diatonicPitch40(x, tonic) for x in s.notes]
-    return scaledegrees
+        return [None] * sc.n_notes
+    return [pitch2diatonicPitch40(name, int(octave), tonic) for name, octave in zip(sc.name, sc.octave)]
 
 
-# s : flat music21 stream without ties and without grace notes
-def toDiatonicIntervals(s):
-    return [None] + [n[1].pitch.diatonicNoteNum - n[0].pitch.diatonicNoteNum for n in zip(s.notes, s.notes[1:]) ]
+# sc : SongContext
+def toDiatonicIntervals(sc):
+    return [None] + np.diff(sc.diatonicNoteNum).tolist()
 
-# s : flat music21 stream without ties and without grace notes
-def toChromaticIntervals(s):
-    return [None] + [n[1].pitch.midi - n[0].pitch.midi for n in zip(s.notes, s.notes[1:]) ]
+# sc : SongContext
+def toChromaticIntervals(sc):
+    return [None] + np.diff(sc.midi).tolist()
 
 # compute expectancy of the note modelled with pitch proximity (Schellenberg, 1997)
 def getPitchProximity(chromaticinterval):
@@ -828,246 +1184,118 @@ def getOnePitchReversal(implicative, realized):
 def getPitchReversal(chromaticinterval):
     return [None, None] + [getOnePitchReversal(i, r) for i,r in zip(chromaticinterval[1:], chromaticinterval[2:])] 
 
+#values where mask is True, None elsewhere
+def masked2list(values, mask):
+    return [v if m else None for v, m in zip(values.tolist(), mask.tolist())]
+
 #compute boundary strength for the potential boundary FOLLOWING the note. Take durations from input
 #duration of the rest following the note (normalized; whole note is 1.0) and maximized (1.0).
-def getFranklandGPR2a(restduration):
-    return [ min(1.0, float(Fraction(r) / 4.0)) if r is not None else None for r in restduration]
-
-def getOneFranklandGPR2b(n1,n2,n3,n4):
-    return ( 1.0 - (float(n1+n3)/(2.0*n2)) ) if (n2>n3) and (n2>n1) else None
+#restafter: duration of the rest following the note (array, 0.0 if no rest follows)
+def getFranklandGPR2a(restafter):
+    restafter = np.asarray(restafter, dtype=float)
+    return masked2list(np.minimum(1.0, restafter / 4.0), restafter > 0)
 
 #compute boundary strength for the potential boundary FOLLOWING the note.
 #For the rule to apply, n2 must be longer than both n1 and n3. In addition
 #n1 through n4 must be notes (not rests)
-def getFranklandGPR2b(lengths, restdurations):
+#lengths: durations of the notes (array)
+#restafter: duration of the rest following the note (array, 0.0 if no rest follows)
+def getFranklandGPR2b(lengths, restafter):
     #only applicable to melodies of length > 4
     if len(lengths) < 4:
         return [None] * len(lengths)
-    quads = zip(lengths,lengths[1:],lengths[2:],lengths[3:])
-    res =  [None] + [getOneFranklandGPR2b(n1, n2, n3, n4) for n1, n2, n3, n4 in quads] + [None, None]
-    
-    #check conditions (Frankland 2004, p.505): no rests in between, n2>n1 and n2>n3 (in getOneFranklandGPR2b())
-    #rest_maks: positions with False result in None in res
-    rest_present = [Fraction(r)>Fraction(0) if r is not None else False for r in restdurations]
-    triple_rest_present = zip(rest_present,rest_present[1:],rest_present[2:])
-    rest_mask = [False] + [not (r1 or r2 or r3) for r1, r2, r3 in triple_rest_present] + [False]
-    #now set all values in res to None if False in mask
-    res = [res[ix] if rest_mask[ix] else None for ix in range(len(res))]
-    return res
-    
-
-def getOneFranklandGPR3a(n1, n2, n3, n4):
-    if n2 != n3 and abs(n2-n3) > abs(n1-n2) and abs(n2-n3) > abs(n3-n4):
-        return 1.0 - ( float(abs(n1-n2)+abs(n3-n4)) / float(2.0 * abs(n2-n3)) )
-    else:
-        return None
+    lengths = np.asarray(lengths, dtype=float)
+    n1, n2, n3 = lengths[:-3], lengths[1:-2], lengths[2:-1]
+    res = np.zeros(len(lengths))
+    mask = np.zeros(len(lengths), dtype=bool)
+    res[1:-2] = 1.0 - (n1+n3) / (2.0*n2)
+    mask[1:-2] = (n2>n3) & (n2>n1)
+
+    #check conditions (Frankland 2004, p.505): no rests in between, n2>n1 and n2>n3
+    rest_present = np.asarray(restafter, dtype=float) > 0
+    mask[1:-1] &= ~(rest_present[:-2] | rest_present[1:-1] | rest_present[2:])
+    return masked2list(res, mask)
 
 #The rule applies only if the transition from n2 to n3 is greater than from n1 to n2
 #and from n3 to n4. In addition, the transition from n2 to n3 must be nonzero
+#midipitch: array
 def getFranklandGPR3a(midipitch):
     #only applicable to melodies of length > 4
     if len(midipitch) < 4:
         return [None] * len(midipitch)
-    quads = zip(midipitch,midipitch[1:],midipitch[2:],midipitch[3:])
-    return  [None] + [getOneFranklandGPR3a(n1, n2, n3, n4) for n1, n2, n3, n4 in quads] + [None, None]
-
-def getOneFranklandGPR3d(n1,n2,n3, n4):
-    if n1 != n2 or n3 != n4:
-        return None
-    if n3 > n1:
-        return 1.0 - (float(n1)/float(n3))
-    else:
-        return 1.0 - (float(n3)/float(n1))
+    intervals = np.abs(np.diff(np.asarray(midipitch, dtype=float)))
+    i12, i23, i34 = intervals[:-2], intervals[1:-1], intervals[2:]
+    res = np.zeros(len(midipitch))
+    mask = np.zeros(len(midipitch), dtype=bool)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        res[1:-2] = 1.0 - ( (i12 + i34) / (2.0 * i23) )
+    mask[1:-2] = (i23 != 0) & (i23 > i12) & (i23 > i34)
+    return masked2list(res, mask)
 
 #... to apply, the length of n1 must equal n2, and the length of n3 must euqal n4
+#lengths: array, nan for unknown lengths
 def getFranklandGPR3d(lengths):
     #only applicable to melodies of length > 4
     if len(lengths) < 4:
         return [None] * len(lengths)
-    quads = zip(lengths,lengths[1:],lengths[2:],lengths[3:])
-    return [None] + [getOneFranklandGPR3d(n1, n2, n3, n4) for n1, n2, n3, n4 in quads] + [None, None]
-    #condition checking in getOneFranklandGRP3d()
-
-#For LBDM parameters:
-#Take interval AFTER note
-#r1 is degree of change of interval AFTER the note
-#compute boundary strength of interval FOLLOWING note
-#note:       n0    n1    n2    n3    n4    n5
-#            |  \  |  \  |  \  |  \  |  \
-#interval    i0    i1    i2    i3    i4    i5
-#            |  \  |  \  |  \  |  \  |  \  | 
-#change      None  r1    r2    r3    r4    r5
-#                  |  /  |  /  |  /  |  /  |  /
-#strength    None  s1    s2    s3    s4    s5
-#
-#  s1 is computed from r1 and r2
-#  s2 is computed from r2 and r3
-# etc.
-
-def getOneDegreeChange(x1, x2, const_add=0.0):
-    res = None
-    x1 += const_add
-    x2 += const_add
-    if x1 == x2: return 0.0
-    if (x1+x2) != 0 and x1 >= 0 and x2 >= 0:
-        res = float(abs(x1-x2)) / float (x1 + x2)
-    return res
-
-#Cambouropoulos 2001
-def getDegreeChangeLBDMpitch(chromaticinterval, threshold=12, const_add=1):
-    #for lbdm we need at least 3 notes
-    if len(chromaticinterval) < 3:
-        return [None] * len(chromaticinterval)
-    # we need absolute values
-    # and thr_int <= threshold
-    # and shift such that chormaticinterval is interval FOLLOWING note
-    thr_int = [min(threshold,abs(i)) for i in chromaticinterval[1:]] + [None] 
-    pairs = zip(thr_int[:-1],thr_int[1:-1])
-    rpitch = [None] + [getOneDegreeChange(x1, x2, const_add=const_add) for x1, x2 in pairs] + [None]
-    return rpitch
-
-#Cambouropoulos 2001
-#default threshold: whole note (4.0 quarterLength)
-def getDegreeChangeLBDMioi(ioi, threshold=4.0):
-    #for lbdm we need at least 3 notes
-    if len(ioi) < 3:
-        return [None] * len(ioi)
-    #We need IOI AFTER the note, and we need maximize the value
-    thr_ioi = [min(threshold,i) for i in ioi[:-1]] + [None]
-    pairs = zip(thr_ioi[:-1],thr_ioi[1:-1])
-    rioi = [None] + [getOneDegreeChange(x1, x2) for x1, x2 in pairs ] + [None]
-    return rioi
-    
-#Cambouropoulos 2001
-def getDegreeChangeLBDMrest(restduration_frac, threshold=4.0):
-    #for lbdm we need at least 3 notes
-    if len(restduration_frac) < 3:
-        return [None] * len(restduration_frac)
-    #need rest AFTER note, and apply threshold
-    thr_rd = [min(threshold, float(Fraction(r))) if r is not None else 0.0 for r in restduration_frac[:-1]] + [None]
-    pairs = zip(thr_rd[:-1], thr_rd[1:-1])
-    rrest = [None] + [getOneDegreeChange(x1, x2) for x1, x2 in pairs] + [None]
-    return rrest
-
-#Boundary strength AFTER the note
-def getBoundaryStrength(rs, intervals):
-    #print(list(zip(rs, intervals)))
-    pairs = zip(rs[1:-1], rs[2:-1], intervals[1:])
-    strength = [ c * (r1 + r2) for r1, r2, c in pairs]
-    #very shor melodies:
-    if len(strength) == 0:
-        return [None, None, None]
-    #normalize
-    maxspitch = max(strength)
-    if maxspitch > 0:
-        strength = [s / maxspitch for s in strength]
-    #Add first and last
-    strength = [None] + strength + [None, None]
-    return strength
-    
-def getBoundaryStrengthPitch(rpitch, chromaticinterval, threshold=12):
-    #for lbdm we need at least 3 notes
-    if len(chromaticinterval) < 3:
-        return [None] * len(chromaticinterval)
-    # we need absolute values
-    # and thr_int <= threshold
-    # and shift such that chormaticinterval is interval FOLLOWING note
-    thr_int = [min(threshold,abs(i)) for i in chromaticinterval[1:]] + [None] 
-    return getBoundaryStrength(rpitch, thr_int)
-
-def getBoundaryStrengthIOI(rioi, ioi, threshold=4.0):
-    #for lbdm we need at least 3 notes
-    if len(ioi) < 3:
-        return [None] * len(ioi)
-    #We need IOI AFTER the note, and we need maximize the value
-    thr_ioi = [min(threshold,i) for i in ioi[:-1]] + [None]
-    return getBoundaryStrength(rioi, thr_ioi)
-
-def getBoundaryStrengthRest(rrest, restduration_frac, threshold=4.0):
-    #for lbdm we need at least 3 notes
-    if len(restduration_frac) < 3:
-        return [None] * len(restduration_frac)
-    #need rest AFTER note, and apply threshold
-    thr_rd = [min(threshold, float(Fraction(r))) if r is not None else 0.0 for r in restduration_frac[:-1]] + [None]
-    return getBoundaryStrength(rrest, thr_rd)
-
-#Cambouropoulos 2001
-#Gives strength fot boundary AFTER the note
-def getLocalBoundaryStrength(spitch, sioi, srest):
-    #for lbdm we need at least 3 notes
-    if len(spitch) < 3:
-        return [None] * len(spitch)
-    triplets = zip(spitch[1:-2], sioi[1:-2], srest[1:-2]) #remove None values at begin and end
-    strength = [0.25*p + 0.5*i + 0.25*r for p, i, r in triplets]
-    strength = [None] + strength + [None, None]
-    return strength
-
-# s : flat music21 stream without ties and without grace notes
-def m21TOPitches(s):
-    return [n.pitch.nameWithOctave for n in s.notes]
-
-# s : flat music21 stream without ties and without grace notes
-def m21TOMidiPitch(s):
-    return [n.pitch.midi for n in s.notes]
-
-# s : flat music21 stream without ties and without grace notes
-def m21TODuration(s):
-    return [float(n.duration.quarterLength) for n in s.notes]
-
-# s : flat music21 stream without ties and without grace notes
-def m21TODuration_fullname(s):
-    return [n.duration.fullName for n in s.notes]
-
-# s : flat music21 stream without ties and without grace notes
-def m21TODuration_frac(s):
-    return [str(Fraction(n.duration.quarterLength)) for n in s.notes]
+    lengths = np.asarray(lengths, dtype=float)
+    n1, n2, n3, n4 = lengths[:-3], lengths[1:-2], lengths[2:-1], lengths[3:]
+    res = np.zeros(len(lengths))
+    mask = np.zeros(len(lengths), dtype=bool)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        res[1:-2] = np.where(n3 > n1, 1.0 - (n1/n3), 1.0 - (n3/n1))
+    mask[1:-2] = (n1 == n2) & (n3 == n4)
+    return masked2list(res, mask)
+
+# sc : SongContext
+def m21TOPitches(sc):
+    return list(sc.nameWithOctave)
+
+# sc : SongContext
+def m21TOMidiPitch(sc):
+    return sc.midi.tolist()
+
+# sc : SongContext
+def m21TODuration(sc):
+    return [float(ql) for ql in sc.duration]
+
+# sc : SongContext
+def m21TODuration_fullname(sc):
+    return list(sc.fullname)
+
+#Features with fractional values are (numerators, denominators, mask), with integer arrays
+#(or scalars) and a boolean mask (or True). Use fraction_str to render them as strings.
+
+# sc : SongContext
+def m21TODuration_frac(sc):
+    return sc.ticks, sc.resolution, True
 
 def getDurationcontour(duration_frac):
-    return [None] + ['-' if Fraction(d2)<Fraction(d1) else '+' if Fraction(d2)>Fraction(d1) else '=' for d1, d2 in zip(duration_frac,duration_frac[1:])]
+    ticks = duration_frac[0]
+    sign2contour = {-1: '-', 0: '=', 1: '+'}
+    return [None] + [sign2contour[sign] for sign in np.sign(ticks[1:] - ticks[:-1]).tolist()]
 
-# s : flat music21 stream without ties and without grace notes
-def m21TONextIsRest(s):
-    notesandrests = list(s.notesAndRests)
-    nextisrest = [ nextnote.isRest for note, nextnote in zip(notesandrests, notesandrests[1:]) if note.isNote or note.isChord]
-    if notesandrests[-1].isNote or notesandrests[-1].isChord:
-        nextisrest.append(None) #final note
-    return nextisrest
+# sc : SongContext
+def m21TONextIsRest(sc):
+    return list(sc.nextisrest)
 
 #Duration of the rest(s) FOLLOWING the note
-def m21TORestDuration_frac(s):
-    restdurations = []
-    notesandrests = list(s.notesAndRests)
-    rest_duration = Fraction(0)
-    #this computes length of rests PRECEEDING the note
-    for event in notesandrests:
-        if event.isRest:
-            rest_duration += Fraction(event.duration.quarterLength)
-        if event.isNote or event.isChord:
-            if rest_duration == 0:
-                restdurations.append(None)
-            else:
-                restdurations.append(str(rest_duration))
-            rest_duration = Fraction(0)
-    #shift list and add last
-    if notesandrests[-1].isNote or notesandrests[-1].isChord:
-        restdurations = restdurations[1:] + [None]
-    else:
-        restdurations = restdurations[1:] + [str(rest_duration)]
-    return restdurations
+def m21TORestDuration_frac(sc):
+    return sc.restafter_ticks, sc.resolution, sc.restafter_ticks > 0
 
-# s : flat music21 stream without ties and without grace notes
-def m21TOTimeSignature(s):
-    if not hasmeter(s):
+# sc : SongContext
+def m21TOTimeSignature(sc):
+    if not hasmeter(sc):
         raise NoMeterError("No Meter")
-    return [n.getContextByClass('TimeSignature').ratioString for n in s.notes]
+    return [ts.ratioString for ts in sc.timesignature]
 
-def m21TOKey(s):
+def m21TOKey(sc):
     try:
-        getTonic(s)
-        keys =  [(k.tonic.name, k.mode) for k in [n.getContextByClass('Key') for n in s.notes]]
+        getTonic(sc)
+        keys =  [(k.tonic.name, k.mode) for k in sc.key]
     except NoKeyError as e:
         print("No Key in ", e)
-        keys = [(None, None) for n in s.notes]
+        keys = [(None, None)] * sc.n_notes
     return list(zip(*keys))
 
 # "4" -> ('4', '0')
@@ -1078,101 +1306,91 @@ def beatStrTOtuple(bstr):
         bstr_splitted.append('0')
     return bstr_splitted[0], bstr_splitted[1]
 
-# s : flat music21 stream without ties and without grace notes
-def m21TOBeat_str(s):
-    if not hasmeter(s):
+# sc : SongContext
+def m21TOBeat_str(sc):
+    if not hasmeter(sc):
         raise NoMeterError("No Meter")
     beats = []
     beat_fractions = []
-    for n in s.notes:
-        try:
-            b, bfr = beatStrTOtuple(n.beatStr)
-        except m21.base.Music21ObjectException: #no time signature
-            b, bfr = '0', '0'
+    for beatstr in sc.beatstr:
+        b, bfr = beatStrTOtuple(beatstr)
         beats.append(b)
         beat_fractions.append(bfr)
     return beats, beat_fractions
 
-# s : flat music21 stream without ties and without grace notes
-def m21TOBeat_float(s):
-    if not hasmeter(s):
+# sc : SongContext
+def m21TOBeat_float(sc):
+    if not hasmeter(sc):
         raise NoMeterError("No Meter")
-    beats = []
-    for n in s.notes:
-        try:
-            beat_float = float(n.beat)
-        except m21.base.Music21ObjectException: #no time signature
-            beat_float = 0.0
-        beats.append(beat_float)
-    return beats
+    return [float(beat) for beat in sc.beat]
 
-# s : flat music21 stream without ties and without grace notes, and with left padding for partial measures
+# sc : SongContext, of a stream with left padding for partial measures
 # caveat: upbeat before meter change is interpreted in context of old meter.
 # origin is first downbeat in each phrase
-def m21TOBeatInSongANDPhrase(s, phrasepos):
-    if not hasmeter(s):
+# returns beatinsong, beatinphrase, beatfraction as fractional features with a common denominator
+def m21TOBeatInSongANDPhrase(sc, phrasepos):
+    if not hasmeter(sc):
         raise NoMeterError("No Meter")
-    phrasestart_ixs = [ix+1 for ix, pp in enumerate(zip(phrasepos,phrasepos[1:])) if pp[1] < pp[0] ]
-    #print(phrasestart_ixs)
-    startbeat = Fraction(s.notesAndRests[0].beat)
-    if startbeat != Fraction(1):  #upbeat
-        startbeat = Fraction(-1 * s.notesAndRests[0].getContextByClass('TimeSignature').beatCount) + startbeat
-    startbeat = startbeat - Fraction(1) #shift origin to first first (no typo) beat in measure
-    #print('startbeat', startbeat)
-    #beatfraction: length of the note with length of the beat as unit
-    beatinsong, beatinphrase, beatfraction = [], [], []
-    n_first = s.notesAndRests[0]
-    if n_first.isNote or n_first.isChord:
-        beatinsong.append(startbeat)
-        beatinphrase.append(startbeat)
-        duration_beatfraction = Fraction(n_first.duration.quarterLength) / Fraction(n_first.beatDuration.quarterLength)
-        beatfraction.append(duration_beatfraction) # add first note here, use nextnote in loop
-    cumsum_beat_song = startbeat
-    cumsum_beat_phrase = startbeat
-    note_ix = 0
-    notesandrests = list(s.notesAndRests)
-    for n, nextnote in zip(notesandrests, notesandrests[1:]):
-        #print("--------------")
-        #print(n)
-        duration_beatfraction = Fraction(n.duration.quarterLength) / Fraction(n.beatDuration.quarterLength)
-        cumsum_beat_song += duration_beatfraction
-        cumsum_beat_phrase += duration_beatfraction
-        #print(cumsum_beat_song)
-        if n.isNote or n.isChord:
-            if note_ix in phrasestart_ixs:
-                cumsum_beat_phrase = Fraction(n.beat)
-                #print('beat ', cumsum_beat_phrase)
-                if cumsum_beat_phrase != Fraction(1): #upbeat
-                    cumsum_beat_phrase = Fraction(-1 * n.getContextByClass('TimeSignature').beatCount) + cumsum_beat_phrase
-                cumsum_beat_phrase = cumsum_beat_phrase - Fraction(1)
-                #print(note_ix, n, cumsum_beat_phrase)
-                beatinphrase[-1] = cumsum_beat_phrase
-                cumsum_beat_phrase += duration_beatfraction
-            #print(f'{n}, beat: {Fraction(n.beat)}, fraction: {duration_beatfraction}')
-            #print("note: ", cumsum_beat_song)
-            note_ix += 1
-        if nextnote.isNote or nextnote.isChord:
-            beatinphrase.append(cumsum_beat_phrase)
-            beatinsong.append(cumsum_beat_song)
-            duration_beatfraction = Fraction(nextnote.duration.quarterLength) / Fraction(nextnote.beatDuration.quarterLength)
-            beatfraction.append(duration_beatfraction)
-    beatinsong = [str(f) for f in beatinsong] #string representation to make it JSON serializable
-    beatinphrase = [str(f) for f in beatinphrase] #string representation to make it JSON serializable
-    beatfraction = [str(f) for f in beatfraction] #string representation to make it JSON serializable
-    return beatinsong, beatinphrase, beatfraction
+    n_events = len(sc.ev_isnote)
+    phrasestart_ixs = set(ix+1 for ix, pp in enumerate(zip(phrasepos,phrasepos[1:])) if pp[1] < pp[0])
+    #position of the first beat in the measure with the given beat as origin
+    def beatOrigin(ix):
+        beat = Fraction(sc.ev_beat[ix])
+        if beat != Fraction(1): #upbeat
+            beat = Fraction(-1 * sc.ev_timesignature[ix].beatCount) + beat
+        return beat - Fraction(1) #shift origin to first first (no typo) beat in measure
+    #The beat position of a phrase is reset at the first note of the phrase (not for the last event)
+    resets = {ix: beatOrigin(ix) for ix in sc.note_ixs[sorted(phrasestart_ixs)].tolist() if ix < n_events - 1}
+    startbeat = beatOrigin(0)
+    #beatfraction: length of the event with length of the beat as unit.
+    #Not needed for the last event if that is a rest.
+    n_used = n_events if sc.ev_isnote[-1] else n_events - 1
+    beatdurations = {}
+    for bd in sc.ev_beatduration[:n_used]:
+        if bd not in beatdurations:
+            beatdurations[bd] = Fraction(bd)
+            if beatdurations[bd] == 0:
+                raise ZeroDivisionError('Beat duration 0')
+    #common denominator of all values
+    denominator = 1
+    for bd in beatdurations.values():
+        denominator = lcm(denominator, sc.resolution * bd.numerator)
+    for beat in [startbeat] + list(resets.values()):
+        denominator = lcm(denominator, beat.denominator)
+    #ticks / resolution / (bd.numerator / bd.denominator) = ticks * (denominator * bd.denominator / (resolution * bd.numerator)) / denominator
+    factors = {bd: denominator * f.denominator // (sc.resolution * f.numerator) for bd, f in beatdurations.items()}
+    beatfraction = np.zeros(n_events, dtype=np.int64)
+    beatfraction[:n_used] = sc.ev_ticks[:n_used] * np.array([factors[bd] for bd in sc.ev_beatduration[:n_used]], dtype=np.int64)
+    #beat position of each event: cumulative sum of the preceding beat fractions
+    cumbeat = np.concatenate(([0], np.cumsum(beatfraction)[:-1]))
+    startnum = startbeat.numerator * (denominator // startbeat.denominator)
+    beatinsong = startnum + cumbeat
+    #within the phrase: relative to the last reset
+    origin = np.full(n_events, startnum)
+    reset_ixs = np.full(n_events, -1)
+    for ix, beat in resets.items():
+        origin[ix] = beat.numerator * (denominator // beat.denominator) - cumbeat[ix]
+        reset_ixs[ix] = ix
+    reset_ixs = np.maximum.accumulate(reset_ixs)
+    beatinphrase = np.where(reset_ixs >= 0, origin[np.maximum(reset_ixs, 0)] + cumbeat, beatinsong)
+    note_ixs = sc.note_ixs
+    return (
+        (beatinsong[note_ixs], denominator, True),
+        (beatinphrase[note_ixs], denominator, True),
+        (beatfraction[note_ixs], denominator, True),
+    )
 
 #origin is onset of last! beat in each phrase
 #TODO: what if note on last beat is tied with previous? Syncope.
 def getBeatinphrase_end(beatinphrase, phrase_ix, beat):
-    #find offset per phrase
-    beatinphrase_end = []
-    origin = defaultdict(lambda: 0.0)
-    for ix in range(len(beatinphrase)):
-        if abs(beat[ix] - 1.0) < epsilon:
-            origin[phrase_ix[ix]] = Fraction(beatinphrase[ix])
-    for ix in range(len(beatinphrase)):
-        beatinphrase_end.append( Fraction(beatinphrase[ix]) - Fraction(origin[phrase_ix[ix]]) )
-    return [str(f) for f in beatinphrase_end]
+    numerators, denominator, mask = beatinphrase
+    phrase_ix = np.asarray(phrase_ix)
+    #find offset per phrase: last note on the first beat
+    onfirstbeat = np.flatnonzero(np.abs(np.asarray(beat, dtype=float) - 1.0) < epsilon)
+    origin_ixs = np.full(phrase_ix.max() + 1, -1)
+    np.maximum.at(origin_ixs, phrase_ix[onfirstbeat], onfirstbeat)
+    origin = np.where(origin_ixs >= 0, numerators[np.maximum(origin_ixs, 0)], 0)
+    return numerators - origin[phrase_ix], denominator, mask
 
 def value2contour(ima1, ima2):
     if ima1 > ima2: return '-'
@@ -1185,67 +1403,89 @@ def getFromJson(nlbid, path, feature, totype=int):
     featvals = [totype(x[feature]) for x in song[nlbid]['symbols']]
     return featvals
 
-def getIMA(s, onsets):
-    """returns IMA and IMASPECT weights. Commandline onsets2ima must be installed."""
-    s = s.stripTies()
-
-    # with subprocess.Popen(["onsets2ima","-onsets"] + [str(o) for o in onsets], stdout=subprocess.PIPE) as proc:
-    #     output = proc.stdout.read().decode('ascii')
-
-    proc = subprocess.Popen(["onsets2ima","-onsets"] + [str(o) for o in onsets], stdout=subprocess.PIPE)
+#Increment if the IMA weights of an engine change (ima.py, or the way onsets2ima is run).
+#Part of the key in the IMA cache.
+IMAVERSION = 1
+
+def getIMA(onsets):
+    """returns IMA and IMASPECT weights, computed with the engine given by -imaengine."""
+    return submitIMA(onsets).result()
+
+def submitIMA(onsets):
+    """Starts the computation of the IMA and IMASPECT weights. Returns a Future.
+    With onsets2ima, other features can be computed while it runs."""
+    #no cache for compare: both engines have to run
+    if imaCache is not None and args.imaengine != 'compare':
+        key = imaCache.key(onsets, f'{args.imaengine} {IMAVERSION}')
+        res = imaCache.get(key)
+        if res is not None:
+            return completedFuture(lambda: res)
+        def putIMA(future):
+            if future.exception() is None:
+                imaCache.put(key, *future.result())
+    else:
+        putIMA = None
+    if args.imaengine == 'python':
+        future = completedFuture(getIMA_python, onsets)
+    else:
+        future = getIMAExecutor().submit(onsets)
+    if args.imaengine == 'compare':
+        res = future.result()
+        if getIMA_python(onsets) != res:
+            print("IMA engines differ for onsets:", ' '.join(str(o) for o in onsets))
+    if putIMA is not None:
+        future.add_done_callback(putIMA)
+    return future
+
+#Future with the result (or exception) of func(*args)
+def completedFuture(func, *args):
+    future = concurrent.futures.Future()
     try:
-        outs, errs = proc.communicate(timeout=5)
-    except TimeoutExpired:
-        proc.kill()
-        raise IMATimeoutError
-    output = outs.decode('ascii')
-
-    ima_str = output.split('\n')[0].strip()
-    ima_spect_str = output.split('\n')[1].strip()
-
-    ima = [float(w) for w in ima_str.split(' ')]
-    ima_spect = [float(w) for w in ima_spect_str.split(' ')]
-
-    #if onset of first note != 0 (start with rest), add zeros to ima_spect
-    ima_spect = [0.0]*onsets[0] + ima_spect
+        future.set_result(func(*args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
 
-    ima_spect = [ima_spect[o] for o in onsets]
+def getIMA_python(onsets):
+    """returns IMA and IMASPECT weights computed in ima.py"""
+    meters = localMeters(onsets)
+    return imaweight(onsets, meters=meters), imaweight_spectral(onsets, meters=meters)
 
-    return ima, ima_spect
+def getIMAExecutor():
+    """returns executor for onsets2ima. Commandline onsets2ima must be installed."""
+    return getExecutor(maxprocs=args.imaprocs, timeout=args.imatimeout, retries=args.imaretries)
 
-def getPhraseInfo(s):
-    lineoffsets = [Fraction(0,1)]
-    for cmt in s.flat.getElementsByClass(m21.humdrum.spineParser.GlobalComment):
-        if cmt.offset > 1e-4: #first already added
-            if "segment" in cmt.comment or "linebreak:original" in cmt.comment:
-                lineoffsets.append(Fraction(cmt.offset))
-    lineends = lineoffsets[1:] + [Fraction(s.flat.notesAndRests.last().offset) + Fraction(s.flat.notesAndRests.last().quarterLength)]
+# sc : SongContext
+def getPhraseInfo(sc):
+    lineoffsets = sc.lineoffsets
+    lineends = lineoffsets[1:] + [Fraction(sc.ev_offset[-1]) + Fraction(sc.ev_quarterLength[-1])]
 
     offsetsfinalnotes = []
     for ix, off in enumerate(lineends):
-        n = s.flat.notes.stream().getElementBeforeOffset(off)
-        if n == None: #There is no Note. Probably a first phrase with only rests...
+        #last note that starts before the end of the line
+        n_ix = bisect_left(sc.offset, off) - 1
+        if n_ix < 0: #There is no Note. Probably a first phrase with only rests...
             offsetsfinalnotes.append(lineoffsets[ix]) #add start of phrase. Results in phrase of length 0.
         else:
-            offsetsfinalnotes.append(Fraction(n.offset)) 
+            offsetsfinalnotes.append(Fraction(sc.offset[n_ix]))
 
     phraselengths = [offsetsfinalnotes[i] - lineoffsets[i] for i in range(len(lineoffsets))]
 
     phraseixs = []
     curphr = 0
-    for n in s.flat.notes:
-        if n.offset>=lineends[curphr]:
+    for offset in sc.offset:
+        if offset>=lineends[curphr]:
             curphr += 1
         phraseixs.append(curphr)
 
     phrasepos = []
-    for ix, n in enumerate(s.flat.notes):
+    for ix, offset in enumerate(sc.offset):
         phrlen = phraselengths[phraseixs[ix]]
         if phrlen == 0:
             #What if a phrase has length 0 (if only one note is in the phrase)?
             phroffset = 0.0
         else:
-            phroffset = (n.offset - lineoffsets[phraseixs[ix]]) / phraselengths[phraseixs[ix]]
+            phroffset = (offset - lineoffsets[phraseixs[ix]]) / phraselengths[phraseixs[ix]]
         phrasepos.append(float(phroffset))
 
     return phraseixs, phrasepos
@@ -1259,16 +1499,16 @@ def getPhraseEnd(phrasepos):
 
 #defined here: http://www.ccarh.org/publications/reprints/base40/
 #Cbb = 1, middle C is octave 3
-def getPitch40_Hewlett(s):
-    return [pitch2base40_hewlett[n.pitch.name] + 40*(n.octave - 1) for n in s.notes]
+def getPitch40_Hewlett(sc):
+    return [pitch2base40_hewlett[name] + 40*(octave - 1) for name, octave in zip(sc.name, sc.octave.tolist())]
 
 #defined here: https://wiki.ccarh.org/wiki/Base_40
 #Cbb = 0, middle C is octave 4
-def getPitch40_Sapp(s):
-    return [pitch2base40_sapp[n.pitch.name] + 40*(n.octave) for n in s.notes]
+def getPitch40_Sapp(sc):
+    return [pitch2base40_sapp[name] + 40*(octave) for name, octave in zip(sc.name, sc.octave.tolist())]
 
-def getOctave(s):
-    return [n.octave for n in s.notes]
+def getOctave(sc):
+    return sc.octave.tolist()
 
 def getContour3(midipitch1, midipitch2):
     if midipitch1 > midipitch2 : return '-'
@@ -1290,60 +1530,38 @@ def midipitch2contour5(mp, thresh=3, undef=None):
     return [undef] + [getContour5(p[0], p[1], thresh) for p in zip(mp,mp[1:])]
 
 def getIOR_frac(ioi_frac):
-    return [None] + [str(Fraction(ioi2)/Fraction(ioi1)) if ioi1 is not None and ioi2 is not None else None for ioi1, ioi2 in zip(ioi_frac,ioi_frac[1:])]
+    ioi, _, mask = ioi_frac
+    numerators = np.concatenate(([0], ioi[1:]))
+    denominators = np.concatenate(([1], ioi[:-1]))
+    return numerators, denominators, np.concatenate(([False], mask[1:] & mask[:-1]))
 
 def getIOR(ior_frac):
-    return [float(Fraction(i)) if i is not None else None for i in ior_frac]
+    numerators, denominators, mask = ior_frac
+    return masked2list(numerators / denominators, mask)
 
 #IOI in quarterLength
 #last note: take duration
 def getIOI(ioi_frac):
-    return [float(Fraction(i)) if i is not None else None for i in ioi_frac]
+    ticks, resolution, mask = ioi_frac
+    return masked2list(ticks / resolution, mask)
 
 #last should be none
 def getIOI_frac(duration_frac, restduration_frac):
-    res =  [str(Fraction(d)+Fraction(r)) if r is not None else str(Fraction(d)) for d, r, in zip(duration_frac[:-1], restduration_frac[:-1])]
+    ticks, resolution, _ = duration_frac
+    restticks = restduration_frac[0]
     #check last item. If no rest follows, we cannot compute IOI
-    if restduration_frac[-1] is not None:
-        res = res + [ str( Fraction(duration_frac[-1])+Fraction(restduration_frac[-1]) ) ]
-    else:
-        res = res + [None]
-    return res
+    mask = np.ones(len(ticks), dtype=bool)
+    mask[-1] = restticks[-1] > 0
+    return ticks + restticks, resolution, mask
 
-def lcm(a, b):
-    """Computes the lowest common multiple."""
-    return a * b // gcd(a, b)
-
-def fraction_gcd(x, y):
-    """Computes the greatest common divisor as Fraction"""
-    a = x.numerator
-    b = x.denominator
-    c = y.numerator
-    d = y.denominator
-    return Fraction(gcd(a, c), lcm(b, d))
-
-def getDurationUnit(s):
-    sf = s.flat.notesAndRests
-    unit = Fraction(sf[0].duration.quarterLength)
-    for n in sf:
-        unit = fraction_gcd(unit, Fraction(n.duration.quarterLength))
-    return fraction_gcd(unit, Fraction(1,1)) # make sure 1 is dividable by the unit.denominator
-
-def getResolution(s) -> int:
+def getResolution(sc) -> int:
     """Return the number of ticks per quarter note given the duration unit."""
-    unit = getDurationUnit(s)
-    #number of ticks is 1 / unit (if that is an integer)
-    ticksPerQuarter = unit.denominator / unit.numerator
-    if ticksPerQuarter.is_integer():
-        return int(unit.denominator / unit.numerator)
-    else:
-        print(s.filePath, ' non integer number of ticks per Quarter')
-        return 0
+    return sc.resolution
 
-def getOnsetTick(s):
+def getOnsetTick(sc):
     """Returns a list of onsets (ints). Onsets are multiples of the duration unit."""
-    ticksPerQuarter = getResolution(s)
-    onsets = [int(n.offset * ticksPerQuarter) for n in s.flat.notes]
+    ticksPerQuarter = getResolution(sc)
+    onsets = [int(offset * ticksPerQuarter) for offset in sc.offset]
     return onsets
 
 def getIMAcontour(ima):
@@ -1360,48 +1578,498 @@ def getIMAcontour(ima):
 #- rhymescontentwords
 #- wordstress
 #- melismastate
+#Records are read one at a time through a persistent index of each file (see textindex.py),
+#such that workers do not hold copies of the text feature files.
 class GetTextFeatures():
-    def __init__(self):
-        self.seqs = {}
-    def addSeqsFromFile(self, filename):
-        _seqs = MTCFeatureLoader(filename).sequences()
-        #convert to dict
-        _seqs = {seq['id']: seq for seq in _seqs}
-        #add to cache
-        self.seqs[filename] = _seqs
+    def __init__(self, cachesize=256):
+        self.cachesize = cachesize
+        self.indexes = {}
     def __call__(self, nlbid, filename):
-        if not filename in self.seqs.keys():
-            self.addSeqsFromFile(filename)
-        if not nlbid in self.seqs[filename].keys():
+        if not filename in self.indexes.keys():
+            self.indexes[filename] = TextIndex(filename, cachesize=self.cachesize)
+        try:
+            seq = self.indexes[filename][nlbid]
+        except KeyError:
             raise CacheError(nlbid)
         return (
-            self.seqs[filename][nlbid]['features']['lyrics'],
-            self.seqs[filename][nlbid]['features']['noncontentword'],
-            self.seqs[filename][nlbid]['features']['wordend'],
-            self.seqs[filename][nlbid]['features']['phoneme'],
-            self.seqs[filename][nlbid]['features']['rhymes'],
-            self.seqs[filename][nlbid]['features']['rhymescontentwords'],
-            self.seqs[filename][nlbid]['features']['wordstress'],
-            self.seqs[filename][nlbid]['features']['melismastate']
+            seq['features']['lyrics'],
+            seq['features']['noncontentword'],
+            seq['features']['wordend'],
+            seq['features']['phoneme'],
+            seq['features']['rhymes'],
+            seq['features']['rhymescontentwords'],
+            seq['features']['wordstress'],
+            seq['features']['melismastate']
         )
 getTextFeatures = GetTextFeatures()
 
-#Generate the sequences
-#iterator
+#Increment if the computation of the features changes. With -incremental, all songs are
+#extracted again.
+FEATUREVERSION = 1
+
+#Metric features of a song without time signature are None
+def meterFeature(func):
+    def feature(sc, *inputs):
+        if not hasmeter(sc):
+            return [None] * sc.n_notes
+        return func(sc, *inputs)
+    return feature
+
+def getBeatInSongANDPhrase(sc, phrasepos):
+    if not hasmeter(sc):
+        nofrac = (np.zeros(sc.n_notes, dtype=np.int64), 1, False)
+        return nofrac, nofrac, nofrac
+    return m21TOBeatInSongANDPhrase(sc, phrasepos)
+
+def getBeatinphrase_end_frac(beatinsongandphrase, phrase_ix, beat, sc):
+    if not hasmeter(sc):
+        return (np.zeros(sc.n_notes, dtype=np.int64), 1, False)
+    return getBeatinphrase_end(beatinsongandphrase[1], phrase_ix, beat)
+
+def getGPR3d(ioi):
+    return getFranklandGPR3d(np.array([i if i is not None else np.nan for i in ioi]))
+
+def getGPRsum(*gprs):
+    return [sum(filter(None, x)) for x in zip(*gprs)]
+
+#All features and the values they are computed from. Given: sc (SongContext).
+#Markers: meter (needs the metric context of the notes), keys (needs the key of every note).
+#The order of the features is the order in the output.
+featureGraph = FeatureGraph(givens=['sc'])
+featureGraph.marker('meter')
+featureGraph.marker('keys')
+#values that are shared by several features
+featureGraph.value('duration_ticks', m21TODuration_frac, ['sc'])
+featureGraph.value('restduration_ticks', m21TORestDuration_frac, ['sc'])
+featureGraph.value('ioi_ticks', getIOI_frac, ['duration_ticks', 'restduration_ticks'])
+featureGraph.value('ior_ticks', getIOR_frac, ['ioi_ticks'])
+featureGraph.value('key', lambda sc, _: m21TOKey(sc), ['sc', 'keys'])
+featureGraph.value('phraseinfo', getPhraseInfo, ['sc'])
+featureGraph.value('beat_strs', lambda sc, _: m21TOBeat_str(sc) if hasmeter(sc) else ([None]*sc.n_notes, [None]*sc.n_notes), ['sc', 'meter'])
+featureGraph.value('beatinsongandphrase', lambda sc, _, phraseinfo: getBeatInSongANDPhrase(sc, phraseinfo[1]), ['sc', 'meter', 'phraseinfo'])
+#features
+featureGraph.add('pitch', m21TOPitches, ['sc'])
+featureGraph.add('octave', getOctave, ['sc'])
+featureGraph.add('midipitch', m21TOMidiPitch, ['sc'])
+featureGraph.add('contour3', midipitch2contour3, ['midipitch'])
+featureGraph.add('contour5', lambda midipitch: midipitch2contour5(midipitch, thresh=3), ['midipitch'])
+featureGraph.add('pitch40_hewlett', getPitch40_Hewlett, ['sc'])
+featureGraph.add('pitch40_sapp', getPitch40_Sapp, ['sc'])
+featureGraph.add('tonic', lambda key: key[0], ['key'])
+featureGraph.add('mode', lambda key: key[1], ['key'])
+featureGraph.add('scaledegree', m21TOscaledegrees, ['sc'])
+featureGraph.add('scaledegreespecifier', m21TOscaleSpecifiers, ['sc'])
+featureGraph.add('chromaticscaledegree', m21TOChromaticScaleDegree, ['sc'])
+featureGraph.add('diatonicpitch', m21TOdiatonicPitches, ['sc'])
+featureGraph.add('diatonicpitch12', m21TOdiatonicPitches12, ['sc'])
+featureGraph.add('diatonicpitch40', m21TOdiatonicPitches40, ['sc'])
+featureGraph.add('diatonicinterval', toDiatonicIntervals, ['sc'])
+featureGraph.add('chromaticinterval', toChromaticIntervals, ['sc'])
+featureGraph.add('pitchproximity', getPitchProximity, ['chromaticinterval'])
+featureGraph.add('pitchreversal', getPitchReversal, ['chromaticinterval'])
+featureGraph.add('onsettick', getOnsetTick, ['sc'])
+featureGraph.value('imafuture', submitIMA, ['onsettick']) #runs while the other features are computed
+featureGraph.add('duration', m21TODuration, ['sc'])
+featureGraph.add('duration_frac', lambda ticks: fraction_str(*ticks), ['duration_ticks'])
+featureGraph.add('duration_fullname', m21TODuration_fullname, ['sc'])
+featureGraph.add('durationcontour', getDurationcontour, ['duration_ticks'])
+featureGraph.add('IOI_frac', lambda ticks: fraction_str(*ticks), ['ioi_ticks'])
+featureGraph.add('IOI', getIOI, ['ioi_ticks'])
+featureGraph.add('IOR_frac', lambda ticks: fraction_str(*ticks), ['ior_ticks'])
+featureGraph.add('IOR', getIOR, ['ior_ticks'])
+featureGraph.add('nextisrest', m21TONextIsRest, ['sc'])
+featureGraph.add('restduration_frac', lambda ticks: fraction_str(*ticks), ['restduration_ticks'])
+featureGraph.add('timesignature', lambda sc, _: meterFeature(m21TOTimeSignature)(sc), ['sc', 'meter'])
+featureGraph.add('beat_str', lambda beat_strs: beat_strs[0], ['beat_strs'])
+featureGraph.add('beat_fraction_str', lambda beat_strs: beat_strs[1], ['beat_strs'])
+featureGraph.add('beat', lambda sc, _: meterFeature(m21TOBeat_float)(sc), ['sc', 'meter'])
+featureGraph.add('beatfraction', lambda bsp: fraction_str(*bsp[2]), ['beatinsongandphrase'])
+featureGraph.add('beatinsong', lambda bsp: fraction_str(*bsp[0]), ['beatinsongandphrase'])
+featureGraph.add('beatinphrase', lambda bsp: fraction_str(*bsp[1]), ['beatinsongandphrase'])
+featureGraph.add('beatinphrase_end', lambda bsp, phraseinfo, beat, sc: fraction_str(*getBeatinphrase_end_frac(bsp, phraseinfo[0], beat, sc)), ['beatinsongandphrase', 'phraseinfo', 'beat', 'sc'])
+featureGraph.add('beatstrength', lambda sc, _: meterFeature(m21TObeatstrength)(sc), ['sc', 'meter'])
+featureGraph.add('metriccontour', lambda sc, _: meterFeature(m21TOmetriccontour)(sc), ['sc', 'meter'])
+featureGraph.value('ima', lambda future: future.result(), ['imafuture'])
+featureGraph.add('imaweight', lambda ima: ima[0], ['ima'])
+featureGraph.add('imaweight_spectral', lambda ima: ima[1], ['ima'])
+featureGraph.add('imacontour', getIMAcontour, ['imaweight'])
+featureGraph.add('songpos', getSongPos, ['onsettick'])
+featureGraph.add('phrasepos', lambda phraseinfo: phraseinfo[1], ['phraseinfo'])
+featureGraph.add('phrase_ix', lambda phraseinfo: phraseinfo[0], ['phraseinfo'])
+featureGraph.add('phrase_end', getPhraseEnd, ['phrasepos'])
+featureGraph.add('gpr2a_Frankland', lambda sc: getFranklandGPR2a(sc.restafter_float), ['sc'])
+featureGraph.add('gpr2b_Frankland', lambda duration, sc: getFranklandGPR2b(duration, sc.restafter_float), ['duration', 'sc']) #or use IOI and no rest check!!!
+featureGraph.add('gpr3a_Frankland', lambda sc: getFranklandGPR3a(sc.midi), ['sc'])
+featureGraph.add('gpr3d_Frankland', getGPR3d, ['IOI'])
+featureGraph.add('gpr_Frankland_sum', getGPRsum, ['gpr2a_Frankland', 'gpr2b_Frankland', 'gpr3a_Frankland', 'gpr3d_Frankland'])
+featureGraph.value('lbdm', lambda sc, ioi: lbdm(sc.midi, ioi, sc.restafter_float), ['sc', 'IOI'])
+for lbdmfeature in ['lbdm_spitch', 'lbdm_sioi', 'lbdm_srest', 'lbdm_rpitch', 'lbdm_rioi', 'lbdm_rrest']:
+    featureGraph.add(lbdmfeature, lambda lbdm_features, name=lbdmfeature: lbdm_features[name], ['lbdm'])
+featureGraph.add('lbdm_boundarystrength', lambda lbdm_features, *_: lbdm_features['lbdm_boundarystrength'], ['lbdm', 'lbdm_spitch', 'lbdm_sioi', 'lbdm_srest'])
+
+#Features from the text feature file (only for MTC)
+TEXTFEATURES = ['lyrics', 'noncontentword', 'wordend', 'phoneme', 'rhymes', 'rhymescontentwords', 'wordstress', 'melismastate']
+
+ALLFEATURES = featureGraph.features + TEXTFEATURES
+
+#The features to compute, and what is needed for them
+class FeatureSelection():
+    #features: list of features, None: all features
+    def __init__(self, features=None):
+        if features is None:
+            features = ALLFEATURES
+        unknown = [feat for feat in features if feat not in ALLFEATURES]
+        if unknown:
+            raise ValueError(f'Unknown features: {", ".join(unknown)}')
+        self.features = list(features)
+        self.graphfeatures = [feat for feat in features if feat not in TEXTFEATURES]
+        self.textfeatures = [feat for feat in TEXTFEATURES if feat in features]
+        self.needsMeter = featureGraph.needs(self.graphfeatures, 'meter')
+        self.needsKeys = featureGraph.needs(self.graphfeatures, 'keys')
+
+#Selected features (-features). Set by configure().
+selectedFeatures = None
+
+#Select the features that extractSong() computes by default
+#features: list of features, None: all features
+def featureSelection(features=None):
+    global selectedFeatures
+    selectedFeatures = FeatureSelection(features)
+
+#Increment if the records built by songRecords() change
+RECORDSVERSION = 1
+
+#numpy scalars (from pandas) to plain python values
+def plainValue(value):
+    if pd.isna(value):
+        return None
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+#Join the metadata of the songs of a collection, and the metadata of their sources, into
+#one record per song, such that extracting a song needs no lookups in DataFrames.
+#returns dict song id -> record, in the order of song_metadata, with:
+#  filename: .krn file, relative to krndir. rep might have subdirectories (e.g. rism)
+#  tunefamily, tunefamily_full, type: str
+#  year: sorting year of the song (RISM) or its source (MTC), -1 if unknown. None if
+#        the sorting year is not a number (extraction of the song fails)
+#  origin: str
+#  ann_bgcorpus: bool, or None if the collection has no such column
+#  metahash: hash of all metadata of the song and its source (see SongManifest)
 #song ids should be in index of song_metadata
-def getSequences(
+def songRecords(song_metadata, source_metadata, fieldmap):
+    sources = {} if source_metadata is None else source_metadata.to_dict('index')
+    records = {}
+    for nlbid, row in song_metadata.to_dict('index').items():
+        row = {col: plainValue(value) for col, value in row.items()}
+        sorting_year = ''
+        #MTC:
+        source = None
+        if row.get('source_id'):
+            source = {col: plainValue(value) for col, value in sources[row['source_id']].items()}
+            sorting_year = source['sorting_year']
+        #RISM
+        if 'sorting_year' in row:
+            sorting_year = row['sorting_year']
+        if sorting_year is None or sorting_year == '':
+            sorting_year = "-1" #UGLY
+        try:
+            sorting_year = int(sorting_year)
+        except ValueError:
+            sorting_year = None
+        metadata = list(row.values())
+        if source is not None:
+            metadata.append(list(source.values()))
+        records[nlbid] = {
+            'filename': row['filename'] if 'filename' in row else nlbid+'.krn',
+            'tunefamily': str(row[fieldmap['tunefamily']]),
+            'tunefamily_full': str(row[fieldmap['tunefamily_full']]),
+            'type': str(row['type']),
+            'year': sorting_year,
+            'origin': row['origin'] if 'origin' in row else '',
+            'ann_bgcorpus': bool(row['ann_bgcorpus']) if 'ann_bgcorpus' in row else None,
+            'metahash': hashString(json.dumps(metadata, default=str)),
+        }
+    return records
+
+#Records of a collection (see songRecords()). With -metadatacache, they are built once
+#and read from the cache as long as the metadata files (paths) do not change.
+#build: function that reads the metadata files and returns the records
+def metadataRecords(name, paths, build):
+    if metadataCache is None:
+        return build()
+    return metadataCache.get(name, paths, f'{RECORDSVERSION}', build)
+
+#Extract the features of one song
+#returns the sequence, or None if the song could not be processed
+#record: metadata of the song (see songRecords())
+#timer: SongTimer, to time the stages and the features
+#failure: dict, that is filled with the stage, exception and traceback if the song could
+#not be processed (see FailureLedger)
+#features: FeatureSelection. Default: the features selected with -features
+def extractSong(
+        nlbid,
+        record,
         krndir,
-        song_metadata,
-        source_metadata,
         textFeatureFile=None,
-        fieldmap={'TuneFamily':'TuneFamily', 'TuneFamily_full' : 'TuneFamily'},
+        timer=None,
+        failure=None,
+        features=None,
+    ):
+    song = startSong(nlbid, record, krndir, textFeatureFile=textFeatureFile, timer=timer, failure=failure, features=features)
+    if song is None:
+        return None
+    return finishSong(song)
+
+#Values of featureGraph that start work in the background (onsets2ima). startSong()
+#computes these, such that the work can run while other songs are processed.
+BACKGROUNDVALUES = ['imafuture']
+
+#First part of extractSong(): parse the song, build the SongContext, and start the
+#background work (see BACKGROUNDVALUES)
+#returns the state of the song for finishSong(), or None if the song could not be processed
+def startSong(
+        nlbid,
+        record,
+        krndir,
+        textFeatureFile=None,
+        timer=None,
+        failure=None,
+        features=None,
+    ):
+
+    print(nlbid)
+
+    filename = record['filename']
+    selection = features if features is not None else selectedFeatures
+    stage = timer.stage if timer is not None else lambda name: nullcontext()
+
+    try:
+        with stage('parse'):
+            s = parseMelody(os.path.join(krndir, filename))
+    except ParseError as e:
+        print(nlbid, "does not exist")
+        songFailure(failure, 'parse', e)
+        return None
+    except NoNotesError as e:
+        print(nlbid, "has not notes.")
+        songFailure(failure, 'parse', e)
+        return None
+    except Exception as e:
+        print("Exception in user code:")
+        print("-"*60)
+        traceback.print_exc(file=sys.stdout)
+        print("-"*60)
+        songFailure(failure, 'parse', e)
+        return None
+
+    if len(s.notes) < 2:
+        print(f"{nlbid}: Melody too short ({len(s.notes)} notes)")
+        songFailure(failure, 'parse', MelodyTooShorError(f"{len(s.notes)} notes"))
+        return None
+
+    failedstage = 'context'
+    try:
+        #all information the features are computed from, in one pass through the stream
+        #the metric and key contexts only if a selected feature needs them
+        with stage('context'):
+            sc = (SongContext.fromKern if isinstance(s, KernMelody) else SongContext)(
+                s,
+                meter=selection.needsMeter,
+                keys=selection.needsKeys,
+            )
+        if selection.needsMeter and not hasmeter(sc):
+            print(nlbid, "has no time signature")
+        failedstage = 'features'
+        with stage('features'):
+            values = featureGraph.start(selection.graphfeatures, {'sc': sc}, BACKGROUNDVALUES, timer=timer.feature if timer is not None else None)
+    except Exception as e:
+        print(f"Features extraction from {nlbid} failed.")
+        print(e)
+        songFailure(failure, failedstage, e)
+        return None
+
+    return {
+        'nlbid': nlbid,
+        'record': record,
+        'textFeatureFile': textFeatureFile,
+        'timer': timer,
+        'failure': failure,
+        'selection': selection,
+        'sc': sc,
+        'values': values,
+    }
+
+#Second part of extractSong(): compute the features of a song started by startSong()
+#returns the sequence, or None if the song could not be processed
+def finishSong(song):
+    nlbid = song['nlbid']
+    record = song['record']
+    textFeatureFile = song['textFeatureFile']
+    timer = song['timer']
+    failure = song['failure']
+    selection = song['selection']
+    sc = song['sc']
+    stage = timer.stage if timer is not None else lambda name: nullcontext()
+
+    failedstage = 'features'
+    try:
+        with stage('features'):
+            songfeatures = featureGraph.compute(selection.graphfeatures, song['values'], timer=timer.feature if timer is not None else None)
+        failedstage = 'metadata'
+        if record['year'] is None:
+            raise ValueError(f"{nlbid}: sorting year is not a number")
+    except Exception as e:
+        print(f"Features extraction from {nlbid} failed.")
+        print(e)
+        songFailure(failure, failedstage, e)
+        return None
+
+    seq = {
+        'id':nlbid, 'tunefamily': record['tunefamily'],
+        'year' : record['year'],
+        'tunefamily_full': record['tunefamily_full'],
+        'type' : record['type'],
+        'freemeter' : not hasmeter(sc),
+        'origin' : record['origin'],
+        'features': songfeatures,
+    }
+    #if False:
+    selectedTextFeatures = selection.textfeatures
+    if textFeatureFile and selectedTextFeatures and (nlbid not in nlbids_notvocal):
+        try:
+            with stage('textfeatures'):
+                textfeatures = dict(zip(TEXTFEATURES, getTextFeatures(nlbid, textFeatureFile)))
+            for feat in selectedTextFeatures:
+                seq['features'][feat] = textfeatures[feat]
+        except CacheError:
+            pass
+            #print(nlbid, 'has no lyrics.')
+        except KeyError:
+            print(f"{nlbid}: No textfeatures present")
+    
+    if record['ann_bgcorpus'] is not None:
+        seq['ann_bgcorpus'] = record['ann_bgcorpus']
+    #check lengths
+    reflength = sc.n_notes
+    for feat in seq['features'].keys():
+        if len(seq['features'][feat]) != reflength:
+            print(f'Error: {nlbid}: length of {feat} differs.')
+            print(f'Difference: {len(seq["features"][feat])-reflength}')
+            raise FeatLenghtError(nlbid)
+    return seq
+
+#Fill failure (dict) with the stage and the exception (class, message and traceback)
+#With the exception that is being handled, the traceback is included.
+def songFailure(failure, stage, exc):
+    if failure is None:
+        return
+    failure['stage'] = stage
+    failure['error'] = type(exc).__name__
+    failure['message'] = str(exc)
+    failure['traceback'] = traceback.format_exc() if sys.exc_info()[1] is exc else ''
+
+#Version of the extractor. Output (SongManifest) and failures (FailureLedger) of another
+#version are not valid.
+#Includes the options that change the output: the selected features (-features, in any
+#order) and -imaengine (ima.py may differ from onsets2ima).
+def extractorVersion():
+    features = hashString(','.join(sorted(selectedFeatures.features)))
+    return f'{PARSEVERSION} {FEATUREVERSION} {m21.__version__} {args.imaengine} {features}'
+
+#Per-process state for extractSongWorker(). Set by initSongWorker(), once per
+#worker process, so the metadata is not sent along with every song.
+_songWorker = {}
+
+#cmdargs: options of the parent. With the spawn start method the worker imports this
+#module again, with the default options.
+def initSongWorker(cmdargs, krndir, records, textFeatureFile):
+    if cmdargs is not args:
+        configure(cmdargs)
+    _songWorker['krndir'] = krndir
+    _songWorker['records'] = records
+    _songWorker['textFeatureFile'] = textFeatureFile
+
+#returns (sequence, timings, failure)
+#timings: SongTimer.asdict() with -timings, otherwise None
+#failure: see extractSong(). None if the sequence is not None.
+def extractSongWorker(nlbid):
+    timer = SongTimer() if args.timings else None
+    failure = {}
+    seq = extractSong(
+        nlbid,
+        _songWorker['records'][nlbid],
+        krndir=_songWorker['krndir'],
+        textFeatureFile=_songWorker['textFeatureFile'],
+        timer=timer,
+        failure=failure,
+    )
+    return seq, timer.asdict() if timer is not None else None, failure or None
+
+#Number of songs a worker starts (see startSong()) ahead of the song of which it
+#computes the features, such that onsets2ima runs for the next songs in the meantime.
+def songLookahead():
+    if args.imaengine != 'onsets2ima':
+        return 0
+    return max(args.imaprocs - 1, 0)
+
+#returns iterator over (sequence, timings, failure) of the songs, as extractSongWorker()
+def extractSongsWorker(nlbids):
+    started = deque()
+    def finish():
+        song, timer, failure = started.popleft()
+        seq = finishSong(song) if song is not None else None
+        return seq, timer.asdict() if timer is not None else None, failure or None
+    for nlbid in nlbids:
+        timer = SongTimer() if args.timings else None
+        failure = {}
+        song = startSong(
+            nlbid,
+            _songWorker['records'][nlbid],
+            krndir=_songWorker['krndir'],
+            textFeatureFile=_songWorker['textFeatureFile'],
+            timer=timer,
+            failure=failure,
+        )
+        started.append((song, timer, failure))
+        if len(started) > songLookahead():
+            yield finish()
+    while started:
+        yield finish()
+
+#list with the results of the songs of a chunk, for Pool.imap()
+def extractChunkWorker(nlbids):
+    res = list(extractSongsWorker(nlbids))
+    if imaCache is not None:
+        imaCache.flush() #the pool terminates the workers
+    return res
+
+#Number of songs per task. Like Pool.map(): about four chunks per worker, such that
+#short songs (e.g. RISM incipits) do not drown in per-task overhead.
+def getChunksize(n_songs, jobs, chunksize=0):
+    if chunksize > 0:
+        return chunksize
+    chunksize, extra = divmod(n_songs, jobs * 4)
+    if extra:
+        chunksize += 1
+    return max(1, chunksize)
+
+#Select the songs to process
+#records: see songRecords()
+def getSongIds(
+        records,
         startat=None,
         stopat=None,
         only=None,
-        missing=False, #True: only generate missing 
+        missing=False, #True: only generate missing
     ):
 
-    id_list = song_metadata.index
+    id_list = records.keys()
+
+    #songs in shards written by earlier runs
+    if missing and args.shards:
+        shardedids = shardedIds(outputpath)
 
     seen=False
     for nlbid in id_list:
@@ -1417,233 +2085,171 @@ def getSequences(
         if stopat:
             if nlbid==stopat:
                 break
-        
-        print(nlbid)
-        
-        #construct filename
-        #rep might have subdirectories (e.g. rism)
-        if 'filename' in song_metadata.columns:
-            filename = song_metadata.loc[nlbid,'filename']
-        else:
-            filename = nlbid+'.krn'
 
-        if missing:
-            jsonfilename = filename.replace('.krn', '.json')
+        if missing and args.shards:
+            if nlbid in shardedids:
+                print (f"{nlbid} exists in shards. Skipping.")
+                continue
+        elif missing:
+            jsonfilename = records[nlbid]['filename'].replace('.krn', '.json')
             if os.path.isfile(os.path.join(outputpath, jsonfilename)):
                 print (f"{jsonfilename} exists. Skipping.")
                 continue
 
-        try:
-            s = parseMelody(os.path.join(krndir, filename))
-        except ParseError:
-            print(nlbid, "does not exist")
-            continue
-        except NoNotesError:
-            print(nlbid, "has not notes.")
-            continue
-        except Exception:
-            print("Exception in user code:")
-            print("-"*60)
-            traceback.print_exc(file=sys.stdout)
-            print("-"*60)
-            continue
-
-        if len(s.flat.notes) < 2:
-            print(f"{nlbid}: Melody too short ({len(s.flat.notes)} notes)")
+        yield nlbid
+
+#Select the songs of which the .krn file, the metadata or the text features changed
+#since the output was written, according to the manifest
+def changedSongIds(manifest, song_ids, krndir, records, textFeatureFile):
+    version = extractorVersion()
+    changed = []
+    for nlbid in song_ids:
+        krnpath = os.path.join(krndir, records[nlbid]['filename'])
+        if not os.path.isfile(krnpath):
+            changed.append(nlbid) #extractSong reports it
             continue
-
-        try:
-            diatonicPitches = m21TOdiatonicPitches(s)
-            diatonicPitches12 = m21TOdiatonicPitches12(s)
-            diatonicPitches40 = m21TOdiatonicPitches40(s)
-            diatonicinterval = toDiatonicIntervals(s)
-            chromaticinterval = toChromaticIntervals(s)
-            pitch = m21TOPitches(s)
-            pitch40_hewlett = getPitch40_Hewlett(s)
-            pitch40_sapp = getPitch40_Sapp(s)
-            octave = getOctave(s)
-            midipitch = m21TOMidiPitch(s)
-            sd = m21TOscaledegrees(s)
-            sdspec = m21TOscaleSpecifiers(s)
-            chr_sd = m21TOChromaticScaleDegree(s)
-            pitchproximity = getPitchProximity(chromaticinterval)
-            pitchreversal = getPitchReversal(chromaticinterval)
-            nextisrest = m21TONextIsRest(s)
-            restduration_frac = m21TORestDuration_frac(s)
-            tonic, mode = m21TOKey(s)
-            contour3 = midipitch2contour3(midipitch)
-            contour5 = midipitch2contour5(midipitch, thresh=3)
-            duration = m21TODuration(s)
-            duration_fullname = m21TODuration_fullname(s)
-            duration_frac = m21TODuration_frac(s)
-            durationcontour = getDurationcontour(duration_frac)
-            onsettick = getOnsetTick(s)
-            ima, ima_spect = getIMA(s, onsettick)
-            ic = getIMAcontour(ima)
-            phrase_ix, phrasepos = getPhraseInfo(s)
-            phrase_end = getPhraseEnd(phrasepos)
-            ioi_frac = getIOI_frac(duration_frac, restduration_frac)
-            ioi = getIOI(ioi_frac)
-            ior_frac = getIOR_frac(ioi_frac)
-            ior = getIOR(ior_frac)
-            songpos = getSongPos(onsettick)
-            gpr2a_Frankland = getFranklandGPR2a(restduration_frac)
-            gpr2b_Frankland = getFranklandGPR2b(duration, restduration_frac) #or use IOI and no rest check!!!
-            gpr3a_Frankland = getFranklandGPR3a(midipitch)
-            gpr3d_Frankland = getFranklandGPR3d(ioi)
-            gpr_Frankland_sum = [sum(filter(None, x)) for x in zip(gpr2a_Frankland, gpr2b_Frankland, gpr3a_Frankland, gpr3d_Frankland)]
-            lbdm_rpitch = getDegreeChangeLBDMpitch(chromaticinterval)
-            lbdm_spitch = getBoundaryStrengthPitch(lbdm_rpitch, chromaticinterval)
-            lbdm_rioi = getDegreeChangeLBDMioi(ioi)
-            lbdm_sioi = getBoundaryStrengthIOI(lbdm_rioi, ioi)
-            lbdm_rrest = getDegreeChangeLBDMrest(restduration_frac)
-            lbdm_srest = getBoundaryStrengthRest(lbdm_rrest, restduration_frac)
-            lbdm_boundarystrength = getLocalBoundaryStrength(lbdm_spitch, lbdm_sioi, lbdm_srest)
-            sorting_year = ''
-            #MTC:
-            if song_metadata.loc[nlbid,'source_id']:
-                sorting_year = source_metadata.loc[song_metadata.loc[nlbid,'source_id'],'sorting_year']
-            #RISM
-            if 'sorting_year' in song_metadata:
-                sorting_year = song_metadata.loc[nlbid,'sorting_year']
-            if pd.isna(sorting_year):
-                sorting_year = "-1"
-            if sorting_year == '':
-                sorting_year = "-1" #UGLY
-            sorting_year = int(sorting_year)
-            if 'ann_bgcorpus' in song_metadata.columns:
-                ann_bgcorpus = bool(song_metadata.loc[nlbid,'ann_bgcorpus'])
-            else:
-                ann_bgcorpus = None
-            if 'origin' in song_metadata.columns:
-                origin = song_metadata.loc[nlbid,'origin']
-            else:
-                origin = ''
+        textfeatures = None
+        if textFeatureFile:
             try:
-                #pass
-                timesignature = m21TOTimeSignature(s)
-                beat_str, beat_fraction_str = m21TOBeat_str(s)
-                beat_float = m21TOBeat_float(s)
-                mc = m21TOmetriccontour(s)
-                beatstrength = m21TObeatstrength(s)
-                beatinsong, beatinphrase, beatfraction = m21TOBeatInSongANDPhrase(s, phrasepos)
-                beatinphrase_end = getBeatinphrase_end(beatinphrase, phrase_ix, beat_float)
-            except NoMeterError:
-                print(nlbid, "has no time signature")
-                timesignature = [None]*len(sd)
-                beat_str, beat_fraction_str = [None]*len(sd) , [None]*len(sd)
-                beat_float = [None]*len(sd)
-                mc = [None]*len(sd)
-                beatstrength = [None]*len(sd)
-                beatinsong, beatinphrase, beatfraction = [None]*len(sd), [None]*len(sd), [None]*len(sd)
-                beatinphrase_end = [None]*len(sd)        
-        except Exception as e:
-            print(f"Features extraction from {nlbid} failed.")
-            print(e)
-            continue
-
-        seq = {
-            'id':nlbid, 'tunefamily': str(song_metadata.loc[nlbid, fieldmap['tunefamily']]),
-            'year' : sorting_year,
-            'tunefamily_full': str(song_metadata.loc[nlbid, fieldmap['tunefamily_full']]),
-            'type' : str(song_metadata.loc[nlbid, 'type']),
-            'freemeter' : not hasmeter(s),
-            'origin' : origin,
-            'features': {
-                'pitch': pitch,
-                'octave': octave,
-                'midipitch': midipitch,
-                'contour3' : contour3,
-                'contour5' : contour5,
-                'pitch40_hewlett': pitch40_hewlett,
-                'pitch40_sapp': pitch40_sapp,
-                'tonic': tonic,
-                'mode': mode,
-                'scaledegree': sd,
-                'scaledegreespecifier' : sdspec,
-                'chromaticscaledegree' : chr_sd,
-                'diatonicpitch' : diatonicPitches,
-                'diatonicpitch12' : diatonicPitches12,
-                'diatonicpitch40' : diatonicPitches40,
-                'diatonicinterval': diatonicinterval,
-                'chromaticinterval': chromaticinterval,
-                'pitchproximity': pitchproximity,
-                'pitchreversal': pitchreversal,
-                'onsettick': onsettick,
-                'duration': duration,
-                'duration_frac': duration_frac,
-                'duration_fullname': duration_fullname,
-                'durationcontour': durationcontour,
-                'IOI_frac': ioi_frac,
-                'IOI': ioi,
-                'IOR_frac': ior_frac,
-                'IOR': ior,
-                'nextisrest': nextisrest,
-                'restduration_frac': restduration_frac,
-                'timesignature': timesignature,
-                'beat_str': beat_str,
-                'beat_fraction_str': beat_fraction_str,
-                'beat': beat_float,
-                'beatfraction': beatfraction,
-                'beatinsong': beatinsong,
-                'beatinphrase': beatinphrase,
-                'beatinphrase_end': beatinphrase_end,
-                'beatstrength': beatstrength,
-                'metriccontour':mc,
-                'imaweight':ima,
-                'imaweight_spectral':ima_spect,
-                'imacontour': ic,
-                'songpos': songpos,
-                'phrasepos': phrasepos,
-                'phrase_ix': phrase_ix,
-                'phrase_end': phrase_end,
-                'gpr2a_Frankland': gpr2a_Frankland,
-                'gpr2b_Frankland': gpr2b_Frankland,
-                'gpr3a_Frankland': gpr3a_Frankland,
-                'gpr3d_Frankland': gpr3d_Frankland,
-                'gpr_Frankland_sum': gpr_Frankland_sum,
-                'lbdm_spitch': lbdm_spitch,
-                'lbdm_sioi': lbdm_sioi,
-                'lbdm_srest': lbdm_srest,
-                'lbdm_rpitch': lbdm_rpitch,
-                'lbdm_rioi': lbdm_rioi,
-                'lbdm_rrest': lbdm_rrest,
-                'lbdm_boundarystrength': lbdm_boundarystrength
-            }
-        }
-        #if False:
-        if textFeatureFile and (nlbid not in nlbids_notvocal):
-            try:
-                lyrics, noncontentword, wordend, phoneme, rhymes, rhymescontentwords, wordstress, melismastate = \
-                    getTextFeatures(nlbid, textFeatureFile)
-                seq['features']['lyrics'] = lyrics
-                seq['features']['noncontentword'] = noncontentword
-                seq['features']['wordend'] = wordend
-                seq['features']['phoneme'] = phoneme
-                seq['features']['rhymes'] = rhymes
-                seq['features']['rhymescontentwords'] = rhymescontentwords
-                seq['features']['wordstress'] = wordstress
-                seq['features']['melismastate'] = melismastate
+                textfeatures = getTextFeatures(nlbid, textFeatureFile)
             except CacheError:
                 pass
-                #print(nlbid, 'has no lyrics.')
-            except KeyError:
-                print(f"{nlbid}: No textfeatures present")
-        
-        if ann_bgcorpus is not None:
-            seq['ann_bgcorpus'] = ann_bgcorpus
-        #check lengths
-        reflength = len(seq['features']['scaledegree'])
-        for feat in seq['features'].keys():
-            if len(seq['features'][feat]) != reflength:
-                print(f'Error: {nlbid}: length of {feat} differs.')
-                print(f'Difference: {len(seq["features"][feat])-reflength}')
-                raise FeatLenghtError(nlbid)
-        yield seq
-
-
-def getANNBackgroundCorpusIndices(fsinst_song_metadata):
-    ann_song_metadata = pd.read_csv(
+        key = manifest.key(nlbid, krnpath, records[nlbid]['metahash'], textfeatures, version)
+        if manifest.changed(nlbid, key):
+            changed.append(nlbid)
+        else:
+            print(f"{nlbid} unchanged. Skipping.")
+    return changed
+
+#Result of extractSongWorker() for a song that was killed by the SongSupervisor
+def supervisorFailure(nlbid, exc):
+    print(f"{nlbid}: killed ({type(exc).__name__}: {exc})")
+    failure = {}
+    songFailure(failure, 'watchdog', exc)
+    return None, None, failure
+
+#Remove the songs that are quarantined in the failure ledger
+def quarantinedSongIds(ledger, song_ids, krndir, records):
+    version = extractorVersion()
+    selected = []
+    for nlbid in song_ids:
+        if ledger.quarantined(os.path.join(krndir, records[nlbid]['filename']), version):
+            print(f"{nlbid} failed before. Skipping.")
+        else:
+            selected.append(nlbid)
+    return selected
+
+#Generate the sequences
+#iterator
+#records: metadata of the songs of the collection (see songRecords())
+#jobs > 1: extract the songs in a pool of worker processes. Sequences are generated in
+#the same order as with jobs=1.
+#With -songtimeout, -songmaxrss, -recycleafter or -recyclerss the songs are extracted in
+#jobs supervised worker processes (see SongSupervisor). Killed songs are failures.
+#queue: WorkQueue. The selected songs are added to the queue, and only the songs in the
+#batches leased from the queue are processed.
+#manifest: SongManifest. Only the songs that changed since the output was written are
+#processed. Songs that are no longer in records are removed from the output, as are songs
+#that fail.
+#With -failures, songs that failed before are skipped (unless -retryfailed), and failures
+#are recorded in the ledger.
+def getSequences(
+        krndir,
+        records,
+        textFeatureFile=None,
+        startat=None,
+        stopat=None,
+        only=None,
+        missing=False, #True: only generate missing 
+        jobs=1,
+        chunksize=0,
+        queue=None,
+        manifest=None,
+    ):
+
+    song_ids = list(getSongIds(records, startat=startat, stopat=stopat, only=only, missing=missing))
+    if failureLedger is not None and not args.retryfailed:
+        song_ids = quarantinedSongIds(failureLedger, song_ids, krndir, records)
+    if manifest is not None:
+        song_ids = changedSongIds(manifest, song_ids, krndir, records, textFeatureFile)
+        if not (startat or stopat or only):
+            for nlbid in manifest.removeOthers(records.keys()):
+                print(f"{nlbid} is no longer in the collection. Removed.")
+    if queue is not None:
+        added = queue.enqueue(song_ids)
+        print(f"{added} songs added to queue {queue.path} ({queue.collection})")
+        batches = queue.batches()
+    else:
+        batches = [song_ids]
+
+    initargs = (args, krndir, records, textFeatureFile)
+    if args.songtimeout or args.songmaxrss or args.recycleafter or args.recyclerss:
+        pool = SongSupervisor(
+            jobs,
+            initSongWorker,
+            initargs,
+            extractSongWorker,
+            supervisorFailure,
+            timeout=args.songtimeout,
+            maxrss=args.songmaxrss*1024**2,
+            maxsongs=args.recycleafter,
+            maxworkerrss=args.recyclerss*1024**2,
+        )
+        mapSongs = pool.map
+    elif jobs > 1:
+        pool = multiprocessing.Pool(jobs, initializer=initSongWorker, initargs=initargs)
+        def mapSongs(batch):
+            n = getChunksize(len(batch), jobs, chunksize)
+            chunks = [batch[i:i+n] for i in range(0, len(batch), n)]
+            return chain.from_iterable(pool.imap(extractChunkWorker, chunks))
+    else:
+        pool = None
+        initSongWorker(*initargs)
+        mapSongs = extractSongsWorker
+
+    try:
+        for batch in batches:
+            for nlbid, (seq, timings, failure) in zip(batch, mapSongs(batch)):
+                if failureLedger is not None:
+                    krnpath = os.path.join(krndir, records[nlbid]['filename'])
+                    if failure is not None:
+                        failureLedger.record(nlbid, krnpath, extractorVersion(), **failure)
+                    elif seq is not None:
+                        failureLedger.clear(krnpath)
+                if manifest is not None and seq is None:
+                    if manifest.discard(nlbid):
+                        print(f"{nlbid}: output of previous run removed.")
+                if seq is not None:
+                    start = time.perf_counter(), time.process_time()
+                    yield seq
+                    if timings is not None:
+                        #the time until the next sequence is requested is the time the
+                        #caller needed to write the sequence
+                        timings['stages']['write'] = [time.perf_counter()-start[0], time.process_time()-start[1]]
+                if timings is not None:
+                    timingReport.add(nlbid, timings)
+                if queue is not None:
+                    if seq is not None:
+                        queue.done(nlbid) #after the sequence has been written
+                    else:
+                        queue.failed(nlbid)
+    finally:
+        if isinstance(pool, SongSupervisor):
+            pool.close()
+        elif pool is not None:
+            pool.terminate()
+
+    #the slowest songs of the collection so far
+    if timingReport is not None and args.profileslow and timingReport.current is not None:
+        timingReport.current.profile(
+            args.profileslow,
+            f'{timingReport.currentname}-' if timingReport.currentname else '',
+            lambda nlbid: extractSong(nlbid, records[nlbid], krndir=krndir, textFeatureFile=textFeatureFile),
+        )
+
+
+def readANNSongMetadata():
+    return pd.read_csv(
         str(Path(mtcannroot,'metadata/MTC-ANN-songs.csv')),
         na_filter=False,
         index_col=0,
@@ -1665,6 +2271,8 @@ def getANNBackgroundCorpusIndices(fsinst_song_metadata):
             "strophe_number"
         ]
     )
+
+def getANNBackgroundCorpusIndices(fsinst_song_metadata, ann_song_metadata):
     #retrieve tf ids of mtc-ann tune families in mtc-fs-inst
     tfids = set(fsinst_song_metadata.loc[ann_song_metadata.index,'tunefamily_id'])
     tfids.remove('')
@@ -1681,69 +2289,60 @@ def getANNBackgroundCorpusIndices(fsinst_song_metadata):
     # now bg_corpus contains all songs unrelated to mtc-ann's tune families
     return bg_corpus.index
 
-def ann2seqs(startat=None, only=None, missing=False, stopat=None):
-    ann_tf_labels = pd.read_csv(
-        str(Path(mtcannroot,'metadata/MTC-ANN-tune-family-labels.csv')),
-        na_filter=False,
-        index_col=0,
-        header=None,
-        encoding='utf8',
-        names=['ID','TuneFamily']
-    )
-    ann_song_metadata = pd.read_csv(
-        str(Path(mtcannroot,'metadata/MTC-ANN-songs.csv')),
-        na_filter=False,
-        index_col=0,
-        header=None,
-        encoding='utf8',
-        names=[
-            "songid",
-            "NLB_record_number",
-            "source_id",
-            "serial_number",
-            "page",
-            "singer_id_s",
-            "date_of_recording",
-            "place_of_recording",
-            "latitude",
-            "longitude",
-            "title",
-            "firstline",
-            "strophe_number"
-        ]
-    )
-    #add tune family labels to song_metadata
-    ann_full_metadata = pd.concat([ann_tf_labels, ann_song_metadata], axis=1, sort=False)
-    #add type ('vocal' for all songs)
-    ann_full_metadata['type'] = 'vocal'
-    ann_source_metadata = pd.read_csv(
-        str(Path(mtcannroot,'metadata/MTC-ANN-sources.csv')),
-        na_filter=False,
-        index_col=0,
-        header=None,
-        encoding='utf8',
-        names=[
-            "source_id",
-            "title",
-            "author",
-            "place_publisher",
-            "dating",
-            "sorting_year",
-            "type",
-            "copy_used",
-            "scan_url"]
+#Metadata of the songs of ann as records (see songRecords())
+def annRecords():
+    def build():
+        ann_tf_labels = pd.read_csv(
+            str(Path(mtcannroot,'metadata/MTC-ANN-tune-family-labels.csv')),
+            na_filter=False,
+            index_col=0,
+            header=None,
+            encoding='utf8',
+            names=['ID','TuneFamily']
         )
+        ann_song_metadata = readANNSongMetadata()
+        #add tune family labels to song_metadata
+        ann_full_metadata = pd.concat([ann_tf_labels, ann_song_metadata], axis=1, sort=False)
+        #add type ('vocal' for all songs)
+        ann_full_metadata['type'] = 'vocal'
+        ann_source_metadata = pd.read_csv(
+            str(Path(mtcannroot,'metadata/MTC-ANN-sources.csv')),
+            na_filter=False,
+            index_col=0,
+            header=None,
+            encoding='utf8',
+            names=[
+                "source_id",
+                "title",
+                "author",
+                "place_publisher",
+                "dating",
+                "sorting_year",
+                "type",
+                "copy_used",
+                "scan_url"]
+            )
+        return songRecords(
+            ann_full_metadata,
+            ann_source_metadata,
+            fieldmap = {'tunefamily':'TuneFamily', 'tunefamily_full' : 'TuneFamily'},
+        )
+    return metadataRecords('ann', [Path(mtcannroot,'metadata/MTC-ANN-tune-family-labels.csv'), Path(mtcannroot,'metadata/MTC-ANN-songs.csv'), Path(mtcannroot,'metadata/MTC-ANN-sources.csv')], build)
+
+def ann2seqs(startat=None, only=None, missing=False, stopat=None, jobs=1, chunksize=0, queue=None, manifest=None):
     print(mtcannkrndir)
     for seq in getSequences(
         krndir=mtcannkrndir,
-        song_metadata=ann_full_metadata,
-        source_metadata=ann_source_metadata,
+        records=annRecords(),
         textFeatureFile=str(mtcanntextfeatspath),
-        fieldmap = {'tunefamily':'TuneFamily', 'tunefamily_full' : 'TuneFamily'},
         startat=startat,
         only=only,
         missing=missing,
         stopat=stopat,
+        jobs=jobs,
+        chunksize=chunksize,
+        queue=queue,
+        manifest=manifest,
     ):
         yield(seq)
 
@@ -1753,356 +2352,652 @@ def ann2seqs(startat=None, only=None, missing=False, stopat=None):
 #        yield(seq)
 
 #if noann, remove all songs related to MTC-ANN, and remove all songs without tune family label
-def fsinst2seqs(startat=None, only=None, missing=False, stopat=None):
-    fsinst_song_metadata = pd.read_csv(
-        str(Path(mtcfsroot,'metadata/MTC-FS-INST-2.0.csv')),
-        na_filter=False,
-        index_col=0,
-        header=None,
-        encoding='utf8',
-        names=[
-            "filename",
-            "songid",
-            "source_id",
-            "serial_number",
-            "page",
-            "singer_id_s",
-            "date_of_recording",
-            "place_of_recording",
-            "latitude",
-            "longitude",
-            "textfamily_id",
-            "title",
-            "firstline",
-            "tunefamily_id",
-            "tunefamily",
-            "type",
-            "voice_stanza_number",
-            "voice_stanza",
-            "image_filename_s",
-            "audio_filename",
-            "variation",
-            "confidence",
-            "comment",
-            "MTC_title",
-            "author"
-        ]
-    )
-    fsinst_source_metadata = pd.read_csv(
-        str(Path(mtcfsroot,'metadata/MTC-FS-INST-2.0-sources.csv')),
-        na_filter=False,
-        index_col=0,
-        header=None,
-        encoding='utf8',
-        names=[
-            "source_id",
-            "title",
-            "author",
-            "place_publisher",
-            "dating",
-            "sorting_year",
-            "type",
-            "copy_used",
-            "scan_url"
-        ]
-    )
-    
-    #figure out which songs are not related to MTC-ANN
-    #and add to song metadata
-    ids_ann_bgcorpus = getANNBackgroundCorpusIndices(fsinst_song_metadata)
-    fsinst_song_metadata['ann_bgcorpus'] = False
-    fsinst_song_metadata.loc[ids_ann_bgcorpus,'ann_bgcorpus'] = True
-    
+#Metadata of the songs of fsinst as records (see songRecords())
+def fsinstRecords():
+    def build():
+        fsinst_song_metadata = pd.read_csv(
+            str(Path(mtcfsroot,'metadata/MTC-FS-INST-2.0.csv')),
+            na_filter=False,
+            index_col=0,
+            header=None,
+            encoding='utf8',
+            names=[
+                "filename",
+                "songid",
+                "source_id",
+                "serial_number",
+                "page",
+                "singer_id_s",
+                "date_of_recording",
+                "place_of_recording",
+                "latitude",
+                "longitude",
+                "textfamily_id",
+                "title",
+                "firstline",
+                "tunefamily_id",
+                "tunefamily",
+                "type",
+                "voice_stanza_number",
+                "voice_stanza",
+                "image_filename_s",
+                "audio_filename",
+                "variation",
+                "confidence",
+                "comment",
+                "MTC_title",
+                "author"
+            ]
+        )
+        fsinst_source_metadata = pd.read_csv(
+            str(Path(mtcfsroot,'metadata/MTC-FS-INST-2.0-sources.csv')),
+            na_filter=False,
+            index_col=0,
+            header=None,
+            encoding='utf8',
+            names=[
+                "source_id",
+                "title",
+                "author",
+                "place_publisher",
+                "dating",
+                "sorting_year",
+                "type",
+                "copy_used",
+                "scan_url"
+            ]
+        )
+
+        #figure out which songs are not related to MTC-ANN
+        #and add to song metadata
+        ids_ann_bgcorpus = getANNBackgroundCorpusIndices(fsinst_song_metadata, readANNSongMetadata())
+        fsinst_song_metadata['ann_bgcorpus'] = False
+        fsinst_song_metadata.loc[ids_ann_bgcorpus,'ann_bgcorpus'] = True
+
+        return songRecords(
+            fsinst_song_metadata,
+            fsinst_source_metadata,
+            fieldmap = {'tunefamily':'tunefamily_id', 'tunefamily_full' : 'tunefamily'},
+        )
+    return metadataRecords('fsinst', [Path(mtcfsroot,'metadata/MTC-FS-INST-2.0.csv'), Path(mtcfsroot,'metadata/MTC-FS-INST-2.0-sources.csv'), Path(mtcannroot,'metadata/MTC-ANN-songs.csv')], build)
+
+def fsinst2seqs(startat=None, only=None, missing=False, stopat=None, jobs=1, chunksize=0, queue=None, manifest=None):
     for seq in getSequences(
         krndir=mtcfskrndir,
-        song_metadata=fsinst_song_metadata,
-        source_metadata=fsinst_source_metadata,
+        records=fsinstRecords(),
         textFeatureFile=str(mtcfsinsttextfeatspath),
-        fieldmap = {'tunefamily':'tunefamily_id', 'tunefamily_full' : 'tunefamily'},
         startat=startat,
         only=only,
         missing=missing,
         stopat=stopat,
+        jobs=jobs,
+        chunksize=chunksize,
+        queue=queue,
+        manifest=manifest,
     ):
         yield(seq)
 
-def essen2seqs(startat=None, only=None, missing=False, stopat=None):
-
-    essen_song_metadata = pd.read_csv(
-        str(essenmetadatapath),
-        na_filter=False,
-        index_col=0,
-        header=0,
-        encoding='utf8'
-    )
-    essen_song_metadata['tunefamily'] = ''
-    essen_song_metadata['type'] = 'vocal'
-    essen_song_metadata['source_id'] = ''
+#Metadata of the songs of essen as records (see songRecords())
+def essenRecords():
+    def build():
+        essen_song_metadata = pd.read_csv(
+            str(essenmetadatapath),
+            na_filter=False,
+            index_col=0,
+            header=0,
+            encoding='utf8'
+        )
+        essen_song_metadata['tunefamily'] = ''
+        essen_song_metadata['type'] = 'vocal'
+        essen_song_metadata['source_id'] = ''
+        return songRecords(
+            essen_song_metadata,
+            None,
+            fieldmap = {'tunefamily':'tunefamily', 'tunefamily_full' : 'tunefamily'},
+        )
+    return metadataRecords('essen', [essenmetadatapath], build)
 
+def essen2seqs(startat=None, only=None, missing=False, stopat=None, jobs=1, chunksize=0, queue=None, manifest=None):
     for seq in getSequences(
         krndir=essenkrndir,
-        song_metadata=essen_song_metadata,
-        source_metadata=None,
-        fieldmap = {'tunefamily':'tunefamily', 'tunefamily_full' : 'tunefamily'},
+        records=essenRecords(),
         startat = startat,
         only=only,
         missing=missing,
         stopat=stopat,
+        jobs=jobs,
+        chunksize=chunksize,
+        queue=queue,
+        manifest=manifest,
     ):
         yield(seq)
 
-def chorale2seqs(startat=None, only=None, missing=False, stopat=None):
-
-    chorale_song_metadata = pd.read_csv(
-        str(choralemetadatapath),
-        na_filter=False,
-        index_col=0,
-        header=0,
-        encoding='utf8'
-    )
-    chorale_song_metadata['tunefamily'] = ''
-    chorale_song_metadata['type'] = 'vocal'
-    chorale_song_metadata['source_id'] = ''
+#Metadata of the songs of chorale as records (see songRecords())
+def choraleRecords():
+    def build():
+        chorale_song_metadata = pd.read_csv(
+            str(choralemetadatapath),
+            na_filter=False,
+            index_col=0,
+            header=0,
+            encoding='utf8'
+        )
+        chorale_song_metadata['tunefamily'] = ''
+        chorale_song_metadata['type'] = 'vocal'
+        chorale_song_metadata['source_id'] = ''
+        return songRecords(
+            chorale_song_metadata,
+            None,
+            fieldmap = {'tunefamily':'tunefamily', 'tunefamily_full' : 'tunefamily'},
+        )
+    return metadataRecords('chorale', [choralemetadatapath], build)
 
+def chorale2seqs(startat=None, only=None, missing=False, stopat=None, jobs=1, chunksize=0, queue=None, manifest=None):
     for seq in getSequences(
         krndir=choralekrndir,
-        song_metadata=chorale_song_metadata,
-        source_metadata=None,
-        fieldmap = {'tunefamily':'tunefamily', 'tunefamily_full' : 'tunefamily'},
+        records=choraleRecords(),
         startat = startat,
         only=only,
         missing=missing,
         stopat=stopat,
+        jobs=jobs,
+        chunksize=chunksize,
+        queue=queue,
+        manifest=manifest,
     ):
         yield(seq)
 
-def thesession2seqs(startat=None, only=None, missing=False, stopat=None):
-
-    thesession_song_metadata = pd.read_csv(
-        str(thesessionmeatadatapath),
-        sep=';',
-        na_filter=False,
-        index_col=0,
-        header=None,
-        encoding='utf8'
-    )
-    thesession_song_metadata['tunefamily'] = ''
-    thesession_song_metadata['type'] = ''
-    thesession_song_metadata['source_id'] = ''
+#Metadata of the songs of thesession as records (see songRecords())
+def thesessionRecords():
+    def build():
+        thesession_song_metadata = pd.read_csv(
+            str(thesessionmeatadatapath),
+            sep=';',
+            na_filter=False,
+            index_col=0,
+            header=None,
+            encoding='utf8'
+        )
+        thesession_song_metadata['tunefamily'] = ''
+        thesession_song_metadata['type'] = ''
+        thesession_song_metadata['source_id'] = ''
+        return songRecords(
+            thesession_song_metadata,
+            None,
+            fieldmap = {'tunefamily':'tunefamily', 'tunefamily_full' : 'tunefamily'},
+        )
+    return metadataRecords('thesession', [thesessionmeatadatapath], build)
 
+def thesession2seqs(startat=None, only=None, missing=False, stopat=None, jobs=1, chunksize=0, queue=None, manifest=None):
     for seq in getSequences(
         krndir=thesessionkrndir,
-        song_metadata=thesession_song_metadata,
-        source_metadata=None,
-        fieldmap = {'tunefamily':'tunefamily', 'tunefamily_full' : 'tunefamily'},
+        records=thesessionRecords(),
         startat = startat,
         only=only,
         missing=missing,
         stopat=stopat,
+        jobs=jobs,
+        chunksize=chunksize,
+        queue=queue,
+        manifest=manifest,
     ):
         yield(seq)
 
-def kolberg2seqs(startat=None, only=None, missing=False, stopat=None):
-
-    kolberg_song_metadata = pd.read_csv(
-        str(kolbergmeatadatapath),
-        sep=';',
-        na_filter=False,
-        index_col=0,
-        header=None,
-        encoding='utf8'
-    )
-    kolberg_song_metadata['tunefamily'] = ''
-    kolberg_song_metadata['type'] = ''
-    kolberg_song_metadata['source_id'] = ''
+#Metadata of the songs of kolberg as records (see songRecords())
+def kolbergRecords():
+    def build():
+        kolberg_song_metadata = pd.read_csv(
+            str(kolbergmeatadatapath),
+            sep=';',
+            na_filter=False,
+            index_col=0,
+            header=None,
+            encoding='utf8'
+        )
+        kolberg_song_metadata['tunefamily'] = ''
+        kolberg_song_metadata['type'] = ''
+        kolberg_song_metadata['source_id'] = ''
+        return songRecords(
+            kolberg_song_metadata,
+            None,
+            fieldmap = {'tunefamily':'tunefamily', 'tunefamily_full' : 'tunefamily'},
+        )
+    return metadataRecords('kolberg', [kolbergmeatadatapath], build)
 
+def kolberg2seqs(startat=None, only=None, missing=False, stopat=None, jobs=1, chunksize=0, queue=None, manifest=None):
     for seq in getSequences(
         krndir=kolbergkrndir,
-        song_metadata=kolberg_song_metadata,
-        source_metadata=None,
-        fieldmap = {'tunefamily':'tunefamily', 'tunefamily_full' : 'tunefamily'},
+        records=kolbergRecords(),
         startat = startat,
         only=only,
         missing=missing,
         stopat=stopat,
+        jobs=jobs,
+        chunksize=chunksize,
+        queue=queue,
+        manifest=manifest,
     ):
         yield(seq)
 
-def cre2seqs(startat=None, only=None, missing=False, stopat=None):
-
-    cre_song_metadata = pd.read_csv(
-        str(cremetadatapath),
-        sep=';',
-        na_filter=False,
-        index_col=0,
-        header=None,
-        encoding='utf8'
-    )
-    cre_song_metadata['tunefamily'] = ''
-    cre_song_metadata['type'] = ''
-    cre_song_metadata['source_id'] = ''
+#Metadata of the songs of cre as records (see songRecords())
+def creRecords():
+    def build():
+        cre_song_metadata = pd.read_csv(
+            str(cremetadatapath),
+            sep=';',
+            na_filter=False,
+            index_col=0,
+            header=None,
+            encoding='utf8'
+        )
+        cre_song_metadata['tunefamily'] = ''
+        cre_song_metadata['type'] = ''
+        cre_song_metadata['source_id'] = ''
+        return songRecords(
+            cre_song_metadata,
+            None,
+            fieldmap = {'tunefamily':'tunefamily', 'tunefamily_full' : 'tunefamily'},
+        )
+    return metadataRecords('cre', [cremetadatapath], build)
 
+def cre2seqs(startat=None, only=None, missing=False, stopat=None, jobs=1, chunksize=0, queue=None, manifest=None):
     for seq in getSequences(
         krndir=crekrndir,
-        song_metadata=cre_song_metadata,
-        source_metadata=None,
-        fieldmap = {'tunefamily':'tunefamily', 'tunefamily_full' : 'tunefamily'},
+        records=creRecords(),
         startat = startat,
         only=only,
         missing=missing,
         stopat=stopat,
+        jobs=jobs,
+        chunksize=chunksize,
+        queue=queue,
+        manifest=manifest,
     ):
         yield(seq)
 
-def rism2seqs(startat=None, only=None, missing=False, stopat=None):
-
-    rism_song_metadata = pd.read_csv(
-        rismmetadatapath,
-        sep=',',
-        na_filter=False,
-        index_col=0,
-        encoding='utf8'
-    )
-    rism_song_metadata['tunefamily'] = ''
-    rism_song_metadata['type'] = ''
-    rism_song_metadata['source_id'] = ''
-
-    rism_song_metadata['sorting_year'] = pd.to_numeric(rism_song_metadata['sorting_year'])
-    rism_song_metadata['sorting_year'] = rism_song_metadata['sorting_year'].astype('Int16')
+#Metadata of the songs of rism as records (see songRecords())
+def rismRecords():
+    def build():
+        rism_song_metadata = pd.read_csv(
+            rismmetadatapath,
+            sep=',',
+            na_filter=False,
+            index_col=0,
+            encoding='utf8'
+        )
+        rism_song_metadata['tunefamily'] = ''
+        rism_song_metadata['type'] = ''
+        rism_song_metadata['source_id'] = ''
+
+        rism_song_metadata['sorting_year'] = pd.to_numeric(rism_song_metadata['sorting_year'])
+        rism_song_metadata['sorting_year'] = rism_song_metadata['sorting_year'].astype('Int16')
+        return songRecords(
+            rism_song_metadata,
+            None,
+            fieldmap = {'tunefamily':'tunefamily', 'tunefamily_full' : 'tunefamily'},
+        )
+    return metadataRecords('rism', [rismmetadatapath], build)
 
+def rism2seqs(startat=None, only=None, missing=False, stopat=None, jobs=1, chunksize=0, queue=None, manifest=None):
     for seq in getSequences(
         krndir=rismkrndir,
-        song_metadata=rism_song_metadata,
-        source_metadata=None,
-        fieldmap = {'tunefamily':'tunefamily', 'tunefamily_full' : 'tunefamily'},
+        records=rismRecords(),
         startat=startat,
         only=only,
         missing=missing,
         stopat=stopat,
+        jobs=jobs,
+        chunksize=chunksize,
+        queue=queue,
+        manifest=manifest,
     ):
         yield(seq)
 
-def eyck2seqs(startat=None, only=None, missing=False, stopat=None):
-    eyck_song_metadata = pd.read_csv(
-        str(Path(eyckroot,'metadata.csv')),
-        na_filter=False,
-        index_col=0,
-        header=0,
-        encoding='utf8',
-        delimiter=';',
-        names=[
-            "filename",
-            "songid",
-            "serial_number",
-            "serial_number_sub",
-            "title",
-            "tunefamily_id",
-            "tunefamily",
-            "variation",
-            "source_id",
-            "type",
-        ]
-    )
-    eyck_source_metadata = pd.read_csv(
-        str(Path(eyckroot,'sources.csv')),
-        na_filter=False,
-        index_col=0,
-        header=0,
-        delimiter=';',
-        encoding='utf8',
-        names=[
-            "source_id",
-            "title",
-            "author",
-            "place_publisher",
-            "dating",
-            "sorting_year",
-            "type",
-            "copy_used",
-            "scan_url"
-        ]
-    )
-    
+#Metadata of the songs of eyck as records (see songRecords())
+def eyckRecords():
+    def build():
+        eyck_song_metadata = pd.read_csv(
+            str(Path(eyckroot,'metadata.csv')),
+            na_filter=False,
+            index_col=0,
+            header=0,
+            encoding='utf8',
+            delimiter=';',
+            names=[
+                "filename",
+                "songid",
+                "serial_number",
+                "serial_number_sub",
+                "title",
+                "tunefamily_id",
+                "tunefamily",
+                "variation",
+                "source_id",
+                "type",
+            ]
+        )
+        eyck_source_metadata = pd.read_csv(
+            str(Path(eyckroot,'sources.csv')),
+            na_filter=False,
+            index_col=0,
+            header=0,
+            delimiter=';',
+            encoding='utf8',
+            names=[
+                "source_id",
+                "title",
+                "author",
+                "place_publisher",
+                "dating",
+                "sorting_year",
+                "type",
+                "copy_used",
+                "scan_url"
+            ]
+        )
+
+        return songRecords(
+            eyck_song_metadata,
+            eyck_source_metadata,
+            fieldmap = {'tunefamily':'tunefamily_id', 'tunefamily_full' : 'tunefamily'},
+        )
+    return metadataRecords('eyck', [Path(eyckroot,'metadata.csv'), Path(eyckroot,'sources.csv')], build)
+
+def eyck2seqs(startat=None, only=None, missing=False, stopat=None, jobs=1, chunksize=0, queue=None, manifest=None):
     for seq in getSequences(
         krndir=eyckkrndir,
-        song_metadata=eyck_song_metadata,
-        source_metadata=eyck_source_metadata,
-        fieldmap = {'tunefamily':'tunefamily_id', 'tunefamily_full' : 'tunefamily'},
+        records=eyckRecords(),
         startat=startat,
         only=only,
         missing=missing,
         stopat=stopat,
+        jobs=jobs,
+        chunksize=chunksize,
+        queue=queue,
+        manifest=manifest,
     ):
         yield(seq)
 
 
+#Iterators over the sequences of the collections
+#see collectionSequences()
+COLLECTIONS = {
+    'mtcann' : ann2seqs,
+    'mtcfsinst' : fsinst2seqs,
+    'essen' : essen2seqs,
+    'chorales' : chorale2seqs,
+    'thesession' : thesession2seqs,
+    'kolberg' : kolberg2seqs,
+    'cre' : cre2seqs,
+    'rism' : rism2seqs,
+    'eyck' : eyck2seqs,
+}
+
+### Library interface
+#
+#  import mtc_to_seqs
+#  mtc_to_seqs.configure(['-mtcroot', '/data/MTC', '-features', 'midipitch,duration'])
+#  seq = mtc_to_seqs.extractFeatures('song.krn', metadata={'tunefamily': '1234_0'})
+#  for seq in mtc_to_seqs.collectionSequences('essen', jobs=4):
+#      ...
+#
+#Importing the module does not parse the command line and does not import music21 or
+#pandas. Without configure() the defaults of all options are used.
+
+#Extract the features of one .krn file
+#returns the sequence (dict, as written by mtc_to_seqs.py), or None if the song could
+#not be processed
+#metadata: dict with the song-level fields (id, tunefamily, tunefamily_full, type, year,
+#  origin, ann_bgcorpus). Default id: name of the file without .krn
+#features: list of features. Default: the features selected with -features (all)
+#textFeatureFile: .jsonl(.gz) file with text features (see GetTextFeatures)
+#failure: see extractSong()
+def extractFeatures(krnpath, metadata=None, features=None, textFeatureFile=None, failure=None):
+    metadata = dict(metadata or {})
+    krnpath = str(krnpath)
+    record = {
+        'filename': os.path.basename(krnpath),
+        'tunefamily': '',
+        'tunefamily_full': '',
+        'type': '',
+        'year': -1,
+        'origin': '',
+        'ann_bgcorpus': None,
+    }
+    record.update((key, value) for key, value in metadata.items() if key in record)
+    nlbid = metadata.get('id', os.path.basename(krnpath).replace('.krn', ''))
+    return extractSong(
+        nlbid,
+        record,
+        krndir=os.path.dirname(krnpath),
+        textFeatureFile=textFeatureFile,
+        failure=failure,
+        features=FeatureSelection(features) if features is not None else None,
+    )
+
+#(function that returns the records, krndir, text feature file) of a collection (a key
+#of COLLECTIONS), with the paths set by configure()
+def collectionSource(collection):
+    return {
+        'mtcann' : (annRecords, mtcannkrndir, str(mtcanntextfeatspath)),
+        'mtcfsinst' : (fsinstRecords, mtcfskrndir, str(mtcfsinsttextfeatspath)),
+        'essen' : (essenRecords, essenkrndir, None),
+        'chorales' : (choraleRecords, choralekrndir, None),
+        'thesession' : (thesessionRecords, thesessionkrndir, None),
+        'kolberg' : (kolbergRecords, kolbergkrndir, None),
+        'cre' : (creRecords, crekrndir, None),
+        'rism' : (rismRecords, rismkrndir, None),
+        'eyck' : (eyckRecords, eyckkrndir, None),
+    }[collection]
+
+#Iterator over the sequences of a collection (a key of COLLECTIONS)
+#kwargs: see getSequences() (startat, stopat, only, missing, jobs, chunksize, queue, manifest)
+def collectionSequences(collection, **kwargs):
+    return COLLECTIONS[collection](**kwargs)
+
+#WorkQueue for the collection if -queue is given, otherwise None
+def getQueue(collection):
+    if not args.queue:
+        return None
+    queue = WorkQueue(args.queue, collection, batchsize=args.batchsize, leaseseconds=args.leaseseconds)
+    if args.requeuefailed:
+        queue.requeueFailed()
+    return queue
+
+#Name of the output file of a collection, without extension
+#with a queue, every worker writes its own file
+def sequencesFilename(name, queue):
+    return f'{name}_sequences{"_from"+args.startat if args.startat else ""}{"_"+queue.owner if queue else ""}'
+
+#Write the sequences to <name>_sequences....parquet (-parquet) or
+#<name>_sequences....mtcstore (-store) in outputpath
+#seqs2file: function queue -> iterator over the sequences
+#with a queue, songs are done when the file is complete
+def writeSequencesFile(seqs2file, name, queue):
+    #imported here: parquetwriter imports pyarrow
+    from parquetwriter import ParquetWriter
+    from featurestore import FeatureStoreWriter
+    if queue is not None:
+        queue = DeferredDoneQueue(queue)
+    if args.parquet:
+        writer = ParquetWriter(Path(outputpath, sequencesFilename(name, queue)+'.parquet'), rowgroupsize=args.rowgroupsize)
+    else:
+        writer = FeatureStoreWriter(Path(outputpath, sequencesFilename(name, queue)+'.mtcstore'))
+    ids = []
+    with writer:
+        for seq in seqs2file(queue):
+            writer.write(seq)
+            ids.append(seq['id'])
+    if queue is not None:
+        queue.commit(ids)
+
+#SongManifest for the collection if -incremental is given, otherwise None
+def getManifest(collection):
+    if not args.incremental:
+        return None
+    os.makedirs(outputpath, exist_ok=True)
+    return SongManifest(Path(outputpath, f'{collection}_manifest.sqlite'))
+
+#Write every sequence to its own .json file in outputpath, or to shards with -shards,
+#or to one file in outputpath with -parquet or -store
+#filename: function seq -> path of the .json file relative to outputpath (default: <id>.json)
+def writeSongFiles(seqs2file, collection, filename=None):
+    if timingReport is not None:
+        timingReport.begin(collection)
+    queue = getQueue(collection)
+    if args.parquet or args.store:
+        writeSequencesFile(seqs2file, collection, queue)
+        return
+    if args.shards:
+        #A run of the whole collection writes a new generation of shards, and removes the
+        #earlier generations when it is done. Other runs add to the latest generation.
+        latest = latestGeneration(outputpath, collection)
+        partial = args.missing or args.startat or args.stopat or args.only
+        generation = 0 if latest is None else latest if partial else latest + 1
+        if queue is not None:
+            #all workers write the generation of the first worker
+            generation = queue.generation(generation)
+            #with a queue, songs are done when the shard with their sequences is complete
+            queue = DeferredDoneQueue(queue)
+        oncommit = queue.commit if queue is not None else None
+        with ShardWriter(outputpath, shardPrefix(collection), collection=collection, generation=generation, maxbytes=args.shardsize*1024**2, threads=args.compressthreads, oncommit=oncommit) as writer:
+            for seq in seqs2file(queue):
+                writer.write(seq['id'], json.dumps(seq)+'\n')
+        removeOldGenerations(outputpath, collection, generation)
+        return
+    manifest = getManifest(collection)
+    for seq in seqs2file(queue, manifest=manifest):
+        if filename is not None:
+            outfilename = Path(outputpath, filename(seq))
+            outfilename.parent.mkdir(parents=True, exist_ok=True)
+        else:
+            outfilename = os.path.join(outputpath, f'{seq["id"]}.json')
+        with open(outfilename, 'w') as outfile:
+            outfile.write(json.dumps(seq)+'\n')
+        if manifest is not None:
+            manifest.commit(seq['id'], outfilename)
 
 def main():
+    configure(sys.argv[1:])
+
+    collections = {
+        'mtcann' : args.gen_mtcann,
+        'mtcfsinst' : args.gen_mtcfsinst,
+        'essen' : args.gen_essen,
+        'chorales' : args.gen_chorales,
+        'thesession' : args.gen_thesession,
+        'kolberg' : args.gen_kolberg,
+        'cre' : args.gen_cre,
+        'rism' : args.gen_rism,
+        'eyck' : args.gen_eyck,
+    }
+
     # MTC-LC-1.0 does not have a key tandem in the *kern files. Therefore not possible to compute scale degrees.
     #lc_seqs = lc2seqs()
     #with open('mtclc_sequences.json', 'w') as outfile:
     #    json.dump(lc_seqs, outfile)
 
+    if imaCache is not None:
+        imaCacheStats = imaCache.stats()
+
+    if args.failuresummary:
+        for stage, error, n, ids in failureLedger.summary():
+            print(f"{stage} {error}: {n} ({', '.join(ids)}{', ...' if n > len(ids) else ''})")
+        return
+
+    if args.queuestatus:
+        for collection, selected in collections.items():
+            if selected:
+                counts = getQueue(collection).counts()
+                print(collection, ', '.join(f'{status}: {n}' for status, n in sorted(counts.items())))
+        return
+
     if args.gen_mtcann:
-        with open(f'mtcann_sequences{"_from"+args.startat if args.startat else ""}.jsonl', 'w') as outfile:
-            for seq in ann2seqs(startat=args.startat, only=args.only, missing=args.missing, stopat=args.stopat):
-                outfile.write(json.dumps(seq)+'\n')
+        if timingReport is not None:
+            timingReport.begin('mtcann')
+        queue = getQueue('mtcann')
+        seqs2file = lambda queue: ann2seqs(startat=args.startat, only=args.only, missing=args.missing, stopat=args.stopat, jobs=args.jobs, chunksize=args.chunksize, queue=queue)
+        if args.parquet or args.store:
+            writeSequencesFile(seqs2file, 'mtcann', queue)
+        else:
+            with open(sequencesFilename('mtcann', queue)+'.jsonl', 'w') as outfile:
+                for seq in seqs2file(queue):
+                    outfile.write(json.dumps(seq)+'\n')
 
     if args.gen_mtcfsinst:
         #with open(f'mtcfsinst_sequences{"_from"+args.startat if args.startat else ""}.jsonl', 'w') as outfile:
-        for seq in fsinst2seqs(startat=args.startat, only=args.only, missing=args.missing, stopat=args.stopat):
-            with open(os.path.join(outputpath, f'{seq["id"]}.json'), 'w') as outfile:
-                outfile.write(json.dumps(seq)+'\n')
+        writeSongFiles(
+            lambda queue, manifest=None: fsinst2seqs(startat=args.startat, only=args.only, missing=args.missing, stopat=args.stopat, jobs=args.jobs, chunksize=args.chunksize, queue=queue, manifest=manifest),
+            'mtcfsinst'
+        )
             
     if args.gen_essen:
         #with open(f'essen_sequences{"_from"+args.startat if args.startat else ""}.jsonl', 'w') as outfile:
-        for seq in essen2seqs(startat=args.startat, only=args.only, missing=args.missing, stopat=args.stopat):
-            with open(os.path.join(outputpath, f'{seq["id"]}.json'), 'w') as outfile:
-                outfile.write(json.dumps(seq)+'\n')
+        writeSongFiles(
+            lambda queue, manifest=None: essen2seqs(startat=args.startat, only=args.only, missing=args.missing, stopat=args.stopat, jobs=args.jobs, chunksize=args.chunksize, queue=queue, manifest=manifest),
+            'essen'
+        )
 
     if args.gen_chorales:
-        with open(f'chorale_sequences{"_from"+args.startat if args.startat else ""}.jsonl', 'w') as outfile:
-            for seq in chorale2seqs(startat=args.startat, only=args.only, missing=args.missing, stopat=args.stopat):
-                outfile.write(json.dumps(seq)+'\n')
+        if timingReport is not None:
+            timingReport.begin('chorales')
+        queue = getQueue('chorales')
+        seqs2file = lambda queue: chorale2seqs(startat=args.startat, only=args.only, missing=args.missing, stopat=args.stopat, jobs=args.jobs, chunksize=args.chunksize, queue=queue)
+        if args.parquet or args.store:
+            writeSequencesFile(seqs2file, 'chorale', queue)
+        else:
+            with open(sequencesFilename('chorale', queue)+'.jsonl', 'w') as outfile:
+                for seq in seqs2file(queue):
+                    outfile.write(json.dumps(seq)+'\n')
 
     if args.gen_thesession:
         #with open(f'thesession_sequences{"_from"+args.startat if args.startat else ""}.jsonl', 'w') as outfile:
-        for seq in thesession2seqs(startat=args.startat, only=args.only, missing=args.missing, stopat=args.stopat):
-            with open(os.path.join(outputpath, f'{seq["id"]}.json'), 'w') as outfile:
-                outfile.write(json.dumps(seq)+'\n')
+        writeSongFiles(
+            lambda queue, manifest=None: thesession2seqs(startat=args.startat, only=args.only, missing=args.missing, stopat=args.stopat, jobs=args.jobs, chunksize=args.chunksize, queue=queue, manifest=manifest),
+            'thesession'
+        )
 
     if args.gen_kolberg:
         #with open(f'kolberg_sequences{"_from"+args.startat if args.startat else ""}.jsonl', 'w') as outfile:
-        for seq in kolberg2seqs(startat=args.startat, only=args.only, missing=args.missing, stopat=args.stopat):
-            with open(os.path.join(outputpath, f'{seq["id"]}.json'), 'w') as outfile:
-                outfile.write(json.dumps(seq)+'\n')
+        writeSongFiles(
+            lambda queue, manifest=None: kolberg2seqs(startat=args.startat, only=args.only, missing=args.missing, stopat=args.stopat, jobs=args.jobs, chunksize=args.chunksize, queue=queue, manifest=manifest),
+            'kolberg'
+        )
 
     if args.gen_cre:
         #with open(f'cre_sequences{"_from"+args.startat if args.startat else ""}.jsonl', 'w') as outfile:
-        for seq in cre2seqs(startat=args.startat, only=args.only, missing=args.missing, stopat=args.stopat):
-            with open(os.path.join(outputpath, f'{seq["id"]}.json'), 'w') as outfile:
-                outfile.write(json.dumps(seq)+'\n')
+        writeSongFiles(
+            lambda queue, manifest=None: cre2seqs(startat=args.startat, only=args.only, missing=args.missing, stopat=args.stopat, jobs=args.jobs, chunksize=args.chunksize, queue=queue, manifest=manifest),
+            'cre'
+        )
 
     if args.gen_rism:
-        rism_song_metadata = pd.read_csv( #needed for file paths
-            rismmetadatapath,
-            sep=',',
-            na_filter=False,
-            index_col=0,
-            encoding='utf8'
-        )
+        rism_records = rismRecords() #needed for file paths
         #with open(f'rism_sequences{"_from"+args.startat if args.startat else ""}.jsonl', 'w') as outfile:
-        for seq in rism2seqs(startat=args.startat, only=args.only, missing=args.missing, stopat=args.stopat):
-            outfilename = Path(outputpath, rism_song_metadata.loc[seq['id'],'filename'].replace('.krn','.json')) #.json
-            outfilename.parent.mkdir(parents=True, exist_ok=True)
-            with open(outfilename, 'w') as outfile:
-                outfile.write(json.dumps(seq)+'\n')
+        writeSongFiles(
+            lambda queue, manifest=None: rism2seqs(startat=args.startat, only=args.only, missing=args.missing, stopat=args.stopat, jobs=args.jobs, chunksize=args.chunksize, queue=queue, manifest=manifest),
+            'rism',
+            filename=lambda seq: rism_records[seq['id']]['filename'].replace('.krn','.json') #.json
+        )
 
     if args.gen_eyck:
         #with open(f'eyck_sequences{"_from"+args.startat if args.startat else ""}.jsonl', 'w') as outfile:
-        for seq in eyck2seqs(startat=args.startat, only=args.only, missing=args.missing, stopat=args.stopat):
-            with open(os.path.join(outputpath, f'{seq["id"]}.json'), 'w') as outfile:
-                outfile.write(json.dumps(seq)+'\n')
+        writeSongFiles(
+            lambda queue, manifest=None: eyck2seqs(startat=args.startat, only=args.only, missing=args.missing, stopat=args.stopat, jobs=args.jobs, chunksize=args.chunksize, queue=queue, manifest=manifest),
+            'eyck'
+        )
+
+    if imaCache is not None:
+        #counts of all workers, also on other hosts using the same cache
+        stats = imaCache.stats()
+        print(f"IMA cache: {stats['hits']-imaCacheStats['hits']} hits, {stats['misses']-imaCacheStats['misses']} misses, {stats['entries']} entries, {stats['size']/1024**2:.1f} MB")
+
+    if timingReport is not None:
+        timingReport.write(args.timings)
+        print(f"Timings written to {args.timings}")
+
+#defaults of all options, until configure() is called
+configure()
 
 if __name__== "__main__":
     main()
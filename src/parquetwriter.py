@@ -0,0 +1,189 @@
+import os
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError: #only needed for -parquet
+    pa = None
+    pq = None
+
+#Writes sequences to a Parquet file, one row per song.
+#
+#The song-level fields are plain columns. Every feature in seq['features'] is a column
+#of type list<type>, with None entries as nulls (validity bitmap). A single feature of a
+#whole corpus can be read without reading the other features (see readParquet()).
+#A song without a feature (e.g. without lyrics) has a null list in that column.
+#
+#Sequences are collected in row groups of rowgroupsize songs. The file is written as a
+#temporary file, which is renamed by close(). If the writer is used as context manager
+#and the block raises, the temporary file is removed instead (see discard()).
+
+#Types of the song-level fields
+SONG_TYPES = {
+    'id': 'string',
+    'tunefamily': 'string',
+    'tunefamily_full': 'string',
+    'year': 'int64',
+    'type': 'string',
+    'freemeter': 'bool',
+    'origin': 'string',
+    'ann_bgcorpus': 'bool',
+}
+
+#Types of the values in the feature lists
+FEATURE_TYPES = {
+    'pitch': 'string',
+    'octave': 'int64',
+    'midipitch': 'int64',
+    'contour3': 'string',
+    'contour5': 'string',
+    'pitch40_hewlett': 'int64',
+    'pitch40_sapp': 'int64',
+    'tonic': 'string',
+    'mode': 'string',
+    'scaledegree': 'int64',
+    'scaledegreespecifier': 'string',
+    'chromaticscaledegree': 'int64',
+    'diatonicpitch': 'int64',
+    'diatonicpitch12': 'int64',
+    'diatonicpitch40': 'int64',
+    'diatonicinterval': 'int64',
+    'chromaticinterval': 'int64',
+    'pitchproximity': 'int64',
+    'pitchreversal': 'float64',
+    'onsettick': 'int64',
+    'duration': 'float64',
+    'duration_frac': 'string',
+    'duration_fullname': 'string',
+    'durationcontour': 'string',
+    'IOI_frac': 'string',
+    'IOI': 'float64',
+    'IOR_frac': 'string',
+    'IOR': 'float64',
+    'nextisrest': 'bool',
+    'restduration_frac': 'string',
+    'timesignature': 'string',
+    'beat_str': 'string',
+    'beat_fraction_str': 'string',
+    'beat': 'float64',
+    'beatfraction': 'string',
+    'beatinsong': 'string',
+    'beatinphrase': 'string',
+    'beatinphrase_end': 'string',
+    'beatstrength': 'float64',
+    'metriccontour': 'string',
+    'imaweight': 'float64',
+    'imaweight_spectral': 'float64',
+    'imacontour': 'string',
+    'songpos': 'float64',
+    'phrasepos': 'float64',
+    'phrase_ix': 'int64',
+    'phrase_end': 'bool',
+    'gpr2a_Frankland': 'float64',
+    'gpr2b_Frankland': 'float64',
+    'gpr3a_Frankland': 'float64',
+    'gpr3d_Frankland': 'float64',
+    'gpr_Frankland_sum': 'float64',
+    'lbdm_spitch': 'float64',
+    'lbdm_sioi': 'float64',
+    'lbdm_srest': 'float64',
+    'lbdm_rpitch': 'float64',
+    'lbdm_rioi': 'float64',
+    'lbdm_rrest': 'float64',
+    'lbdm_boundarystrength': 'float64',
+    #text features
+    'lyrics': 'string',
+    'noncontentword': 'bool',
+    'wordend': 'bool',
+    'phoneme': 'string',
+    'rhymes': 'bool',
+    'rhymescontentwords': 'bool',
+    'wordstress': 'bool',
+    'melismastate': 'string',
+}
+
+#pyarrow names that differ from the type names above
+PA_TYPES = {
+    'bool': 'bool_',
+}
+
+def _type(name):
+    return getattr(pa, PA_TYPES.get(name, name))()
+
+def seqSchema():
+    fields = [pa.field(name, _type(t)) for name, t in SONG_TYPES.items()]
+    fields += [pa.field(name, pa.list_(_type(t))) for name, t in FEATURE_TYPES.items()]
+    return pa.schema(fields)
+
+class ParquetWriter():
+    def __init__(self, path, rowgroupsize=1000, compression='zstd'):
+        if pa is None:
+            raise ImportError('pyarrow is needed for Parquet output')
+        self.path = str(path)
+        self.rowgroupsize = rowgroupsize
+        self.schema = seqSchema()
+        self.rows = []
+        self.closed = False
+        dirname = os.path.dirname(self.path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self.writer = pq.ParquetWriter(self.path + '.tmp', self.schema, compression=compression)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def _writeRowGroup(self):
+        if not self.rows:
+            return
+        columns = []
+        for name in SONG_TYPES:
+            columns.append([seq.get(name) for seq in self.rows])
+        for name in FEATURE_TYPES:
+            columns.append([seq['features'].get(name) for seq in self.rows])
+        arrays = [pa.array(column, type=field.type) for column, field in zip(columns, self.schema)]
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+        self.rows = []
+
+    def write(self, seq):
+        unknown = seq['features'].keys() - FEATURE_TYPES.keys()
+        if unknown:
+            raise ValueError(f"{seq['id']}: no Parquet type for features: {', '.join(sorted(unknown))}")
+        self.rows.append(seq)
+        if len(self.rows) >= self.rowgroupsize:
+            self._writeRowGroup()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._writeRowGroup()
+        self.writer.close()
+        os.replace(self.path + '.tmp', self.path)
+
+    #Close without publishing the file (e.g. after an error): the temporary file is removed
+    def discard(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.rows = []
+        try:
+            self.writer.close()
+        finally:
+            if os.path.exists(self.path + '.tmp'):
+                os.remove(self.path + '.tmp')
+
+#Read a Parquet file written by ParquetWriter as a pandas DataFrame
+#features: list of features to read (default: all). The song-level fields are always read.
+def readParquet(path, features=None):
+    if pq is None:
+        raise ImportError('pyarrow is needed to read Parquet files')
+    columns = None
+    if features is not None:
+        columns = list(SONG_TYPES) + list(features)
+    return pq.read_table(str(path), columns=columns).to_pandas()
@@ -0,0 +1,225 @@
+import os
+import gzip
+import json
+import socket
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+#Writes sequences (lines of json) to gzip compressed shards of bounded size, instead of
+#one file per song.
+#
+#Lines are collected in chunks of chunkbytes. Every chunk is compressed as a separate gzip
+#member on a background thread (zlib releases the GIL). The members are written in order;
+#a sequence of gzip members is a valid gzip file. If a shard reaches maxbytes (compressed),
+#it is closed and a new shard is started.
+#A shard is written as a temporary file, which is renamed when the shard is complete. After
+#every completed shard, the manifest is written (also with temp-then-rename). The manifest
+#lists the shards with their number of records, size and the ids of the records.
+#oncommit(ids) is called after a shard is complete.
+#If the with block raises, the incomplete shard is removed; the manifest and oncommit are
+#not updated for it.
+#
+#The manifest also has the collection and the generation of the run. A run that writes the
+#whole collection starts a new generation, other runs (e.g. with -missing) add to the latest
+#generation (see latestGeneration()). readShards() only reads the latest generation of every
+#collection, and removeOldGenerations() removes the shards of the other generations.
+#
+#Shard files: <prefix>-<shardno>.jsonl.gz
+#Manifest:    <prefix>.manifest.json
+class ShardWriter():
+    def __init__(self, outputdir, prefix, collection=None, generation=0, maxbytes=256*1024**2, chunkbytes=1024**2, threads=4, compresslevel=6, oncommit=None):
+        self.outputdir = str(outputdir)
+        self.prefix = prefix
+        self.collection = collection
+        self.generation = generation
+        self.created = time.time()
+        self.maxbytes = maxbytes
+        self.chunkbytes = chunkbytes
+        self.compresslevel = compresslevel
+        self.oncommit = oncommit
+        os.makedirs(self.outputdir, exist_ok=True)
+        self.executor = ThreadPoolExecutor(threads)
+        self.maxpending = 2 * threads
+        self.pending = deque() #(future with compressed chunk, ids)
+        self.chunk = []
+        self.chunkids = []
+        self.chunksize = 0
+        self.shards = [] #manifest entries
+        self.shardfile = None
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def _shardname(self, shardno):
+        return f'{self.prefix}-{shardno:05d}.jsonl.gz'
+
+    def _startShard(self):
+        name = self._shardname(len(self.shards))
+        self.shardfile = open(os.path.join(self.outputdir, name + '.tmp'), 'wb')
+        self.shards.append({'file': name, 'records': 0, 'bytes': 0, 'ids': []})
+
+    def _finishShard(self):
+        shard = self.shards[-1]
+        self.shardfile.flush()
+        os.fsync(self.shardfile.fileno())
+        self.shardfile.close()
+        self.shardfile = None
+        path = os.path.join(self.outputdir, shard['file'])
+        os.replace(path + '.tmp', path)
+        self._writeManifest()
+        if self.oncommit is not None:
+            self.oncommit(shard['ids'])
+
+    def _writeManifest(self):
+        path = os.path.join(self.outputdir, f'{self.prefix}.manifest.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'prefix': self.prefix, 'collection': self.collection, 'generation': self.generation, 'created': self.created, 'shards': self.shards}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+
+    #write the oldest compressed chunk to the current shard
+    def _writeOldest(self):
+        future, ids = self.pending.popleft()
+        data = future.result()
+        if self.shardfile is None:
+            self._startShard()
+        self.shardfile.write(data)
+        shard = self.shards[-1]
+        shard['records'] += len(ids)
+        shard['bytes'] += len(data)
+        shard['ids'].extend(ids)
+        if shard['bytes'] >= self.maxbytes:
+            self._finishShard()
+
+    def _submitChunk(self):
+        if not self.chunk:
+            return
+        data = ''.join(self.chunk).encode('utf8')
+        self.pending.append((self.executor.submit(gzip.compress, data, self.compresslevel, mtime=0), self.chunkids))
+        self.chunk = []
+        self.chunkids = []
+        self.chunksize = 0
+        #bound the memory
+        while len(self.pending) > self.maxpending or (self.pending and self.pending[0][0].done()):
+            self._writeOldest()
+
+    #line: json of one sequence, ending with newline
+    def write(self, seqid, line):
+        self.chunk.append(line)
+        self.chunkids.append(seqid)
+        self.chunksize += len(line)
+        if self.chunksize >= self.chunkbytes:
+            self._submitChunk()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self._submitChunk()
+            while self.pending:
+                self._writeOldest()
+            if self.shardfile is not None:
+                self._finishShard()
+        finally:
+            self.executor.shutdown()
+
+    #Stop without completing the current shard: its temporary file is removed. Completed
+    #shards are kept.
+    def discard(self):
+        if self.closed:
+            return
+        self.closed = True
+        for future, _ in self.pending:
+            future.cancel()
+        self.pending.clear()
+        self.executor.shutdown()
+        if self.shardfile is not None:
+            self.shardfile.close()
+            self.shardfile = None
+            os.remove(os.path.join(self.outputdir, self.shards.pop()['file'] + '.tmp'))
+
+#returns set of the ids in the latest generation of the shards in outputdir
+def shardedIds(outputdir):
+    ids = set()
+    for manifest in readManifests(outputdir):
+        for shard in manifest['shards']:
+            ids.update(shard['ids'])
+    return ids
+
+#returns list of all manifests in outputdir, oldest first, with the path of the manifest
+#as 'path'. Manifests of older versions have no collection, generation and created.
+def _allManifests(outputdir):
+    manifests = []
+    if not os.path.isdir(outputdir):
+        return manifests
+    for filename in sorted(os.listdir(outputdir)):
+        if filename.endswith('.manifest.json'):
+            path = os.path.join(outputdir, filename)
+            with open(path) as f:
+                manifest = json.load(f)
+            manifest['path'] = path
+            manifests.append(manifest)
+    return sorted(manifests, key=lambda manifest: manifest.get('created', 0))
+
+#returns the latest generation of the shards of collection in outputdir, or None if there
+#are no shards of the collection
+def latestGeneration(outputdir, collection):
+    return max((manifest.get('generation', 0) for manifest in _allManifests(outputdir) if manifest.get('collection') == collection), default=None)
+
+#returns list of the manifests of the latest generation of every collection, oldest first
+def readManifests(outputdir):
+    manifests = _allManifests(outputdir)
+    latest = {}
+    for manifest in manifests:
+        collection = manifest.get('collection')
+        latest[collection] = max(latest.get(collection, 0), manifest.get('generation', 0))
+    return [manifest for manifest in manifests if manifest.get('generation', 0) == latest[manifest.get('collection')]]
+
+#Iterator over the sequences (dicts) in the latest generation of the shards in outputdir.
+#A song that is in several shards (e.g. a song that was done again after its lease expired)
+#is read from the newest shard only.
+def readShards(outputdir):
+    manifests = readManifests(outputdir)
+    newest = {}
+    for manifest in manifests:
+        for shard in manifest['shards']:
+            for seqid in shard['ids']:
+                newest[seqid] = shard['file']
+    for manifest in manifests:
+        for shard in manifest['shards']:
+            with gzip.open(os.path.join(outputdir, shard['file']), 'rt', encoding='utf8') as f:
+                for line in f:
+                    seq = json.loads(line)
+                    if newest[seq['id']] == shard['file']:
+                        yield seq
+
+#Remove the manifests and shards of collection in outputdir with another generation than
+#generation. Several workers may do this at the same time.
+def removeOldGenerations(outputdir, collection, generation):
+    for manifest in _allManifests(outputdir):
+        if manifest.get('collection') != collection or manifest.get('generation', 0) == generation:
+            continue
+        for shard in manifest['shards']:
+            try:
+                os.remove(os.path.join(outputdir, shard['file']))
+            except FileNotFoundError:
+                pass
+        try:
+            os.remove(manifest['path'])
+        except FileNotFoundError:
+            pass
+
+#Prefix for the shards of a run. Unique, such that runs (e.g. with -missing) and workers
+#on several hosts do not overwrite each other's shards.
+def shardPrefix(collection):
+    return f'{collection}_{socket.gethostname()}_{os.getpid()}_{int(time.time())}'
@@ -0,0 +1,399 @@
+import numpy as np
+from fractions import Fraction
+from math import gcd
+from bisect import bisect_right
+from functools import lru_cache
+
+from lazymodule import LazyModule
+from kernparser import KernEvent
+
+m21 = LazyModule('music21') #imported on first use
+
+def lcm(a, b):
+    """Computes the lowest common multiple."""
+    return a * b // gcd(a, b)
+
+def fraction_gcd(x, y):
+    """Computes the greatest common divisor as Fraction"""
+    a = x.numerator
+    b = x.denominator
+    c = y.numerator
+    d = y.denominator
+    return Fraction(gcd(a, c), lcm(b, d))
+
+def fraction_str(numerators, denominators, mask=None):
+    """Renders numerators / denominators (integer arrays or scalars) as str(Fraction).
+    Positions where mask is False become None."""
+    numerators, denominators = np.broadcast_arrays(np.asarray(numerators, dtype=np.int64), np.asarray(denominators, dtype=np.int64))
+    g = np.gcd(numerators, denominators)
+    res = [str(n) if d == 1 else f'{n}/{d}' for n, d in zip((numerators // g).tolist(), (denominators // g).tolist())]
+    if mask is not None:
+        res = [r if m else None for r, m in zip(res, np.broadcast_to(mask, len(res)).tolist())]
+    return res
+
+#as music21.common.opFrac(): float if the denominator is a power of two, otherwise Fraction.
+#A float that is not a fraction with a small denominator (e.g. 1/3 + 0.0) becomes the nearest
+#Fraction with a denominator up to 65535.
+def opFrac(x):
+    if isinstance(x, float):
+        if x.as_integer_ratio()[1] <= 65535:
+            return x
+        return Fraction(x).limit_denominator(65535)
+    x = Fraction(x)
+    d = x.denominator
+    if d & (d - 1) == 0:
+        return x.numerator / d
+    return x
+
+#left padding of a measure as music21 has it: float, or Fraction for tuplets (opFrac)
+def _padding(paddingLeft):
+    if isinstance(paddingLeft, Fraction):
+        return opFrac(paddingLeft) if paddingLeft != 0 else 0.0
+    return paddingLeft
+
+#Duration.fullName of the plain and dotted note values, from 64th to breve
+_durationNames = {'Breve': Fraction(8), 'Whole': Fraction(4), 'Half': Fraction(2), 'Quarter': Fraction(1), 'Eighth': Fraction(1, 2), '16th': Fraction(1, 4), '32nd': Fraction(1, 8), '64th': Fraction(1, 16)}
+_fullNames = {}
+for _name, _ql in _durationNames.items():
+    _fullNames[_ql] = _name
+    _fullNames[_ql * Fraction(3, 2)] = 'Dotted ' + _name
+    _fullNames[_ql * Fraction(7, 4)] = 'Double Dotted ' + _name
+
+#Duration.fullName of a quarterLength (e.g. 'Dotted Quarter'). music21 only for other
+#durations (tuplets, tied values).
+@lru_cache(maxsize=None)
+def _fullName(ql):
+    fullname = _fullNames.get(Fraction(ql))
+    if fullname is None:
+        fullname = m21.duration.Duration(ql).fullName
+    return fullname
+
+#Time signature of a KernMelody, with the attributes and beat properties of the default
+#music21 TimeSignature of the same ratio (beat partition and accent weights), computed
+#without music21.
+#The accent sequence of music21 divides the bar in three levels. The first beat has weight 1,
+#the starts of the divisions of the levels 1/2, 1/4 and 1/8, other positions 1/16.
+class KernTimeSignature():
+    #numerator -> number of divisions on each level of the accent sequence (as music21)
+    accentDivisions = {
+        1: (2, 2, 2), 2: (2, 2, 2), 3: (3, 2, 2), 4: (2, 2, 2), 5: (5, 2, 2), 6: (2, 3, 2),
+        7: (7, 2, 2), 8: (2, 2, 2), 9: (3, 3, 2), 10: (10, 2, 2), 11: (11, 2, 2), 12: (2, 2, 3),
+        13: (13, 2, 2), 14: (14, 2, 2), 15: (5, 3, 2), 16: (2, 2, 2), 17: (17, 2, 2), 18: (6, 3, 2),
+    }
+
+    def __init__(self, numerator, denominator):
+        self.numerator = numerator
+        self.denominator = denominator
+        self.ratioString = f'{numerator}/{denominator}'
+        self.barDuration = Fraction(4 * numerator, denominator)
+        #compound meters have beats of three units; 3/4 and 3/2 have three beats
+        if numerator == 3 and denominator >= 8:
+            self.beatCount = 1
+        elif numerator in (6, 9, 12) or (numerator >= 15 and numerator % 3 == 0):
+            self.beatCount = numerator // 3
+        else:
+            self.beatCount = numerator
+        self.beatDuration = self.barDuration / self.beatCount
+        level1, level2, level3 = self.accentDivisions[numerator]
+        self.accentLevels = (level2 * level3, level3)
+        self.accentStep = self.barDuration / (level1 * level2 * level3)
+
+    #returns the time signature, or a music21 TimeSignature for the meters that are not known
+    #(other numerators, and denominators outside 2-16, where music21 matches offsets differently)
+    @classmethod
+    def make(cls, numerator, denominator):
+        if numerator in cls.accentDivisions and denominator in (2, 4, 8, 16):
+            return cls(numerator, denominator)
+        return m21.meter.TimeSignature(f'{numerator}/{denominator}')
+
+    #returns the beat (as getBeatProportion()), beat string (getBeatProportionStr()), accent
+    #weight (getAccentWeight(forcePositionMatch=True)) and beat duration of an offset in the bar
+    def beatProperties(self, measureoffset):
+        measureoffset = Fraction(opFrac(measureoffset))
+        beatindex, progress = divmod(measureoffset, self.beatDuration)
+        proportion = progress / self.beatDuration
+        beat = opFrac(beatindex + 1 + proportion)
+        if proportion == 0:
+            beatstr = f'{beatindex + 1}'
+        else:
+            #as music21: the nearest fraction with a denominator up to 16 of the proportion
+            #computed in floats (which decides ties)
+            proportion = (float(measureoffset) - float(beatindex * self.beatDuration)) / float(self.beatDuration)
+            proportion = Fraction(proportion).limit_denominator(16)
+            beatstr = f'{beatindex + 1} {proportion.numerator}/{proportion.denominator}'
+        division, rest = divmod(measureoffset, self.accentStep)
+        if rest != 0:
+            weight = 0.0625
+        elif division == 0:
+            weight = 1.0
+        elif division % self.accentLevels[0] == 0:
+            weight = 0.5
+        elif division % self.accentLevels[1] == 0:
+            weight = 0.25
+        else:
+            weight = 0.125
+        return beat, beatstr, weight, opFrac(self.beatDuration)
+
+#Key of a KernMelody, with the attributes of music21's Key that the features use
+class KernKey():
+    #keystring: as in *X:, e.g. 'G', 'e-'
+    def __init__(self, keystring):
+        alter = keystring.count('#') - keystring.count('-')
+        #the tonic has name, midi and diatonicNoteNum, in the implicit octave of music21 (4)
+        self.tonic = KernEvent(False, keystring[0].upper(), alter, 4, None, None, None, None)
+        self.mode = 'major' if keystring[0].isupper() else 'minor'
+
+#beat properties of a music21 TimeSignature at an offset in the bar (see KernTimeSignature)
+def _beatProperties(ts, measureoffset):
+    if isinstance(ts, KernTimeSignature):
+        return ts.beatProperties(measureoffset)
+    return (
+        ts.getBeatProportion(measureoffset),
+        ts.getBeatProportionStr(measureoffset),
+        ts.getAccentWeight(measureoffset, forcePositionMatch=True, permitMeterModulus=False),
+        ts.getBeatDuration(measureoffset).quarterLength,
+    )
+
+#Everything the feature extractors need to know about a song, collected in one traversal
+#of the flat stream.
+#Numbers per note are in NumPy arrays, strings and music21 values (offsets and durations,
+#which are float or Fraction) are in lists, such that the features are exactly the same
+#as computed from the stream. The time signatures and keys are music21 objects, or
+#KernTimeSignature and KernKey (fromKern()).
+#
+#s : flat music21 stream without ties and without grace notes
+#meter : collect the time signature and beat of every note (needed for the metric features)
+#keys : collect the key of every note (needed for tonic and mode)
+#These need a context search per note, which is the most expensive part.
+class SongContext():
+    def __init__(self, s, meter=True, keys=True):
+        self.filePath = str(s.metadata.filePath) if s.metadata is not None else ''
+
+        #time signatures and keys (also used for the contexts of the notes)
+        self.timesignatures = list(s.getElementsByClass('TimeSignature'))
+        self.keys = list(s.getElementsByClass('Key'))
+        self.hasmeter = len(self.timesignatures) > 0
+        #maybe it is an Essen song with Mixed meter.
+        #---> that has meter!
+        #mixedmetercomments = [c.comment for c in s.getElementsByClass('GlobalComment') if c.comment.startswith('Mixed meters:')]
+        #if len(mixedmetercomments) > 0:
+        #    self.hasmeter = False
+        #(offset, ratioString) of each time signature
+        self.metersegments = [(ts.offset, ts.ratioString) for ts in self.timesignatures]
+        self.tonic = self.keys[0].tonic if self.keys else None
+
+        #events: notes and rests
+        ev_isnote = []
+        ev_offset = []
+        ev_ql = []
+        ev_timesignature = []
+        ev_beat = []
+        ev_beatstr = []
+        ev_beatstrength = []
+        ev_beatduration = []
+
+        #notes
+        midi, diatonicnotenum, octave = [], [], []
+        self.name = []
+        self.nameWithOctave = []
+        self.fullname = []
+        self.duration = []
+        self.tie = []
+        self.key = []
+
+        for n in s.notesAndRests:
+            isnote = n.isNote or n.isChord
+            ev_isnote.append(isnote)
+            ev_offset.append(n.offset)
+            ev_ql.append(n.duration.quarterLength)
+            if self.hasmeter and meter:
+                #one lookup of the time signature for all beat properties
+                try:
+                    ts = n._getTimeSignatureForBeat()
+                    measureoffset = ts.getMeasureOffsetOrMeterModulusOffset(n)
+                    ev_beat.append(ts.getBeatProportion(measureoffset))
+                    ev_beatstr.append(ts.getBeatProportionStr(measureoffset))
+                    ev_beatstrength.append(ts.getAccentWeight(measureoffset, forcePositionMatch=True, permitMeterModulus=False))
+                    ev_beatduration.append(ts.getBeatDuration(measureoffset).quarterLength)
+                except m21.base.Music21ObjectException:
+                    ev_beat.append(float('nan'))
+                    ev_beatstr.append('nan')
+                    ev_beatstrength.append(float('nan'))
+                    ev_beatduration.append(0.0)
+                ev_timesignature.append(n.getContextByClass('TimeSignature'))
+            if isnote:
+                p = n.pitch
+                midi.append(p.midi)
+                diatonicnotenum.append(p.diatonicNoteNum)
+                octave.append(n.octave)
+                self.name.append(p.name)
+                self.nameWithOctave.append(p.nameWithOctave)
+                #For notes that were merged by stripTies() from tied tuplets, music21 resets the
+                #quarterLength to that of the first note when the components of the duration
+                #are accessed (e.g. by fullName). The duration feature has always been
+                #taken before, all others after.
+                self.duration.append(n.duration.quarterLength)
+                self.fullname.append(n.duration.fullName)
+                ev_ql[-1] = n.duration.quarterLength
+                self.tie.append(n.tie.type if n.tie is not None else None)
+                if self.tonic is not None and keys:
+                    self.key.append(n.getContextByClass('Key'))
+
+        self._setEvents(ev_isnote, ev_offset, ev_ql, ev_timesignature, ev_beat, ev_beatstr, ev_beatstrength, ev_beatduration, midi, diatonicnotenum, octave, meter)
+
+        #phrase boundaries: offsets of the lines in the original layout
+        self._setLineOffsets((cmt.offset, cmt.comment) for cmt in s.getElementsByClass(m21.humdrum.spineParser.GlobalComment))
+
+    #Context of a melody parsed by kernparser.parseKern() (-fastparse), without music21. The
+    #values are the same as those of the stream that parseMelody() produces with music21:
+    #the beats are those of the default music21 TimeSignature (see KernTimeSignature),
+    #computed from the offset in the measure instead of by a context search per note.
+    #music21 is only imported for meters and durations that KernTimeSignature and _fullName()
+    #do not know.
+    #km : KernMelody
+    @classmethod
+    def fromKern(cls, km, meter=True, keys=True):
+        sc = cls.__new__(cls)
+        sc.filePath = km.path
+
+        sc.timesignatures = [KernTimeSignature.make(numerator, denominator) for _, numerator, denominator in km.timesignatures]
+        sc.keys = [KernKey(keystring) for _, keystring in km.keys]
+        sc.hasmeter = len(sc.timesignatures) > 0
+        sc.metersegments = [(opFrac(offset), ts.ratioString) for (offset, _, _), ts in zip(km.timesignatures, sc.timesignatures)]
+        sc.tonic = sc.keys[0].tonic if sc.keys else None
+
+        #the time signature or key in effect at an offset
+        tsoffsets = [offset for offset, _, _ in km.timesignatures]
+        keyoffsets = [offset for offset, _ in km.keys]
+        def contextAt(offsets, objects, offset):
+            return objects[bisect_right(offsets, offset) - 1]
+        #bar duration of each time signature, as TimeSignature.barDuration.quarterLength
+        bardurations = {ts: opFrac(Fraction(4 * numerator, denominator)) for ts, (_, numerator, denominator) in zip(sc.timesignatures, km.timesignatures)}
+
+        ev_isnote = []
+        ev_offset = []
+        ev_ql = []
+        ev_timesignature = []
+        ev_beat = []
+        ev_beatstr = []
+        ev_beatstrength = []
+        ev_beatduration = []
+
+        midi, diatonicnotenum, octave = [], [], []
+        sc.name = []
+        sc.nameWithOctave = []
+        sc.fullname = []
+        sc.duration = []
+        sc.tie = []
+        sc.key = []
+
+        #the beat properties only depend on the time signature and the offset in the measure
+        beats = {}
+        for e in km.events:
+            offset = opFrac(e.offset)
+            ql = opFrac(e.quarterLength)
+            ev_isnote.append(e.isNote)
+            ev_offset.append(offset)
+            ev_ql.append(ql)
+            if sc.hasmeter and meter:
+                ts = contextAt(tsoffsets, sc.timesignatures, e.offset)
+                measure = km.measures[e.measure]
+                #as TimeSignature.getMeasureOffsetOrMeterModulusOffset(): offset in the measure
+                #plus the padding, modulo the bar duration if it exceeds the bar
+                measureoffset = opFrac(e.offset - measure.offset) + _padding(measure.paddingLeft)
+                barduration = bardurations[ts]
+                if measureoffset >= barduration:
+                    measureoffset = measureoffset % barduration
+                if (ts, measureoffset) not in beats:
+                    beats[(ts, measureoffset)] = _beatProperties(ts, measureoffset)
+                beat, beatstr, beatstrength, beatduration = beats[(ts, measureoffset)]
+                ev_beat.append(beat)
+                ev_beatstr.append(beatstr)
+                ev_beatstrength.append(beatstrength)
+                ev_beatduration.append(beatduration)
+                ev_timesignature.append(ts)
+            if e.isNote:
+                midi.append(e.midi)
+                diatonicnotenum.append(e.diatonicNoteNum)
+                octave.append(e.octave)
+                sc.name.append(e.name)
+                sc.nameWithOctave.append(e.nameWithOctave)
+                sc.duration.append(ql)
+                sc.fullname.append(_fullName(ql))
+                sc.tie.append(e.tie)
+                if sc.tonic is not None and keys:
+                    sc.key.append(contextAt(keyoffsets, sc.keys, e.offset))
+
+        sc._setEvents(ev_isnote, ev_offset, ev_ql, ev_timesignature, ev_beat, ev_beatstr, ev_beatstrength, ev_beatduration, midi, diatonicnotenum, octave, meter)
+        sc._setLineOffsets(km.comments)
+        return sc
+
+    def _setEvents(self, ev_isnote, ev_offset, ev_ql, ev_timesignature, ev_beat, ev_beatstr, ev_beatstrength, ev_beatduration, midi, diatonicnotenum, octave, meter):
+        self.ev_isnote = np.array(ev_isnote, dtype=bool)
+        self.ev_offset = ev_offset
+        self.ev_quarterLength = ev_ql
+        self.ev_timesignature = ev_timesignature
+        self.ev_beat = ev_beat
+        self.ev_beatstr = ev_beatstr
+        self.ev_beatstrength = np.array(ev_beatstrength, dtype=float)
+        self.ev_beatduration = ev_beatduration
+
+        #positions of the notes in the events
+        self.note_ixs = np.flatnonzero(self.ev_isnote)
+        self.n_notes = len(self.note_ixs)
+
+        self.midi = np.array(midi, dtype=int)
+        self.diatonicNoteNum = np.array(diatonicnotenum, dtype=int)
+        self.octave = np.array(octave, dtype=int)
+        self.offset = [ev_offset[ix] for ix in self.note_ixs]
+        self.quarterLength = [ev_ql[ix] for ix in self.note_ixs]
+        self.offset_float = np.array(self.offset, dtype=float)
+        self.quarterLength_float = np.array(self.quarterLength, dtype=float)
+
+        #durations in ticks (resolution ticks per quarter note)
+        self.resolution = self._resolution()
+        self.ev_ticks = np.array([int(ql * self.resolution) for ql in ev_ql], dtype=np.int64)
+        self.ticks = self.ev_ticks[self.note_ixs]
+
+        #rests following each note
+        self.restafter_ticks = self._restAfter()
+        self.restafter_float = self.restafter_ticks / self.resolution
+        self.nextisrest = [not self.ev_isnote[ix+1] if ix+1 < len(self.ev_isnote) else None for ix in self.note_ixs.tolist()]
+
+        if self.hasmeter and meter:
+            self.timesignature = [ev_timesignature[ix] for ix in self.note_ixs]
+            self.beat = [ev_beat[ix] for ix in self.note_ixs]
+            self.beatstr = [ev_beatstr[ix] for ix in self.note_ixs]
+            self.beatstrength = self.ev_beatstrength[self.note_ixs]
+
+    #comments: (offset, text) of the global comments
+    def _setLineOffsets(self, comments):
+        self.lineoffsets = [Fraction(0,1)]
+        for offset, comment in comments:
+            if offset > 1e-4: #first already added
+                if "segment" in comment or "linebreak:original" in comment:
+                    self.lineoffsets.append(Fraction(offset))
+
+    #Duration (ticks) of the rest(s) FOLLOWING each note. 0 if no rest follows.
+    def _restAfter(self):
+        cumticks = np.concatenate(([0], np.cumsum(self.ev_ticks)))
+        #the events between a note and the next note (or the end) are rests
+        nextnote_ixs = np.append(self.note_ixs[1:], len(self.ev_ticks))
+        return cumticks[nextnote_ixs] - cumticks[self.note_ixs + 1]
+
+    def _durationUnit(self):
+        unit = Fraction(self.ev_quarterLength[0])
+        for ql in self.ev_quarterLength:
+            unit = fraction_gcd(unit, Fraction(ql))
+        return fraction_gcd(unit, Fraction(1,1)) # make sure 1 is dividable by the unit.denominator
+
+    #Number of ticks per quarter note given the duration unit.
+    def _resolution(self):
+        unit = self._durationUnit()
+        #number of ticks is 1 / unit (if that is an integer)
+        ticksPerQuarter = unit.denominator / unit.numerator
+        if ticksPerQuarter.is_integer():
+            return int(unit.denominator / unit.numerator)
+        else:
+            print(self.filePath, ' non integer number of ticks per Quarter')
+            return 0
@@ -0,0 +1,126 @@
+import os
+import json
+import sqlite3
+import hashlib
+
+#Manifest of the songs in an output directory, in an SQLite database.
+#For every song it records what the output was computed from:
+#- hash of the .krn file (with size and mtime, such that unchanged files are not read)
+#- hash of the metadata of the song
+#- hash of the text features of the song
+#- version of the extractor
+#and the path of the output file (relative to the directory of the manifest).
+#A song is extracted again if one of these changed.
+#
+#Keys of songs that are being extracted are kept in pending until the output has been
+#written (commit()). If the extraction fails, the song and its old output are removed
+#(discard()).
+class SongManifest():
+    def __init__(self, path):
+        self.path = str(path)
+        self.basedir = os.path.dirname(os.path.abspath(self.path))
+        self.pending = {}
+        self.conn = sqlite3.connect(self.path, timeout=120)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS songs (
+                songid TEXT PRIMARY KEY,
+                krnsize INTEGER NOT NULL,
+                krnmtime INTEGER NOT NULL,
+                krnhash TEXT NOT NULL,
+                metahash TEXT NOT NULL,
+                texthash TEXT NOT NULL,
+                version TEXT NOT NULL,
+                output TEXT NOT NULL
+            )
+        ''')
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def get(self, songid):
+        row = self.conn.execute(
+            'SELECT krnsize, krnmtime, krnhash, metahash, texthash, version FROM songs WHERE songid=?',
+            (str(songid),)
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('krnsize', 'krnmtime', 'krnhash', 'metahash', 'texthash', 'version'), row))
+
+    #returns key of the song: dict with the hashes and the version
+    #metadata, textfeatures: json serializable
+    def key(self, songid, krnpath, metadata, textfeatures, version):
+        st = os.stat(krnpath)
+        old = self.get(songid)
+        if old is not None and old['krnsize'] == st.st_size and old['krnmtime'] == st.st_mtime_ns:
+            krnhash = old['krnhash']
+        else:
+            with open(krnpath, 'rb') as f:
+                krnhash = hashlib.sha1(f.read()).hexdigest()
+        return {
+            'krnsize': st.st_size,
+            'krnmtime': st.st_mtime_ns,
+            'krnhash': krnhash,
+            'metahash': hashString(json.dumps(metadata, default=str)),
+            'texthash': hashString(json.dumps(textfeatures, default=str)),
+            'version': version,
+        }
+
+    #returns True if the song has to be extracted. Keeps the key until commit().
+    def changed(self, songid, key):
+        old = self.get(songid)
+        if old is not None:
+            same = all(old[field] == key[field] for field in ('krnhash', 'metahash', 'texthash', 'version'))
+            if same:
+                if old['krnmtime'] != key['krnmtime']: #touched, but same content
+                    self.conn.execute(
+                        'UPDATE songs SET krnsize=?, krnmtime=? WHERE songid=?',
+                        (key['krnsize'], key['krnmtime'], str(songid))
+                    )
+                    self.conn.commit()
+                return False
+        self.pending[songid] = key
+        return True
+
+    #Record the song after its output has been written
+    def commit(self, songid, output):
+        key = self.pending.pop(songid)
+        self.conn.execute(
+            'INSERT OR REPLACE INTO songs VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (str(songid), key['krnsize'], key['krnmtime'], key['krnhash'], key['metahash'], key['texthash'], key['version'], os.path.relpath(output, self.basedir))
+        )
+        self.conn.commit()
+
+    #Remove the song and its output file, e.g. if the extraction failed: the output of the
+    #previous run is no longer valid
+    #returns True if the song was in the manifest
+    def discard(self, songid):
+        self.pending.pop(songid, None)
+        row = self.conn.execute('SELECT output FROM songs WHERE songid=?', (str(songid),)).fetchone()
+        if row is None:
+            return False
+        output = os.path.join(self.basedir, row[0])
+        if os.path.isfile(output):
+            os.remove(output)
+        self.conn.execute('DELETE FROM songs WHERE songid=?', (str(songid),))
+        self.conn.commit()
+        return True
+
+    #Remove the songs that are not in songids, and their output files
+    #returns list of removed song ids
+    def removeOthers(self, songids):
+        songids = set(str(songid) for songid in songids)
+        removed = []
+        for songid, output in self.conn.execute('SELECT songid, output FROM songs').fetchall():
+            if songid in songids:
+                continue
+            output = os.path.join(self.basedir, output)
+            if os.path.isfile(output):
+                os.remove(output)
+            self.conn.execute('DELETE FROM songs WHERE songid=?', (songid,))
+            removed.append(songid)
+        self.conn.commit()
+        return removed
+
+def hashString(s):
+    return hashlib.sha1(s.encode('utf8')).hexdigest()
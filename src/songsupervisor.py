@@ -0,0 +1,212 @@
+import os
+import time
+import signal
+import resource
+import multiprocessing
+from multiprocessing.connection import wait
+
+#the extraction of a song took longer than the time budget
+class SongTimeoutError(Exception):
+    def __init__(self, message):
+        self.message = message
+    def __str__(self):
+        return repr(self.message)
+
+#the worker used more memory than the budget while extracting a song
+class SongMemoryError(Exception):
+    def __init__(self, message):
+        self.message = message
+    def __str__(self):
+        return repr(self.message)
+
+#the worker died while extracting a song (e.g. killed by the OOM killer)
+class WorkerDiedError(Exception):
+    def __init__(self, message):
+        self.message = message
+    def __str__(self):
+        return repr(self.message)
+
+#Resident set size of a process in bytes. None if unknown (no /proc).
+def processRSS(pid):
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+#RSS of this process. Without /proc the peak RSS.
+def ownRSS():
+    rss = processRSS(os.getpid())
+    if rss is None:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if os.uname().sysname != 'Darwin': #kilobytes, bytes on macOS
+            rss *= 1024
+    return rss
+
+#Process ids of the children of a process. Empty if unknown (no /proc).
+def childPids(pid):
+    children = []
+    try:
+        names = os.listdir('/proc')
+    except OSError:
+        return children
+    for name in names:
+        if not name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{name}/stat') as f:
+                stat = f.read()
+        except OSError: #exited
+            continue
+        #the name of the program (in parentheses) may contain spaces
+        if int(stat[stat.rindex(')')+2:].split()[1]) == pid:
+            children.append(int(name))
+    return children
+
+#Kill the children of a process that run in their own process group (e.g. onsets2ima,
+#see IMAExecutor) with their groups. They would survive the process.
+def killChildGroups(pid):
+    for child in childPids(pid):
+        try:
+            if os.getpgid(child) == child:
+                os.killpg(child, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+def _workerMain(conn, init, initargs, func):
+    init(*initargs)
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        try:
+            result = func(task)
+        except Exception as e:
+            conn.send((False, e, ownRSS()))
+            return
+        conn.send((True, result, ownRSS()))
+
+class _Worker():
+    def __init__(self, init, initargs, func):
+        self.conn, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_workerMain, args=(child, init, initargs, func), daemon=True)
+        self.process.start()
+        child.close()
+        self.songs = 0
+        self.task = None #(index, started)
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(5)
+        self.kill()
+
+    def kill(self):
+        if self.process.is_alive():
+            #before the worker is killed: its children are then no longer its children
+            killChildGroups(self.process.pid)
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+#Pool of worker processes that are supervised per task (song):
+#- a task that runs longer than timeout seconds is killed
+#- a task of which the worker uses more than maxrss bytes is killed (the RSS of the
+#  workers is polled every pollseconds; only where /proc exists)
+#- a worker is replaced by a new one after maxsongs tasks, or if it uses more than
+#  maxworkerrss bytes after a task (e.g. by growing caches)
+#The worker of a killed task is replaced, and the process groups its children started
+#(e.g. onsets2ima) are killed as well. failed(task, exception) gives the result of a
+#killed task or of a task of which the worker died (also before the task was sent).
+#Workers get one task at a time, such that one slow task only delays itself.
+#An exception raised by func is raised by map().
+class SongSupervisor():
+    def __init__(self, jobs, init, initargs, func, failed, timeout=0, maxrss=0, maxsongs=0, maxworkerrss=0, pollseconds=0.5):
+        self.jobs = jobs
+        self.init = init
+        self.initargs = initargs
+        self.func = func
+        self.failed = failed
+        self.timeout = timeout
+        self.maxrss = maxrss
+        self.maxsongs = maxsongs
+        self.maxworkerrss = maxworkerrss
+        self.pollseconds = pollseconds
+        self.workers = [self._newWorker() for _ in range(jobs)]
+
+    def _newWorker(self):
+        return _Worker(self.init, self.initargs, self.func)
+
+    def _replace(self, worker, kill):
+        if kill:
+            worker.kill()
+        else:
+            worker.stop()
+        self.workers[self.workers.index(worker)] = self._newWorker()
+
+    def close(self):
+        for worker in self.workers:
+            worker.kill()
+        self.workers = []
+
+    #Iterator over the results of func for the tasks, in the order of the tasks
+    def map(self, tasks):
+        tasks = list(tasks)
+        results = {}
+        nexttask = 0
+        nextresult = 0
+        while nextresult < len(tasks):
+            #at most a few tasks ahead of the oldest unfinished task
+            for worker in self.workers:
+                if worker.task is None and nexttask < len(tasks) and nexttask - nextresult < 4 * self.jobs:
+                    try:
+                        worker.conn.send(tasks[nexttask])
+                    except (BrokenPipeError, ConnectionResetError):
+                        #the worker died before the task (e.g. in init)
+                        worker.process.join(1)
+                        results[nexttask] = self.failed(tasks[nexttask], WorkerDiedError(f'exit code {worker.process.exitcode}'))
+                        nexttask += 1
+                        self._replace(worker, kill=True)
+                        continue
+                    worker.task = (nexttask, time.monotonic())
+                    nexttask += 1
+            while nextresult in results:
+                yield results.pop(nextresult)
+                nextresult += 1
+            if nextresult == len(tasks):
+                break
+            busy = [worker for worker in self.workers if worker.task is not None]
+            ready = wait([worker.conn for worker in busy], timeout=self.pollseconds)
+            for worker in busy:
+                ix, started = worker.task
+                if worker.conn in ready:
+                    worker.task = None
+                    try:
+                        ok, result, rss = worker.conn.recv()
+                    except EOFError:
+                        worker.process.join(1)
+                        results[ix] = self.failed(tasks[ix], WorkerDiedError(f'exit code {worker.process.exitcode}'))
+                        self._replace(worker, kill=True)
+                        continue
+                    if not ok:
+                        raise result
+                    results[ix] = result
+                    worker.songs += 1
+                    if (self.maxsongs and worker.songs >= self.maxsongs) or (self.maxworkerrss and rss > self.maxworkerrss):
+                        self._replace(worker, kill=False)
+                    continue
+                elapsed = time.monotonic() - started
+                if self.timeout and elapsed > self.timeout:
+                    results[ix] = self.failed(tasks[ix], SongTimeoutError(f'{elapsed:.1f} s'))
+                    self._replace(worker, kill=True)
+                    continue
+                if self.maxrss:
+                    rss = processRSS(worker.process.pid)
+                    if rss is not None and rss > self.maxrss:
+                        results[ix] = self.failed(tasks[ix], SongMemoryError(f'{rss/1024**2:.0f} MB'))
+                        self._replace(worker, kill=True)
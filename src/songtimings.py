@@ -0,0 +1,167 @@
+import os
+import time
+import json
+import math
+import heapq
+import cProfile
+
+#Wall and CPU time of the stages (parse, context, features, ...) of the extraction of one
+#song, and of the computation of every feature (and value, see FeatureGraph).
+#CPU time is the time of this process: time spent in other processes (e.g. onsets2ima)
+#only shows in the wall time.
+class SongTimer():
+    def __init__(self):
+        self.stages = {} #name -> [wall, cpu]
+        self.features = {}
+
+    def _timed(self, times, name):
+        return _Timed(times.setdefault(name, [0.0, 0.0]))
+
+    #context manager that adds the time of the block to stage name
+    def stage(self, name):
+        return self._timed(self.stages, name)
+
+    #context manager that adds the time of the block to feature name
+    def feature(self, name):
+        return self._timed(self.features, name)
+
+    def asdict(self):
+        return {'stages': self.stages, 'features': self.features}
+
+class _Timed():
+    def __init__(self, times):
+        self.times = times
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.times[0] += time.perf_counter() - self.wall
+        self.times[1] += time.process_time() - self.cpu
+
+#Histogram of durations with buckets that double in size: bucket i has the durations
+#up to 2**i ms (the last bucket has the rest).
+class Histogram():
+    def __init__(self, nbuckets=20):
+        self.counts = [0] * nbuckets
+        self.n = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.max = 0.0
+
+    def add(self, wall, cpu):
+        ms = wall * 1000.0
+        i = 0 if ms <= 1.0 else math.ceil(math.log2(ms))
+        self.counts[min(i, len(self.counts)-1)] += 1
+        self.n += 1
+        self.wall += wall
+        self.cpu += cpu
+        self.max = max(self.max, wall)
+
+    def asdict(self):
+        return {
+            'n': self.n,
+            'wall': self.wall,
+            'cpu': self.cpu,
+            'mean_wall': self.wall / self.n if self.n else 0.0,
+            'max_wall': self.max,
+            #upper bound of the bucket in ms (None: no bound) -> number of songs
+            'histogram': [
+                {'le_ms': 2**i if i < len(self.counts)-1 else None, 'n': n}
+                for i, n in enumerate(self.counts) if n
+            ],
+        }
+
+#Timings of the songs of one collection: histograms per stage and per feature, and the
+#slowest songs.
+class CollectionTimings():
+    def __init__(self, slowest=20):
+        self.slowest = slowest
+        self.stages = {}
+        self.features = {}
+        self.total = Histogram()
+        self.heap = [] #(wall, songid, timings) of the slowest songs
+        self.profiles = {} #songid -> path of the profile
+
+    #timings: SongTimer.asdict()
+    def add(self, songid, timings):
+        for name, (wall, cpu) in timings['stages'].items():
+            self.stages.setdefault(name, Histogram()).add(wall, cpu)
+        for name, (wall, cpu) in timings['features'].items():
+            self.features.setdefault(name, Histogram()).add(wall, cpu)
+        wall = sum(w for w, _ in timings['stages'].values())
+        self.total.add(wall, sum(c for _, c in timings['stages'].values()))
+        if self.slowest > 0:
+            item = (wall, songid, timings)
+            if len(self.heap) < self.slowest:
+                heapq.heappush(self.heap, item)
+            elif wall > self.heap[0][0]:
+                heapq.heapreplace(self.heap, item)
+
+    #ids of the slowest songs, slowest first
+    def slowestIds(self):
+        return [songid for _, songid, _ in sorted(self.heap, reverse=True)]
+
+    #Extract the slowest songs again with cProfile, and write the profiles to
+    #<profiledir>/<prefix><song id>.prof (pstats format)
+    #extract: function song id -> None
+    def profile(self, profiledir, prefix, extract):
+        os.makedirs(profiledir, exist_ok=True)
+        for songid in self.slowestIds():
+            path = os.path.join(profiledir, f'{prefix}{songid}.prof'.replace('/', '_'))
+            profiler = cProfile.Profile()
+            profiler.runcall(extract, songid)
+            profiler.dump_stats(path)
+            self.profiles[songid] = path
+
+    def asdict(self):
+        slowest = []
+        for wall, songid, timings in sorted(self.heap, reverse=True):
+            stages = timings['stages']
+            slowest.append({
+                'id': songid,
+                'wall': wall,
+                'cpu': sum(c for _, c in stages.values()),
+                'dominant_stage': max(stages, key=lambda name: stages[name][0]),
+                'stages': {name: {'wall': w, 'cpu': c} for name, (w, c) in stages.items()},
+                'features': {name: {'wall': w, 'cpu': c} for name, (w, c) in timings['features'].items()},
+                'profile': self.profiles.get(songid),
+            })
+        return {
+            'total': self.total.asdict(),
+            'stages': {name: h.asdict() for name, h in self.stages.items()},
+            'features': {name: h.asdict() for name, h in sorted(self.features.items(), key=lambda item: -item[1].wall)},
+            'slowest': slowest,
+        }
+
+#Timings of a run, per collection. The collections are extracted one after the other:
+#begin() selects the collection the timings are added to.
+class TimingReport():
+    def __init__(self, slowest=20):
+        self.slowest = slowest
+        self.collections = {}
+        self.current = None
+        self.currentname = None
+        self.started = time.time()
+
+    def begin(self, collection):
+        self.current = self.collections.setdefault(collection, CollectionTimings(self.slowest))
+        self.currentname = collection
+        return self.current
+
+    def add(self, songid, timings):
+        if self.current is None:
+            self.begin('')
+        self.current.add(songid, timings)
+
+    #Write the report as json
+    def write(self, path):
+        report = {
+            'started': self.started,
+            'seconds': time.time() - self.started,
+            'collections': {name: c.asdict() for name, c in self.collections.items()},
+        }
+        with open(str(path) + '.tmp', 'w') as f:
+            json.dump(report, f, indent=1)
+        os.replace(str(path) + '.tmp', str(path))
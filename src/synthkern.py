@@ -0,0 +1,144 @@
+import os
+import csv
+import random
+import argparse
+from fractions import Fraction
+
+#Generator of a synthetic corpus of monophonic **kern melodies, for benchmarks (see
+#benchmark.py). The corpus is deterministic: the same seed and parameters give the same
+#files. The melodies vary in length, meter, key, pickup, rests, ties, grace notes and
+#phrase segments (!!linebreak:original).
+#
+#The corpus has the layout of the Essen collection (mtc_to_seqs.py -essen):
+#  <root>/krn/<id>.krn
+#  <root>/metadata.csv
+
+METERS = [(2, 4), (3, 4), (4, 4), (6, 8), (3, 8), (2, 2)]
+
+#(tonic as in *G:, key signature, accidentals of the steps)
+KEYS = [
+    ('C', '', {}),
+    ('G', 'f#', {'F': '#'}),
+    ('D', 'f#c#', {'F': '#', 'C': '#'}),
+    ('F', 'b-', {'B': '-'}),
+    ('B-', 'b-e-', {'B': '-', 'E': '-'}),
+    ('a', '', {}),
+    ('e', 'f#', {'F': '#'}),
+    ('d', 'b-', {'B': '-'}),
+    ('g', 'b-e-', {'B': '-', 'E': '-'}),
+]
+
+STEPS = 'CDEFGAB'
+
+#durations (quarterLength) of the notes and their recip
+RECIPS = {
+    Fraction(4): '1',
+    Fraction(3): '2.',
+    Fraction(2): '2',
+    Fraction(3, 2): '4.',
+    Fraction(1): '4',
+    Fraction(3, 4): '8.',
+    Fraction(1, 2): '8',
+    Fraction(1, 4): '16',
+}
+
+#**kern pitch of diatonic note number (C4 is 28) with the accidentals of the key
+def kernPitch(dnn, accidentals):
+    octave, step = divmod(dnn, 7)
+    name = STEPS[step]
+    letter = name.lower() * (octave - 3) if octave >= 4 else name * (4 - octave)
+    return letter + accidentals.get(name, '')
+
+#Durations that fill a measure of barql quarter notes
+def measureDurations(rng, barql, beatql):
+    durations = []
+    left = barql
+    while left > 0:
+        #mostly notes of one beat or shorter
+        choices = [d for d in RECIPS if d <= left and (d <= beatql or rng.random() < 0.3)]
+        if not choices:
+            choices = [d for d in RECIPS if d <= left]
+        d = rng.choice(choices)
+        durations.append(d)
+        left -= d
+    return durations
+
+#returns the lines of one melody
+#nmeasures: number of full measures
+def melody(rng, songid, nmeasures, rests=0.05, ties=0.05, graces=0.03, pickup=0.3, phraselength=4):
+    numerator, denominator = rng.choice(METERS)
+    tonic, signature, accidentals = rng.choice(KEYS)
+    barql = Fraction(4 * numerator, denominator)
+    beatql = Fraction(3, 2) if denominator == 8 and numerator % 3 == 0 else Fraction(4, denominator)
+    lines = [
+        f'!!!OTL: Synthetic melody {songid}',
+        '**kern',
+        f'*M{numerator}/{denominator}',
+        f'*k[{signature}]',
+        f'*{tonic}:',
+    ]
+    measures = [measureDurations(rng, barql, beatql) for _ in range(nmeasures)]
+    if rng.random() < pickup:
+        measures.insert(0, [rng.choice([d for d in RECIPS if d < barql and d <= beatql])])
+    else:
+        measures.insert(0, [])
+    dnn = 7 * 4 + STEPS.index(tonic[0].upper())
+    first = True
+    tied = False
+    for ix, durations in enumerate(measures):
+        if ix > 0:
+            lines.append(f'={ix}')
+            if ix > 1 and (ix - 1) % phraselength == 0:
+                lines.append('!!linebreak:original')
+        for d in durations:
+            if tied:
+                lines.append(RECIPS[d] + kernPitch(dnn, accidentals) + ']')
+                tied = False
+                continue
+            if not first and rng.random() < rests:
+                lines.append(RECIPS[d] + 'r')
+                continue
+            first = False
+            #random walk, mostly steps, within two octaves around the tonic
+            dnn = min(max(dnn + rng.choice([-2, -1, -1, 0, 1, 1, 2, 3, -3]), 22), 38)
+            if rng.random() < graces:
+                lines.append('8q' + kernPitch(dnn + 1, accidentals))
+            if rng.random() < ties:
+                lines.append('[' + RECIPS[d] + kernPitch(dnn, accidentals))
+                tied = True
+            else:
+                lines.append(RECIPS[d] + kernPitch(dnn, accidentals))
+    if tied: #close the tie
+        lines[-1] = lines[-1].replace('[', '')
+    lines.extend(['==', '*-'])
+    return lines
+
+#Write a corpus of n melodies with minmeasures to maxmeasures measures to root
+#returns list of the song ids
+def writeCorpus(root, n, seed=1, minmeasures=4, maxmeasures=32, **kwargs):
+    rng = random.Random(seed)
+    krndir = os.path.join(root, 'krn')
+    os.makedirs(krndir, exist_ok=True)
+    songids = []
+    for i in range(n):
+        songid = f'synth{i:06d}'
+        nmeasures = rng.randint(minmeasures, maxmeasures)
+        with open(os.path.join(krndir, songid + '.krn'), 'w', encoding='utf8') as f:
+            f.write('\n'.join(melody(rng, songid, nmeasures, **kwargs)) + '\n')
+        songids.append(songid)
+    with open(os.path.join(root, 'metadata.csv'), 'w', encoding='utf8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['songid', 'title', 'origin'])
+        for songid in songids:
+            writer.writerow([songid, f'Synthetic melody {songid}', 'synthetic'])
+    return songids
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='Generate a synthetic corpus of **kern melodies.')
+    argparser.add_argument('root', type=str, help='output directory (krn/ and metadata.csv)')
+    argparser.add_argument('-songs', type=int, help='Number of melodies.', default=1000)
+    argparser.add_argument('-seed', type=int, help='Seed of the random generator.', default=1)
+    argparser.add_argument('-minmeasures', type=int, help='Minimal number of measures of a melody.', default=4)
+    argparser.add_argument('-maxmeasures', type=int, help='Maximal number of measures of a melody.', default=32)
+    cmdargs = argparser.parse_args()
+    writeCorpus(cmdargs.root, cmdargs.songs, seed=cmdargs.seed, minmeasures=cmdargs.minmeasures, maxmeasures=cmdargs.maxmeasures)
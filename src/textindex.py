@@ -0,0 +1,189 @@
+import os
+import gzip
+import json
+import zlib
+import sqlite3
+import argparse
+from collections import OrderedDict
+
+#Random access by id to the records of a .jsonl or .jsonl.gz file (e.g. a text feature
+#file), through a persistent index in an SQLite database next to the file
+#(<file>.idx.sqlite). The index is built on first use, and built again if the size or
+#modification time of the file changed.
+#
+#For every record the index has the position of the line:
+#- .jsonl: byte offset and length in the file.
+#- .jsonl.gz: offset of the gzip member that contains the line in the file, and offset and
+#  length of the line in the decompressed member. A lookup only decompresses that member.
+#  A file that is compressed as one member (e.g. by gzip) has to be decompressed from the
+#  start for every lookup. Use blockGzip() to convert it to a file with small members (a
+#  sequence of gzip members is a valid gzip file).
+#
+#Decoded records are kept in an LRU cache of cachesize records.
+#An SQLite connection cannot be used after fork(). A connection is opened per process.
+class TextIndex():
+    def __init__(self, path, cachesize=256):
+        self.path = str(path)
+        self.indexpath = self.path + '.idx.sqlite'
+        self.gzipped = self.path.endswith('.gz')
+        self.cachesize = cachesize
+        self.cache = OrderedDict()
+        self.pid = None
+        self.conn = None
+
+    def _connection(self):
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.conn = sqlite3.connect(self.indexpath, timeout=120)
+            self.conn.execute('CREATE TABLE IF NOT EXISTS meta (size INTEGER, mtime INTEGER)')
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS records (
+                    id TEXT PRIMARY KEY,
+                    member INTEGER NOT NULL,
+                    offset INTEGER NOT NULL,
+                    length INTEGER NOT NULL
+                )
+            ''')
+            self.conn.commit()
+            st = os.stat(self.path)
+            if self.conn.execute('SELECT size, mtime FROM meta').fetchone() != (st.st_size, st.st_mtime_ns):
+                self._build(st)
+        return self.conn
+
+    #(id, member, offset, length) of every line
+    def _scan(self):
+        if self.gzipped:
+            for member, offset, line in _gzipLines(self.path):
+                yield json.loads(line)['id'], member, offset, len(line)
+        else:
+            offset = 0
+            with open(self.path, 'rb') as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)['id'], 0, offset, len(line)
+                    offset += len(line)
+
+    def _build(self, st):
+        conn = self.conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            #another process might have built the index in the meantime
+            if conn.execute('SELECT size, mtime FROM meta').fetchone() == (st.st_size, st.st_mtime_ns):
+                conn.execute('COMMIT')
+                return
+            print(f'Indexing {self.path}')
+            conn.execute('DELETE FROM records')
+            conn.execute('DELETE FROM meta')
+            conn.executemany('INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?)', self._scan())
+            conn.execute('INSERT INTO meta VALUES (?, ?)', (st.st_size, st.st_mtime_ns))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def __contains__(self, recordid):
+        return self._position(recordid) is not None
+
+    def _position(self, recordid):
+        return self._connection().execute(
+            'SELECT member, offset, length FROM records WHERE id=?',
+            (str(recordid),)
+        ).fetchone()
+
+    def _read(self, member, offset, length):
+        with open(self.path, 'rb') as f:
+            if not self.gzipped:
+                f.seek(offset)
+                return f.read(length)
+            f.seek(member)
+            d = zlib.decompressobj(wbits=31)
+            pos = 0 #offset of out in the decompressed member
+            line = b''
+            while len(line) < length:
+                chunk = f.read(64*1024)
+                if not chunk:
+                    break
+                out = d.decompress(chunk)
+                #only keep the part of the line
+                if pos + len(out) > offset:
+                    line += out[max(0, offset-pos):offset+length-pos]
+                pos += len(out)
+            return line
+
+    #returns the record (dict) with the id. KeyError if there is none.
+    def __getitem__(self, recordid):
+        if recordid in self.cache:
+            self.cache.move_to_end(recordid)
+            return self.cache[recordid]
+        position = self._position(recordid)
+        if position is None:
+            raise KeyError(recordid)
+        record = json.loads(self._read(*position))
+        self.cache[recordid] = record
+        if len(self.cache) > self.cachesize:
+            self.cache.popitem(last=False)
+        return record
+
+#Iterator over (offset of the member, offset in the decompressed member, line) of all
+#non-empty lines in a gzip file with one or more members. A line does not span members
+#if the file was written by blockGzip() or ShardWriter.
+def _gzipLines(path, chunkbytes=1024**2):
+    with open(path, 'rb') as f:
+        member = 0 #offset of the current member in the file
+        consumed = 0 #compressed bytes read from the current member
+        d = zlib.decompressobj(wbits=31)
+        pending = b'' #decompressed data after the last newline
+        pendingoffset = 0 #offset of pending in the decompressed member
+        data = f.read(chunkbytes)
+        while data:
+            out = d.decompress(data)
+            lines = (pending + out).split(b'\n')
+            pending = lines.pop()
+            for line in lines:
+                if line.strip():
+                    yield member, pendingoffset, line + b'\n'
+                pendingoffset += len(line) + 1
+            if d.eof:
+                if pending.strip():
+                    yield member, pendingoffset, pending
+                consumed += len(data) - len(d.unused_data)
+                member += consumed
+                consumed = 0
+                data = d.unused_data
+                d = zlib.decompressobj(wbits=31)
+                pending = b''
+                pendingoffset = 0
+                if not data:
+                    data = f.read(chunkbytes)
+                continue
+            consumed += len(data)
+            data = f.read(chunkbytes)
+
+#Write the lines of a .jsonl or .jsonl.gz file to a gzip file with members of about
+#blockbytes (uncompressed), such that TextIndex only decompresses one block per lookup.
+def blockGzip(inpath, outpath, blockbytes=64*1024, compresslevel=6):
+    opener = gzip.open if str(inpath).endswith('.gz') else open
+    with opener(inpath, 'rb') as fin, open(str(outpath) + '.tmp', 'wb') as fout:
+        block = []
+        size = 0
+        for line in fin:
+            block.append(line if line.endswith(b'\n') else line + b'\n')
+            size += len(line)
+            if size >= blockbytes:
+                fout.write(gzip.compress(b''.join(block), compresslevel, mtime=0))
+                block = []
+                size = 0
+        if block:
+            fout.write(gzip.compress(b''.join(block), compresslevel, mtime=0))
+    os.replace(str(outpath) + '.tmp', str(outpath))
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='Index a .jsonl(.gz) file, or convert it to block gzip.')
+    argparser.add_argument('inpath', type=str)
+    argparser.add_argument('-blockgzip', type=str, help='Write a block gzipped copy to this file and index it.', default='')
+    cmdargs = argparser.parse_args()
+    path = cmdargs.inpath
+    if cmdargs.blockgzip:
+        blockGzip(path, cmdargs.blockgzip)
+        path = cmdargs.blockgzip
+    TextIndex(path)._connection()
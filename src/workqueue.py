@@ -0,0 +1,201 @@
+import sqlite3
+import socket
+import os
+import time
+
+#Work queue in an SQLite database for running one collection on several hosts.
+#The database should be on a filesystem that is shared by all hosts (e.g. NFS).
+#
+#Every worker enqueues the song ids it would process (songs that are already in
+#the queue are ignored), and then repeatedly claims a batch of pending songs.
+#A claimed batch is leased to the worker for leaseseconds. The lease is renewed
+#after every song. If a worker dies, its lease expires and the songs are claimed
+#again by another worker. A song that was leased maxattempts times without
+#being done is marked as failed.
+#
+#status of a song: pending -> leased -> done | failed
+class WorkQueue():
+    def __init__(self, path, collection, batchsize=50, leaseseconds=1800, maxattempts=3, pollseconds=10):
+        self.path = str(path)
+        self.collection = collection
+        self.batchsize = batchsize
+        self.leaseseconds = leaseseconds
+        self.maxattempts = maxattempts
+        self.pollseconds = pollseconds
+        self.owner = f'{socket.gethostname()}_{os.getpid()}'
+        #isolation_level=None: we do our own transactions
+        #No WAL journal: WAL does not work on network filesystems.
+        self.conn = sqlite3.connect(self.path, timeout=120, isolation_level=None)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS songs (
+                collection TEXT NOT NULL,
+                songid TEXT NOT NULL,
+                seqno INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                owner TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (collection, songid)
+            )
+        ''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS songs_status ON songs (collection, status, seqno)')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS generations (
+                collection TEXT PRIMARY KEY,
+                generation INTEGER NOT NULL
+            )
+        ''')
+
+    def close(self):
+        self.conn.close()
+
+    #BEGIN IMMEDIATE takes the write lock at once, such that two workers cannot claim the same songs
+    def _begin(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+
+    #Add song ids to the queue. Songs already in the queue keep their status.
+    #returns the number of added songs
+    def enqueue(self, songids):
+        self._begin()
+        try:
+            seqno = self.conn.execute(
+                'SELECT COALESCE(MAX(seqno)+1, 0) FROM songs WHERE collection=?',
+                (self.collection,)
+            ).fetchone()[0]
+            added = 0
+            for songid in songids:
+                cur = self.conn.execute(
+                    'INSERT OR IGNORE INTO songs (collection, songid, seqno) VALUES (?, ?, ?)',
+                    (self.collection, str(songid), seqno)
+                )
+                added += cur.rowcount
+                seqno += 1
+            self.conn.execute('COMMIT')
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        return added
+
+    #Put songs with an expired lease back in the queue.
+    #Must be called within a transaction.
+    def _requeueExpired(self, now):
+        self.conn.execute(
+            '''UPDATE songs SET status='failed', owner=NULL, lease_expires=NULL
+               WHERE collection=? AND status='leased' AND lease_expires<? AND attempts>=?''',
+            (self.collection, now, self.maxattempts)
+        )
+        self.conn.execute(
+            '''UPDATE songs SET status='pending', owner=NULL, lease_expires=NULL
+               WHERE collection=? AND status='leased' AND lease_expires<?''',
+            (self.collection, now)
+        )
+
+    #Lease a batch of pending songs to this worker.
+    #returns list of song ids (in order of the collection). Empty list if no song is pending.
+    def claim(self):
+        now = time.time()
+        self._begin()
+        try:
+            self._requeueExpired(now)
+            songids = [row[0] for row in self.conn.execute(
+                '''SELECT songid FROM songs WHERE collection=? AND status='pending'
+                   ORDER BY seqno LIMIT ?''',
+                (self.collection, self.batchsize)
+            )]
+            self.conn.executemany(
+                '''UPDATE songs SET status='leased', owner=?, lease_expires=?, attempts=attempts+1
+                   WHERE collection=? AND songid=?''',
+                [(self.owner, now + self.leaseseconds, self.collection, songid) for songid in songids]
+            )
+            self.conn.execute('COMMIT')
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        return songids
+
+    #Extend the lease of all songs leased by this worker.
+    def renew(self):
+        self.conn.execute(
+            '''UPDATE songs SET lease_expires=?
+               WHERE collection=? AND status='leased' AND owner=?''',
+            (time.time() + self.leaseseconds, self.collection, self.owner)
+        )
+
+    #Only if the song is still leased by this worker: if the lease expired, another worker
+    #may have claimed it.
+    #returns True if the status was set
+    def _finish(self, songid, status):
+        cur = self.conn.execute(
+            '''UPDATE songs SET status=?, lease_expires=NULL
+               WHERE collection=? AND songid=? AND status='leased' AND owner=?''',
+            (status, self.collection, str(songid), self.owner)
+        )
+        return cur.rowcount > 0
+
+    def done(self, songid):
+        self._finish(songid, 'done')
+        self.renew()
+
+    def failed(self, songid):
+        self._finish(songid, 'failed')
+        self.renew()
+
+    #Put all failed songs back in the queue.
+    def requeueFailed(self):
+        cur = self.conn.execute(
+            '''UPDATE songs SET status='pending', owner=NULL, attempts=0
+               WHERE collection=? AND status='failed' ''',
+            (self.collection,)
+        )
+        return cur.rowcount
+
+    #Output generation (see shardwriter.py) of the collection in this queue: the first worker
+    #sets it to proposed, such that all workers write the same generation.
+    def generation(self, proposed):
+        self.conn.execute(
+            'INSERT OR IGNORE INTO generations (collection, generation) VALUES (?, ?)',
+            (self.collection, proposed)
+        )
+        return self.conn.execute(
+            'SELECT generation FROM generations WHERE collection=?',
+            (self.collection,)
+        ).fetchone()[0]
+
+    #returns dict status -> number of songs
+    def counts(self):
+        return dict(self.conn.execute(
+            'SELECT status, COUNT(*) FROM songs WHERE collection=? GROUP BY status',
+            (self.collection,)
+        ).fetchall())
+
+    #Iterator over leased batches.
+    #Stops if no song is pending and no song is leased by any worker.
+    #If other workers still hold leases, wait, because these might expire.
+    def batches(self):
+        while True:
+            songids = self.claim()
+            if songids:
+                yield songids
+                continue
+            counts = self.counts()
+            if counts.get('leased', 0) == 0 and counts.get('pending', 0) == 0:
+                return
+            time.sleep(self.pollseconds)
+
+#Wrapper of a WorkQueue for output that is written later than the songs are processed
+#(e.g. shards). done() only renews the lease. The songs are marked done with commit(),
+#after their output has been written.
+class DeferredDoneQueue():
+    def __init__(self, queue):
+        self.queue = queue
+
+    def __getattr__(self, name):
+        return getattr(self.queue, name)
+
+    def done(self, songid):
+        self.queue.renew()
+
+    def commit(self, songids):
+        for songid in songids:
+            self.queue._finish(songid, 'done')
+        self.queue.renew()
@@ -0,0 +1,31 @@
+import os
+import sys
+
+#the modules are in src/, which is not a package
+SRCDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, os.path.abspath(SRCDIR))
+
+DATADIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+#the .krn files in tests/data
+def krnFiles():
+    return sorted(os.path.join(DATADIR, name) for name in os.listdir(DATADIR) if name.endswith('.krn'))
+
+#directory with a stand-in for onsets2ima (see bin/onsets2ima)
+BINDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bin')
+
+#records (see mtc_to_seqs.songRecords()) of the .krn files in tests/data
+def krnRecords():
+    records = {}
+    for krnpath in krnFiles():
+        name = os.path.basename(krnpath)
+        records[name[:-len('.krn')]] = {
+            'filename': name,
+            'tunefamily': '',
+            'tunefamily_full': '',
+            'type': 'vocal',
+            'year': 1900,
+            'origin': '',
+            'ann_bgcorpus': None,
+        }
+    return records
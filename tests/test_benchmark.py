@@ -0,0 +1,56 @@
+import os
+import csv
+import sys
+import json
+import subprocess
+
+import pytest
+
+from conftest import SRCDIR
+from kernparser import parseKern
+from synthkern import writeCorpus
+from benchmark import regressions
+
+#the corpus has the requested number of melodies, with the same content for the same seed
+def test_synthkern(tmp_path):
+    songids = writeCorpus(str(tmp_path / 'a'), 5, seed=7, minmeasures=2, maxmeasures=6)
+    writeCorpus(str(tmp_path / 'b'), 5, seed=7, minmeasures=2, maxmeasures=6)
+    assert sorted(os.listdir(tmp_path / 'a' / 'krn')) == [songid + '.krn' for songid in songids]
+    with open(tmp_path / 'a' / 'metadata.csv', newline='') as f:
+        assert [row[0] for row in csv.reader(f)] == ['songid'] + songids
+    for songid in songids:
+        krnpath = tmp_path / 'a' / 'krn' / (songid + '.krn')
+        assert krnpath.read_text() == (tmp_path / 'b' / 'krn' / (songid + '.krn')).read_text()
+        assert parseKern(str(krnpath)).notes
+
+def benchmark(workdir, *options):
+    return subprocess.run(
+        [sys.executable, os.path.join(SRCDIR, 'benchmark.py'), '-workdir', str(workdir), '-songs', '3', '-repeat', '1', '-minmeasures', '2', '-maxmeasures', '4'] + list(options) + ['--', '-imaengine', 'python'],
+        capture_output=True,
+        text=True,
+    )
+
+#a small run counts the songs, compares to the baseline, and fails if songs failed
+def test_benchmark(tmp_path):
+    pytest.importorskip('music21')
+    baseline = str(tmp_path / 'baseline.json')
+    res = benchmark(tmp_path, '-baseline', baseline, '-savebaseline')
+    assert res.returncode == 0, res.stderr
+    assert res.stdout.splitlines()[1].startswith('3 songs in ')
+    with open(baseline) as f:
+        result = json.load(f)
+    assert (result['songs'], result['failed']) == (3, 0)
+    assert 'parse' in result['stages_ms']
+    assert benchmark(tmp_path, '-baseline', baseline, '-tolerance', '100').returncode == 0
+    with open(tmp_path / 'corpus' / 'krn' / 'synth000001.krn', 'w') as f:
+        f.write('**kern\n*M3/4\n4c\n=1\n*-\n')
+    res = benchmark(tmp_path, '-baseline', baseline)
+    assert res.returncode == 1
+    assert '1 songs failed' in res.stderr
+
+def test_regressions():
+    baseline = {'songs_per_second': 100.0, 'stages_ms': {'parse': 1.0, 'features': 2.0}, 'ima_ms': 1.0}
+    result = {'songs_per_second': 95.0, 'stages_ms': {'parse': 1.05, 'features': 3.0, 'write': 9.0}, 'ima_ms': 1.0}
+    assert regressions(result, baseline, 0.1) == [('stage features (ms)', 2.0, 3.0)]
+    result['songs_per_second'] = 80.0
+    assert [name for name, _, _ in regressions(result, baseline, 0.1)] == ['songs_per_second', 'stage features (ms)']
@@ -0,0 +1,87 @@
+import os
+import csv
+import sys
+import json
+import socket
+import shutil
+import subprocess
+import urllib.error
+
+import pytest
+
+pytest.importorskip('music21')
+
+import mtc_to_seqs
+from extractdaemon import requestSequence
+from conftest import krnFiles
+
+SRCDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+@pytest.fixture(scope='module')
+def corpus(tmp_path_factory):
+    root = tmp_path_factory.mktemp('essen')
+    os.makedirs(root / 'krn')
+    with open(root / 'metadata.csv', 'w', encoding='utf8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['songid', 'title', 'origin'])
+        for krnpath in krnFiles():
+            songid = os.path.basename(krnpath)[:-len('.krn')]
+            shutil.copy(krnpath, root / 'krn')
+            writer.writerow([songid, songid, 'fixture'])
+    return root
+
+#the daemon, serving the corpus as essen
+@pytest.fixture(scope='module')
+def url(corpus):
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(SRCDIR, 'extractdaemon.py'), '-port', str(port), '-preload', 'essen', '-essenroot', str(corpus), '-imaengine', 'python'],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        for line in proc.stdout:
+            if line.startswith('Listening'):
+                break
+        else:
+            pytest.fail('extractdaemon did not start')
+        yield f'http://127.0.0.1:{port}'
+    finally:
+        proc.terminate()
+        proc.wait()
+
+#sequences of the songs as extracted by mtc_to_seqs.py
+@pytest.fixture(scope='module')
+def expected(corpus):
+    try:
+        mtc_to_seqs.configure(['-essenroot', str(corpus), '-imaengine', 'python'])
+        records = mtc_to_seqs.essenRecords()
+        mtc_to_seqs.initSongWorker(mtc_to_seqs.args, mtc_to_seqs.essenkrndir, records, None)
+        #as written by mtc_to_seqs.py
+        return {songid: json.loads(json.dumps(mtc_to_seqs.extractSongWorker(songid)[0])) for songid in records}
+    finally:
+        mtc_to_seqs.configure([])
+
+def test_song(url, expected):
+    for songid, seq in expected.items():
+        assert requestSequence('essen', songid, url=url) == seq
+
+def test_features(url, expected):
+    seq = requestSequence('essen', 'ties', features=['midipitch', 'beat'], url=url)
+    assert seq['features'] == {name: expected['ties']['features'][name] for name in ('midipitch', 'beat')}
+
+def test_kern(url, expected):
+    with open(os.path.join(os.path.dirname(krnFiles()[0]), 'tuplets.krn')) as f:
+        kern = f.read()
+    seq = requestSequence(kern=kern, metadata={'id': 'tuplets'}, url=url)
+    assert seq['features'] == expected['tuplets']['features']
+
+def test_errors(url):
+    with pytest.raises(urllib.error.HTTPError) as e:
+        requestSequence('essen', 'nosuchsong', url=url)
+    assert e.value.code == 404
+    with pytest.raises(urllib.error.HTTPError) as e:
+        requestSequence(kern='**kern\n*M2/4\n=1\n4x\n*-\n', url=url)
+    assert e.value.code == 422
@@ -0,0 +1,139 @@
+import os
+import csv
+import sys
+import json
+import shutil
+from fractions import Fraction
+
+import pytest
+
+pytest.importorskip('music21')
+
+import mtc_to_seqs
+from synthkern import writeCorpus
+from shardwriter import readShards
+from conftest import BINDIR, krnFiles
+
+#Every extraction path gives the same sequences as the default (serial, music21, one
+#.json file per song), on a synthetic corpus and the fixtures in tests/data.
+
+@pytest.fixture(scope='module')
+def corpus(tmp_path_factory):
+    root = tmp_path_factory.mktemp('essen')
+    writeCorpus(str(root), 8, seed=3, minmeasures=2, maxmeasures=8)
+    with open(root / 'metadata.csv', 'a', encoding='utf8', newline='') as f:
+        writer = csv.writer(f)
+        for krnpath in krnFiles():
+            songid = os.path.basename(krnpath)[:-len('.krn')]
+            shutil.copy(krnpath, root / 'krn')
+            writer.writerow([songid, songid, 'fixture'])
+    return root
+
+#run mtc_to_seqs.py -essen on the corpus with options (by default with -imaengine python)
+#returns dict id -> sequence
+def run(corpus, outputpath, options, monkeypatch):
+    os.makedirs(outputpath, exist_ok=True)
+    if '-imaengine' not in options:
+        options = ['-imaengine', 'python'] + options
+    monkeypatch.setattr(sys, 'argv', ['mtc_to_seqs.py', '-essen', '-essenroot', str(corpus), '-outputpath', str(outputpath)] + options)
+    try:
+        mtc_to_seqs.main()
+    finally:
+        mtc_to_seqs.configure([])
+    return readOutput(outputpath, options)
+
+def readOutput(outputpath, options):
+    if '-shards' in options:
+        return {seq['id']: seq for seq in readShards(outputpath)}
+    if '-store' in options:
+        from featurestore import FeatureStore
+        store = FeatureStore(os.path.join(outputpath, 'essen_sequences.mtcstore'))
+        return {songid: store.sequence(songid) for songid in store.ids.tolist()}
+    if '-parquet' in options:
+        pq = pytest.importorskip('pyarrow.parquet')
+        rows = pq.read_table(os.path.join(outputpath, 'essen_sequences.parquet')).to_pylist()
+        return {row['id']: row for row in rows}
+    seqs = {}
+    for name in os.listdir(outputpath):
+        if name.endswith('.json'):
+            with open(os.path.join(outputpath, name)) as f:
+                seq = json.loads(f.read())
+            seqs[seq['id']] = seq
+    return seqs
+
+@pytest.fixture(scope='module')
+def default(corpus, tmp_path_factory):
+    monkeypatch = pytest.MonkeyPatch()
+    try:
+        seqs = run(corpus, tmp_path_factory.mktemp('default'), [], monkeypatch)
+    finally:
+        monkeypatch.undo()
+    assert len(seqs) == 8 + len(krnFiles())
+    return seqs
+
+@pytest.mark.parametrize('options', [
+    ['-jobs', '2'],
+    ['-jobs', '2', '-chunksize', '1'],
+    ['-songtimeout', '60'],
+    ['-jobs', '2', '-recycleafter', '3'],
+    ['-fastparse'],
+    ['-fastparse', '-jobs', '2'],
+    ['-shards'],
+    ['-store'],
+], ids=' '.join)
+def test_sameasdefault(corpus, default, tmp_path, monkeypatch, options):
+    seqs = run(corpus, tmp_path, options, monkeypatch)
+    if '-store' in options:
+        #the store has all features of all songs, None for missing values
+        default = {songid: dict(seq, features={name: seq['features'].get(name) for name in mtc_to_seqs.featureGraph.features}) for songid, seq in default.items()}
+        seqs = {songid: dict(seq, features={name: values for name, values in seq['features'].items() if name in mtc_to_seqs.featureGraph.features}) for songid, seq in seqs.items()}
+        for seq in list(seqs.values()) + list(default.values()):
+            for name in [name for name, value in seq.items() if value is None]:
+                del seq[name]
+    assert seqs == default
+
+def test_parquet(corpus, default, tmp_path, monkeypatch):
+    rows = run(corpus, tmp_path, ['-parquet'], monkeypatch)
+    assert rows.keys() == default.keys()
+    for songid, seq in default.items():
+        for name, values in seq['features'].items():
+            assert rows[songid][name] == values, name
+
+#a second -shards run replaces the shards of the first, -missing adds to them
+def test_shardsrerun(corpus, default, tmp_path, monkeypatch):
+    assert run(corpus, tmp_path, ['-shards'], monkeypatch) == default
+    assert run(corpus, tmp_path, ['-shards'], monkeypatch) == default
+    assert len([name for name in os.listdir(tmp_path) if name.endswith('.manifest.json')]) == 1
+    assert run(corpus, tmp_path, ['-shards', '-missing'], monkeypatch) == default
+
+#with onsets2ima (a stand-in that uses ima.py), started for the next songs
+def test_onsets2ima(corpus, default, tmp_path, monkeypatch):
+    monkeypatch.setenv('PATH', BINDIR + os.pathsep + os.environ['PATH'])
+    for options in (['-imaprocs', '4'], ['-imaprocs', '3', '-jobs', '2']):
+        assert run(corpus, tmp_path / options[1], ['-imaengine', 'onsets2ima'] + options, monkeypatch) == default
+
+#caches: the first run fills them, the second uses them
+@pytest.mark.parametrize('cache', ['-melodycache', '-imacache'])
+def test_caches(corpus, default, tmp_path, monkeypatch, cache):
+    options = [cache, str(tmp_path / 'cache')]
+    assert run(corpus, tmp_path / 'first', options, monkeypatch) == default
+    assert run(corpus, tmp_path / 'second', options, monkeypatch) == default
+
+#a second run with -incremental extracts nothing, and keeps the output
+def test_incremental(corpus, default, tmp_path, monkeypatch, capsys):
+    assert run(corpus, tmp_path, ['-incremental'], monkeypatch) == default
+    capsys.readouterr()
+    assert run(corpus, tmp_path, ['-incremental'], monkeypatch) == default
+    assert capsys.readouterr().out.count('unchanged. Skipping.') == len(default)
+
+#the fraction features are consistent with each other
+def test_fractions(default):
+    for seq in default.values():
+        features = seq['features']
+        for i, (duration, rest, ioi) in enumerate(zip(features['duration_frac'], features['restduration_frac'], features['IOI_frac'])):
+            assert float(Fraction(duration)) == features['duration'][i]
+            if ioi is not None:
+                assert Fraction(ioi) == Fraction(duration) + Fraction(rest or 0)
+        for prev, ioi, ior in zip(features['IOI_frac'], features['IOI_frac'][1:], features['IOR_frac'][1:]):
+            if ior is not None:
+                assert Fraction(ior) == Fraction(ioi) / Fraction(prev)
@@ -0,0 +1,86 @@
+import os
+import sys
+
+import pytest
+
+from failureledger import FailureLedger
+from synthkern import writeCorpus
+
+@pytest.fixture
+def ledger(tmp_path):
+    ledger = FailureLedger(tmp_path / 'failures.sqlite')
+    yield ledger
+    ledger.close()
+
+@pytest.fixture
+def krnpath(tmp_path):
+    path = tmp_path / 'song.krn'
+    path.write_text('**kern\n4c\n*-\n')
+    return str(path)
+
+def test_unchanged(ledger, krnpath):
+    assert not ledger.quarantined(krnpath, 'v1')
+    ledger.record('song', krnpath, 'v1', 'parse', 'ValueError', 'broken')
+    assert ledger.quarantined(krnpath, 'v1')
+    #another mtime with the same content: the hash is the same
+    os.utime(krnpath, ns=(0, 10**9))
+    assert ledger.quarantined(krnpath, 'v1')
+    assert ledger.summary() == [('parse', 'ValueError', 1, ['song'])]
+    assert [(f['songid'], f['message']) for f in ledger.failures('ValueError')] == [('song', 'broken')]
+    assert ledger.failures('KeyError') == []
+
+def test_changedfile(ledger, krnpath):
+    ledger.record('song', krnpath, 'v1', 'parse', 'ValueError')
+    with open(krnpath, 'w') as f:
+        f.write('**kern\n4d\n*-\n')
+    os.utime(krnpath, ns=(0, 10**9))
+    assert not ledger.quarantined(krnpath, 'v1')
+
+def test_changedversion(ledger, krnpath):
+    ledger.record('song', krnpath, 'v1', 'parse', 'ValueError')
+    assert not ledger.quarantined(krnpath, 'v2')
+
+def test_missingfile(ledger, krnpath):
+    ledger.record('song', krnpath, 'v1', 'parse', 'ValueError')
+    os.remove(krnpath)
+    assert not ledger.quarantined(krnpath, 'v1')
+
+#after a successful retry the song is no longer quarantined
+def test_clear(ledger, krnpath):
+    ledger.record('song', krnpath, 'v1', 'parse', 'ValueError')
+    ledger.clear(krnpath)
+    assert not ledger.quarantined(krnpath, 'v1')
+    assert ledger.failures() == []
+
+#mtc_to_seqs.py -failures skips the songs that failed before, -retryfailed extracts them again
+def test_extraction(tmp_path, monkeypatch, capsys):
+    pytest.importorskip('music21')
+    import mtc_to_seqs
+    corpus = tmp_path / 'essen'
+    writeCorpus(str(corpus), 3, seed=3, minmeasures=2, maxmeasures=4)
+    broken = corpus / 'krn' / 'synth000001.krn'
+    fixed = broken.read_text()
+    broken.write_text('**kern\n*M3/4\n4c\n=1\n*-\n')
+    outputpath = tmp_path / 'output'
+    os.makedirs(outputpath)
+    ledgerpath = tmp_path / 'failures.sqlite'
+    def run(*options):
+        monkeypatch.setattr(sys, 'argv', ['mtc_to_seqs.py', '-essen', '-essenroot', str(corpus), '-outputpath', str(outputpath), '-imaengine', 'python', '-failures', str(ledgerpath)] + list(options))
+        try:
+            mtc_to_seqs.main()
+        finally:
+            mtc_to_seqs.configure([])
+        return capsys.readouterr().out
+    run()
+    assert sorted(os.listdir(outputpath)) == ['synth000000.json', 'synth000002.json']
+    assert 'synth000001 failed before. Skipping.' in run()
+    assert 'failed before' not in run('-retryfailed')
+    ledger = FailureLedger(ledgerpath)
+    try:
+        assert [f['songid'] for f in ledger.failures()] == ['synth000001']
+        broken.write_text(fixed)
+        run('-retryfailed')
+        assert ledger.failures() == []
+    finally:
+        ledger.close()
+    assert 'synth000001.json' in os.listdir(outputpath)
@@ -0,0 +1,46 @@
+import os
+
+import pytest
+
+pytest.importorskip('music21')
+
+import mtc_to_seqs
+from kernparser import parseKern, KernMelody, KernUnsupportedError
+from conftest import DATADIR, krnFiles
+
+@pytest.fixture
+def configure():
+    #configure(options), reset to the defaults afterwards
+    yield lambda options: mtc_to_seqs.configure(options + ['-imaengine', 'python'])
+    mtc_to_seqs.configure([])
+
+def extract(configure, krnpath, options):
+    configure(options)
+    failure = {}
+    seq = mtc_to_seqs.extractFeatures(krnpath, failure=failure)
+    assert seq is not None, failure
+    return seq
+
+@pytest.mark.parametrize('krnpath', krnFiles(), ids=os.path.basename)
+def test_sameasmusic21(configure, krnpath):
+    assert extract(configure, krnpath, ['-fastparse']) == extract(configure, krnpath, [])
+
+@pytest.mark.parametrize('krnpath', krnFiles(), ids=os.path.basename)
+def test_sameasmusic21_selection(configure, krnpath):
+    options = ['-features', 'beatstrength,beat_str,timesignature,tonic,mode,scaledegree']
+    assert extract(configure, krnpath, ['-fastparse'] + options) == extract(configure, krnpath, options)
+
+def test_nativeparse(configure):
+    configure(['-fastparse'])
+    assert isinstance(mtc_to_seqs.parseMelody(os.path.join(DATADIR, 'tuplets.krn')), KernMelody)
+
+#music21 gives other beats after a meter change after a barline without number
+def test_unnumberedmeterchange(configure):
+    with pytest.raises(KernUnsupportedError):
+        parseKern(os.path.join(DATADIR, 'metermixed.krn'))
+    configure(['-fastparse'])
+    assert not isinstance(mtc_to_seqs.parseMelody(os.path.join(DATADIR, 'metermixed.krn')), KernMelody)
+
+def test_numberedmeterchange():
+    km = parseKern(os.path.join(DATADIR, 'tuplets.krn'))
+    assert [(numerator, denominator) for _, numerator, denominator in km.timesignatures] == [(2, 4), (3, 4)]
@@ -0,0 +1,43 @@
+import pytest
+
+from featuregraph import FeatureGraph
+
+def graph(calls):
+    g = FeatureGraph(givens=['x'])
+    def node(name, func):
+        def f(*args):
+            calls.append(name)
+            return func(*args)
+        return f
+    g.value('double', node('double', lambda x: 2 * x), ['x'])
+    g.marker('meter')
+    g.add('a', node('a', lambda double: double + 1), ['double'])
+    g.add('b', node('b', lambda x, meter: x - 1), ['x', 'meter'])
+    g.add('c', node('c', lambda a, b: a * b), ['a', 'b'])
+    return g
+
+def test_compute():
+    calls = []
+    g = graph(calls)
+    assert g.features == ['a', 'b', 'c']
+    assert g.compute(['c', 'a'], {'x': 3}) == {'a': 7, 'c': 14}
+    assert calls == ['double', 'a', 'b', 'c']
+    assert g.needs(['b'], 'meter') and not g.needs(['a'], 'meter')
+
+def test_unknowninput():
+    g = FeatureGraph()
+    with pytest.raises(ValueError):
+        g.add('a', lambda y: y, ['y'])
+
+#start() computes the given nodes and their inputs, compute() the rest
+def test_start():
+    calls = []
+    g = graph(calls)
+    values = g.start(['c'], {'x': 3}, ['a'])
+    assert calls == ['double', 'a']
+    assert g.compute(['c'], values) == {'c': 14}
+    assert calls == ['double', 'a', 'b', 'c']
+    #not needed for the features: not started
+    calls.clear()
+    g.start(['b'], {'x': 3}, ['a'])
+    assert calls == []
@@ -0,0 +1,60 @@
+import os
+
+import pytest
+
+from featurestore import FeatureStoreWriter, FeatureStore
+
+def sequence(songid, n):
+    return {
+        'id': songid,
+        'type': 'vocal',
+        'year': 1900 + n,
+        'freemeter': False,
+        'features': {
+            'midipitch': list(range(60, 60 + n)),
+            'duration': [1.0] * n,
+            'diatonicinterval': [None] + [1] * (n - 1),
+            'nextisrest': [False] * (n - 1) + [True],
+            'lyrics': ['la'] * (n - 1) + [None],
+        },
+    }
+
+def writeStore(path, seqs):
+    with FeatureStoreWriter(path) as writer:
+        for seq in seqs:
+            writer.write(seq)
+
+def test_roundtrip(tmp_path):
+    path = tmp_path / 'seqs.mtcstore'
+    seqs = [sequence('b', 3), sequence('a', 5), sequence('c', 1)]
+    writeStore(path, seqs)
+    assert not os.path.exists(str(path) + '.tmp')
+    store = FeatureStore(path)
+    assert len(store) == 3
+    assert 'a' in store and 'd' not in store
+    for seq in seqs:
+        res = store.sequence(seq['id'], features=list(seq['features']))
+        assert res['features'] == seq['features']
+        assert res['year'] == seq['year']
+        assert res['freemeter'] is False
+    #not written: None
+    assert store.feature('a', 'pitch') == [None] * 5
+
+#only text features selected, and a song without lyrics
+def test_nofeatures(tmp_path):
+    path = tmp_path / 'seqs.mtcstore'
+    seqs = [{'id': 'a', 'features': {}}, {'id': 'b', 'features': {'lyrics': ['x', 'y']}}]
+    writeStore(path, seqs)
+    store = FeatureStore(path)
+    assert store.feature('a', 'lyrics') == []
+    assert store.feature('b', 'lyrics') == ['x', 'y']
+
+#an error does not change the existing store
+def test_errordiscards(tmp_path):
+    path = tmp_path / 'seqs.mtcstore'
+    writeStore(path, [sequence('a', 2)])
+    with pytest.raises(ValueError):
+        writeStore(path, [sequence('b', 2), {'id': 'c', 'features': {'unknown': [1]}}])
+    assert not os.path.exists(str(path) + '.tmp')
+    store = FeatureStore(path)
+    assert list(store.ids) == ['a']
@@ -0,0 +1,56 @@
+import os
+import sys
+import random
+import subprocess
+
+import pytest
+
+from ima import localMeters, imaweight, imaweight_spectral
+
+#local meters by definition: the sequences of equally spaced onsets with at least
+#minlength+1 onsets that are not contained in another such sequence
+def referenceMeters(onsets, minlength=2):
+    on = set(onsets)
+    candidates = []
+    for s in on:
+        for d in range(1, max(on) - s + 1):
+            if s - d in on or s + d not in on:
+                continue
+            k = 1
+            while s + (k + 1) * d in on:
+                k += 1
+            if k >= minlength:
+                candidates.append((s, d, k, frozenset(range(s, s + k*d + 1, d))))
+    return sorted(
+        (s, d, k) for s, d, k, points in candidates
+        if not any(points < other for _, _, _, other in candidates)
+    )
+
+def randomOnsets(rng):
+    return sorted(rng.sample(range(48), rng.randint(2, 20)))
+
+@pytest.mark.parametrize('seed', range(30))
+def test_localmeters(seed):
+    onsets = randomOnsets(random.Random(seed))
+    assert sorted(localMeters(onsets)) == referenceMeters(onsets)
+
+def test_weights():
+    #one local meter with period 2 and k=3
+    onsets = [0, 2, 4, 6]
+    assert localMeters(onsets) == [(0, 2, 3)]
+    assert imaweight(onsets) == [9.0, 9.0, 9.0, 9.0]
+    assert imaweight_spectral(onsets, positions=range(0, 7)) == [9.0, 0.0, 9.0, 0.0, 9.0, 0.0, 9.0]
+
+@pytest.mark.parametrize('seed', range(10))
+def test_spectralonsets(seed):
+    onsets = randomOnsets(random.Random(seed))
+    meters = localMeters(onsets)
+    #the spectral weight of an onset is at least its metric weight
+    for w, ws in zip(imaweight(onsets, meters=meters), imaweight_spectral(onsets, meters=meters)):
+        assert ws >= w
+
+#command line as onsets2ima
+def test_commandline():
+    script = os.path.join(os.path.dirname(__file__), '..', 'src', 'ima.py')
+    out = subprocess.run([sys.executable, script, '-onsets', '0', '2', '4', '6'], capture_output=True, text=True, check=True).stdout
+    assert out.split('\n')[:2] == ['9.0 9.0 9.0 9.0', '9.0 0.0 9.0 0.0 9.0 0.0 9.0']
@@ -0,0 +1,47 @@
+import os
+
+from imacache import IMACache
+
+IMA = [1.0, 0.5, 2.0]
+IMA_SPECT = [3.0, 1.5, 0.25]
+
+def test_normalized(tmp_path):
+    cache = IMACache(tmp_path / 'ima.sqlite')
+    #same rhythm: other start and resolution
+    assert cache.key([0, 2, 6], 'python 1') == cache.key([4, 8, 16], 'python 1')
+    assert cache.key([0, 2, 6], 'python 1') != cache.key([0, 2, 4], 'python 1')
+
+#weights of another engine are not used
+def test_engine(tmp_path):
+    cache = IMACache(tmp_path / 'ima.sqlite')
+    cache.put(cache.key([0, 2, 6], 'python 1'), IMA, IMA_SPECT)
+    assert cache.get(cache.key([0, 2, 6], 'python 1')) == (IMA, IMA_SPECT)
+    assert cache.get(cache.key([0, 2, 6], 'onsets2ima 1')) is None
+    assert cache.get(cache.key([0, 2, 6], 'python 2')) is None
+
+#hits are written in batches
+def test_flush(tmp_path):
+    cache = IMACache(tmp_path / 'ima.sqlite', flushevery=3)
+    key = cache.key([0, 1], 'python 1')
+    cache.put(key, IMA[:2], IMA_SPECT[:2])
+    other = IMACache(tmp_path / 'ima.sqlite')
+    cache.get(key)
+    cache.get(key)
+    assert other.stats()['hits'] == 0
+    cache.get(key)
+    assert other.stats()['hits'] == 3
+    cache.get(key)
+    assert cache.stats()['hits'] == 4
+    assert (cache.hits, cache.misses) == (4, 0)
+
+#least recently used entries are removed
+def test_evict(tmp_path):
+    cache = IMACache(tmp_path / 'ima.sqlite', maxbytes=3*48) #48 bytes per entry
+    keys = [cache.key(list(range(0, 2*n, 2)) + [2*n+1], 'python 1') for n in range(1, 5)]
+    for key in keys[:3]:
+        cache.put(key, IMA, IMA_SPECT)
+    cache.get(keys[0]) #keys[1] is the least recently used
+    cache.put(keys[3], IMA, IMA_SPECT)
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[3]) is not None
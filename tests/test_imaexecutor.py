@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+import imaexecutor
+from imaexecutor import IMAExecutor, IMATimeoutError, getExecutor
+from conftest import BINDIR, DATADIR, krnRecords
+import mtc_to_seqs
+
+PROGRAM = os.path.join(BINDIR, 'onsets2ima')
+ONSETS = [0, 2, 4, 6, 7, 8, 12, 14, 16]
+
+def test_sameaspython():
+    executor = IMAExecutor(program=PROGRAM)
+    try:
+        assert executor.getIMA(ONSETS) == mtc_to_seqs.getIMA_python(ONSETS)
+    finally:
+        executor.shutdown()
+
+#onsets that do not fit on the command line go to stdin
+def test_stdin():
+    executor = IMAExecutor(program=PROGRAM, maxarglength=10)
+    try:
+        assert executor.getIMA(ONSETS) == mtc_to_seqs.getIMA_python(ONSETS)
+    finally:
+        executor.shutdown()
+
+def test_timeout(monkeypatch):
+    monkeypatch.setenv('FAKE_ONSETS2IMA_SLEEP', '5')
+    executor = IMAExecutor(program=PROGRAM, timeout=0.5, retries=1)
+    try:
+        with pytest.raises(IMATimeoutError):
+            executor.getIMA(ONSETS)
+    finally:
+        executor.shutdown()
+
+def test_getexecutor():
+    first = getExecutor(program=PROGRAM, timeout=1.0)
+    assert getExecutor(program=PROGRAM, timeout=1.0) is first
+    #other arguments: other executor
+    second = getExecutor(program=PROGRAM, timeout=2.0)
+    assert second is not first
+    assert second.timeout == 2.0
+    assert not first.thread.is_alive()
+    second.shutdown()
+    imaexecutor._executor = None
+
+#songs are started ahead (onsets2ima runs for the next songs), in the order of the songs
+def test_lookahead(monkeypatch):
+    pytest.importorskip('music21')
+    monkeypatch.setenv('PATH', BINDIR + os.pathsep + os.environ['PATH'])
+    records = krnRecords()
+    songids = sorted(records)
+    try:
+        results = {}
+        for options in (['-imaengine', 'python'], ['-imaengine', 'onsets2ima', '-imaprocs', '3']):
+            mtc_to_seqs.configure(options)
+            mtc_to_seqs.initSongWorker(mtc_to_seqs.args, DATADIR, records, None)
+            results[options[1]] = list(mtc_to_seqs.extractSongsWorker(songids))
+        assert mtc_to_seqs.songLookahead() == 2
+        assert [seq['id'] for seq, _, _ in results['onsets2ima']] == songids
+        assert results['onsets2ima'] == results['python']
+    finally:
+        mtc_to_seqs.configure([])
@@ -0,0 +1,49 @@
+import os
+
+import pytest
+
+from kernparser import parseKern, KernUnsupportedError
+from conftest import DATADIR, krnFiles
+
+KERNFILES = [path for path in krnFiles() if os.path.basename(path) != 'metermixed.krn']
+
+def parseString(tmp_path, kern):
+    path = tmp_path / 'song.krn'
+    path.write_text(kern)
+    return parseKern(path)
+
+#the same notes and rests as the music21 stream of parseMelody()
+@pytest.mark.parametrize('krnpath', KERNFILES, ids=os.path.basename)
+def test_sameasmusic21(krnpath):
+    pytest.importorskip('music21')
+    import mtc_to_seqs
+    mtc_to_seqs.configure([])
+    s = mtc_to_seqs.parseMelody(krnpath)
+    km = parseKern(krnpath)
+    assert [(e.isRest, e.offset, e.quarterLength) for e in km.events] == [(n.isRest, n.offset, n.duration.quarterLength) for n in s.notesAndRests]
+    assert [(e.nameWithOctave, e.midi, e.diatonicNoteNum) for e in km.notes] == [(n.pitch.nameWithOctave, n.pitch.midi, n.pitch.diatonicNoteNum) for n in s.notes]
+
+def test_ties(tmp_path):
+    km = parseString(tmp_path, '**kern\n*M3/4\n=1\n4c\n[4d\n4d_\n=2\n4d]\n4e-\n4r\n==\n*-\n')
+    assert [(e.name, e.quarterLength, e.tie) for e in km.notes] == [('C', 1, None), ('D', 3, None), ('E-', 1, None)]
+
+def test_grace(tmp_path):
+    km = parseString(tmp_path, '**kern\n*M2/4\n=1\n8qc\n4d\n4e\n==\n*-\n')
+    assert [e.name for e in km.notes] == ['D', 'E']
+
+def test_pickup():
+    km = parseKern(os.path.join(DATADIR, 'pickup.krn'))
+    assert km.measures[0].paddingLeft == 2
+    assert km.timesignatures == [(0, 3, 4)]
+    assert km.keys == [(0, 'G')]
+
+@pytest.mark.parametrize('kern', [
+    '**kern\t**kern\n4c\t4d\n*-\t*-\n',                  #two spines
+    '**kern\n*M2/4\n=1\n*^\n4c\t4d\n*v\t*v\n*-\n',      #spine split
+    '**kern\n*M2/4\n=1\n4c\n[4d\n==\n*-\n',             #unterminated tie
+    '**kern\n*M2/4\n=1\n4c\n4d\n8e\n==\n*-\n',          #measure too long
+    '**kern\n*M2/4\n=1\n4c\n*M3/4\n4d\n==\n*-\n',       #meter change within measure
+])
+def test_unsupported(tmp_path, kern):
+    with pytest.raises(KernUnsupportedError):
+        parseString(tmp_path, kern)
@@ -0,0 +1,79 @@
+import random
+from fractions import Fraction
+
+import pytest
+
+from lbdm import lbdm, lbdmBatch
+
+#The per-song implementation that lbdm.py replaced (Cambouropoulos 2001)
+
+def oneDegreeChange(x1, x2, const_add=0.0):
+    res = None
+    x1 += const_add
+    x2 += const_add
+    if x1 == x2: return 0.0
+    if (x1+x2) != 0 and x1 >= 0 and x2 >= 0:
+        res = float(abs(x1-x2)) / float (x1 + x2)
+    return res
+
+def degreeChange(thr, const_add=0.0):
+    pairs = zip(thr[:-1], thr[1:-1])
+    return [None] + [oneDegreeChange(x1, x2, const_add=const_add) for x1, x2 in pairs] + [None]
+
+def boundaryStrength(rs, intervals):
+    pairs = zip(rs[1:-1], rs[2:-1], intervals[1:])
+    strength = [c * (r1 + r2) for r1, r2, c in pairs]
+    if len(strength) == 0:
+        return [None, None, None]
+    maxs = max(strength)
+    if maxs > 0:
+        strength = [s / maxs for s in strength]
+    return [None] + strength + [None, None]
+
+def reference(chromaticinterval, ioi, restduration_frac):
+    if len(chromaticinterval) < 3:
+        return {name: [None] * len(chromaticinterval) for name in ('lbdm_spitch', 'lbdm_sioi', 'lbdm_srest', 'lbdm_rpitch', 'lbdm_rioi', 'lbdm_rrest', 'lbdm_boundarystrength')}
+    thr_int = [min(12, abs(i)) for i in chromaticinterval[1:]] + [None]
+    thr_ioi = [min(4.0, i) for i in ioi[:-1]] + [None]
+    thr_rd = [min(4.0, float(Fraction(r))) if r is not None else 0.0 for r in restduration_frac[:-1]] + [None]
+    res = {
+        'lbdm_rpitch': degreeChange(thr_int, const_add=1),
+        'lbdm_rioi': degreeChange(thr_ioi),
+        'lbdm_rrest': degreeChange(thr_rd),
+    }
+    res['lbdm_spitch'] = boundaryStrength(res['lbdm_rpitch'], thr_int)
+    res['lbdm_sioi'] = boundaryStrength(res['lbdm_rioi'], thr_ioi)
+    res['lbdm_srest'] = boundaryStrength(res['lbdm_rrest'], thr_rd)
+    triplets = zip(res['lbdm_spitch'][1:-2], res['lbdm_sioi'][1:-2], res['lbdm_srest'][1:-2])
+    res['lbdm_boundarystrength'] = [None] + [0.25*p + 0.5*i + 0.25*r for p, i, r in triplets] + [None, None]
+    return res
+
+#random song: (midipitch, ioi, restafter) and the inputs of the reference
+def randomSong(rng, n):
+    midipitch = [rng.randint(55, 80) for _ in range(n)]
+    durations = [rng.choice([Fraction(1, 4), Fraction(1, 2), Fraction(1), Fraction(3, 2), Fraction(2), Fraction(6)]) for _ in range(n)]
+    rests = [rng.choice([None, None, None, Fraction(1, 2), Fraction(1), Fraction(5)]) for _ in range(n)]
+    rests[-1:] = [None] * min(n, 1)
+    ioi = [float(d + (r or 0)) for d, r in zip(durations, rests)]
+    ioi[-1:] = [None] * min(n, 1)
+    restafter = [float(r or 0) for r in rests]
+    chromaticinterval = [None] + [b - a for a, b in zip(midipitch, midipitch[1:])]
+    restduration_frac = [str(r) if r is not None else None for r in rests]
+    return (midipitch, ioi, restafter), (chromaticinterval, ioi, restduration_frac)
+
+@pytest.mark.parametrize('seed', range(20))
+def test_reference(seed):
+    rng = random.Random(seed)
+    song, inputs = randomSong(rng, rng.randint(3, 40))
+    assert lbdm(*song) == reference(*inputs)
+
+def test_short():
+    for n in range(3):
+        res = lbdm([60] * n, [1.0] * (n - 1) + [None] * (n > 0), [0.0] * n)
+        assert all(values == [None] * n for values in res.values())
+
+#all songs in one pass: the same as one by one
+def test_batch():
+    rng = random.Random(1)
+    songs = [randomSong(rng, n)[0] for n in (5, 1, 12, 3, 0, 8)]
+    assert lbdmBatch(songs) == [lbdm(*song) for song in songs]
@@ -0,0 +1,62 @@
+import os
+import json
+import shutil
+
+import pytest
+
+import mtc_to_seqs
+from songmanifest import SongManifest
+from conftest import krnFiles, krnRecords
+
+#output of other features or another IMA engine is not valid
+def test_extractorversion():
+    try:
+        mtc_to_seqs.configure(['-features', 'midipitch,duration'])
+        version = mtc_to_seqs.extractorVersion()
+        mtc_to_seqs.configure(['-features', 'duration,midipitch'])
+        assert mtc_to_seqs.extractorVersion() == version
+        mtc_to_seqs.configure(['-features', 'midipitch,duration,beat'])
+        assert mtc_to_seqs.extractorVersion() != version
+        mtc_to_seqs.configure(['-features', 'midipitch,duration', '-imaengine', 'python'])
+        assert mtc_to_seqs.extractorVersion() != version
+    finally:
+        mtc_to_seqs.configure([])
+
+def test_incrementalonefile():
+    with pytest.raises(SystemExit):
+        mtc_to_seqs.configure(['-incremental', '-mtcann'])
+    with pytest.raises(SystemExit):
+        mtc_to_seqs.configure(['-incremental', '-chorales'])
+    mtc_to_seqs.configure([])
+
+def extract(krndir, records, manifest):
+    written = []
+    for seq in mtc_to_seqs.getSequences(krndir, records, manifest=manifest):
+        output = os.path.join(krndir, f'{seq["id"]}.json')
+        with open(output, 'w') as f:
+            f.write(json.dumps(seq)+'\n')
+        manifest.commit(seq['id'], output)
+        written.append(seq['id'])
+    return written
+
+#the output of a song that fails on a rerun is removed
+def test_failedrerun(tmp_path):
+    pytest.importorskip('music21')
+    for krnpath in krnFiles():
+        shutil.copy(krnpath, tmp_path)
+    records = krnRecords()
+    for record in records.values():
+        record['metahash'] = mtc_to_seqs.hashString(json.dumps(record))
+    manifest = SongManifest(tmp_path / 'test_manifest.sqlite')
+    try:
+        mtc_to_seqs.configure(['-imaengine', 'python'])
+        assert extract(tmp_path, records, manifest) == sorted(records)
+        assert extract(tmp_path, records, manifest) == []
+        (tmp_path / 'ties.krn').write_text('**kern\n*M3/4\n=1\n4c\n4x\n*-\n')
+        assert extract(tmp_path, records, manifest) == []
+        assert not (tmp_path / 'ties.json').exists()
+        assert manifest.get('ties') is None
+        assert (tmp_path / 'pickup.json').exists()
+    finally:
+        manifest.close()
+        mtc_to_seqs.configure([])
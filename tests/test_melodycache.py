@@ -0,0 +1,46 @@
+import os
+import glob
+
+import pytest
+
+import mtc_to_seqs
+from melodycache import MelodyCache
+from conftest import DATADIR
+
+def test_getput(tmp_path):
+    cache = MelodyCache(tmp_path)
+    key = cache.key(os.path.join(DATADIR, 'ties.krn'), 'v1')
+    assert key != cache.key(os.path.join(DATADIR, 'ties.krn'), 'v2')
+    assert cache.get(key) is None
+    cache.put(key, b'melody')
+    assert cache.get(key) == b'melody'
+    cache.discard(key)
+    assert cache.get(key) is None
+
+#processes that share the cache count the entries of the others
+def test_sharedsize(tmp_path):
+    caches = [MelodyCache(tmp_path, maxbytes=10000, rescanfraction=0.1) for _ in range(4)]
+    for i in range(200):
+        caches[i % 4].put(f'{i:040d}', b'x' * 100)
+    size = sum(os.path.getsize(path) for path in glob.glob(str(tmp_path / '*' / '*.pickle')))
+    assert size <= 10000 + 4 * 1000
+
+#a corrupt entry is removed, and the file is parsed again
+def test_corrupt(tmp_path):
+    pytest.importorskip('music21')
+    path = os.path.join(DATADIR, 'ties.krn')
+    try:
+        mtc_to_seqs.configure(['-melodycache', str(tmp_path)])
+        reference = mtc_to_seqs.parseMelody(path)
+        entries = glob.glob(str(tmp_path / '*' / '*.pickle'))
+        assert len(entries) == 1
+        with open(entries[0], 'r+b') as f:
+            f.truncate(100)
+        s = mtc_to_seqs.parseMelody(path)
+        assert [n.nameWithOctave for n in s.notes] == [n.nameWithOctave for n in reference.notes]
+        #parsed again and cached
+        assert os.path.getsize(entries[0]) > 100
+        s = mtc_to_seqs.parseMelody(path)
+        assert [n.nameWithOctave for n in s.notes] == [n.nameWithOctave for n in reference.notes]
+    finally:
+        mtc_to_seqs.configure([])
@@ -0,0 +1,49 @@
+import gzip
+import json
+
+import pytest
+
+from mergestream import mergeFiles, readChunks
+
+def writeJsonl(path, records):
+    data = ''.join(json.dumps(record)+'\n' for record in records).encode('utf8')
+    if str(path).endswith('.gz'):
+        data = gzip.compress(data)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+def readJsonl(path):
+    with gzip.open(path, 'rt') as f:
+        return [json.loads(line) for line in f]
+
+SEQS = [{'id': f's{i}', 'features': {'midipitch': [60+i, 62], 'lyrics': ['x', 'y']}} for i in range(7)]
+FEATURES = [{'id': f's{i}', 'features': {'lyrics': ['a', str(i)]}} for i in range(1, 9)]
+
+def test_merge(tmp_path):
+    writeJsonl(tmp_path / 'seqs.jsonl.gz', SEQS)
+    writeJsonl(tmp_path / 'features.jsonl', FEATURES)
+    seqsonly, featuresonly = mergeFiles(tmp_path / 'seqs.jsonl.gz', tmp_path / 'features.jsonl', tmp_path / 'out.jsonl.gz', jobs=2, chunklines=2)
+    assert seqsonly == ['s0']
+    assert sorted(featuresonly) == ['s7', 's8']
+    merged = readJsonl(tmp_path / 'out.jsonl.gz')
+    assert [seq['id'] for seq in merged] == [seq['id'] for seq in SEQS]
+    assert merged[0]['features'] == SEQS[0]['features']
+    assert merged[3]['features'] == {'midipitch': [63, 62], 'lyrics': ['a', '3']}
+
+def test_readerror(tmp_path):
+    writeJsonl(tmp_path / 'seqs.jsonl.gz', SEQS)
+    data = (tmp_path / 'seqs.jsonl.gz').read_bytes()
+    (tmp_path / 'seqs.jsonl.gz').write_bytes(data[:len(data)//2])
+    with pytest.raises(EOFError):
+        list(readChunks(tmp_path / 'seqs.jsonl.gz', 2))
+
+#on an error the output is not written, and the temporary file is removed
+def test_mergeerror(tmp_path):
+    writeJsonl(tmp_path / 'seqs.jsonl.gz', SEQS)
+    data = (tmp_path / 'seqs.jsonl.gz').read_bytes()
+    (tmp_path / 'seqs.jsonl.gz').write_bytes(data[:len(data)//2])
+    writeJsonl(tmp_path / 'features.jsonl', FEATURES)
+    with pytest.raises(EOFError):
+        mergeFiles(tmp_path / 'seqs.jsonl.gz', tmp_path / 'features.jsonl', tmp_path / 'out.jsonl.gz', jobs=1)
+    assert not (tmp_path / 'out.jsonl.gz').exists()
+    assert not (tmp_path / 'out.jsonl.gz.tmp').exists()
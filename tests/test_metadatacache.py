@@ -0,0 +1,30 @@
+import os
+
+from metadatacache import MetadataCache
+
+#get() builds the table once, and again after the size or the mtime of the CSV or the
+#version changed. Only the newest entry of a table is kept.
+def test_invalidation(tmp_path):
+    csvpath = tmp_path / 'metadata.csv'
+    csvpath.write_text('songid,title\ns1,first\n')
+    cache = MetadataCache(tmp_path / 'cache')
+    builds = []
+    def get(version='1'):
+        def build():
+            builds.append(csvpath.read_text())
+            return {'rows': csvpath.read_text().splitlines()[1:]}
+        return cache.get('test', [str(csvpath)], version, build)
+    assert get() == {'rows': ['s1,first']}
+    assert get() == {'rows': ['s1,first']}
+    assert len(builds) == 1
+    csvpath.write_text('songid,title\ns1,first\ns2,second\n')
+    assert get() == {'rows': ['s1,first', 's2,second']}
+    assert len(builds) == 2
+    st = os.stat(csvpath)
+    csvpath.write_text('songid,title\ns1,FIRST\ns2,SECOND\n')
+    os.utime(csvpath, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert get() == {'rows': ['s1,FIRST', 's2,SECOND']}
+    assert len(builds) == 3
+    get(version='2')
+    assert len(builds) == 4
+    assert len(os.listdir(tmp_path / 'cache')) == 1
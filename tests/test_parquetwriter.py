@@ -0,0 +1,65 @@
+import os
+
+import pytest
+
+pytest.importorskip('pyarrow')
+
+from parquetwriter import ParquetWriter, readParquet
+
+def sequence(songid, n):
+    return {
+        'id': songid,
+        'type': 'vocal',
+        'year': 1900 + n,
+        'freemeter': False,
+        'features': {
+            'midipitch': list(range(60, 60 + n)),
+            'duration': [1.0] * n,
+            'diatonicinterval': [None] + [1] * (n - 1),
+            'nextisrest': [False] * (n - 1) + [True],
+            'phrase_end': [False] * (n - 1) + [True],
+            'lyrics': ['la'] * n,
+        },
+    }
+
+def test_roundtrip(tmp_path):
+    path = tmp_path / 'seqs.parquet'
+    seqs = [sequence('a', 3), sequence('b', 5), sequence('c', 1)]
+    with ParquetWriter(path, rowgroupsize=2) as writer:
+        for seq in seqs:
+            writer.write(seq)
+    assert not os.path.exists(str(path) + '.tmp')
+    df = readParquet(path)
+    assert list(df['id']) == ['a', 'b', 'c']
+    assert list(df['year']) == [1903, 1905, 1901]
+    assert list(df['freemeter']) == [False] * 3
+    for seq, (_, row) in zip(seqs, df.iterrows()):
+        for name in ('midipitch', 'duration', 'nextisrest', 'phrase_end', 'lyrics'):
+            assert list(row[name]) == seq['features'][name]
+        #not written: null list
+        assert row['pitch'] is None
+
+def test_readfeatures(tmp_path):
+    path = tmp_path / 'seqs.parquet'
+    with ParquetWriter(path) as writer:
+        writer.write(sequence('a', 3))
+    df = readParquet(path, features=['nextisrest'])
+    assert 'nextisrest' in df.columns
+    assert 'midipitch' not in df.columns
+    assert list(df['nextisrest'][0]) == [False, False, True]
+
+def test_unknownfeature(tmp_path):
+    seq = sequence('a', 2)
+    seq['features']['nosuchfeature'] = [1, 2]
+    with pytest.raises(ValueError):
+        with ParquetWriter(tmp_path / 'seqs.parquet') as writer:
+            writer.write(seq)
+
+def test_errordiscards(tmp_path):
+    path = tmp_path / 'seqs.parquet'
+    with pytest.raises(RuntimeError):
+        with ParquetWriter(path, rowgroupsize=1) as writer:
+            writer.write(sequence('a', 3))
+            raise RuntimeError('crash')
+    assert not os.path.exists(path)
+    assert not os.path.exists(str(path) + '.tmp')
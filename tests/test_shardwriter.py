@@ -0,0 +1,50 @@
+import os
+import json
+
+import pytest
+
+from shardwriter import ShardWriter, readShards, readManifests, shardedIds, latestGeneration, removeOldGenerations
+
+def writeShards(outputdir, prefix, songids, generation=0, collection='test', **kwargs):
+    with ShardWriter(outputdir, prefix, collection=collection, generation=generation, **kwargs) as writer:
+        for songid in songids:
+            writer.write(songid, json.dumps({'id': songid, 'prefix': prefix}) + '\n')
+
+def test_roundtrip(tmp_path):
+    committed = []
+    songids = [f's{i}' for i in range(50)]
+    writeShards(tmp_path, 'run', songids, maxbytes=100, chunkbytes=200, oncommit=committed.extend)
+    assert [seq['id'] for seq in readShards(tmp_path)] == songids
+    assert committed == songids
+    assert len(readManifests(tmp_path)[0]['shards']) > 1
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.tmp')]
+
+#the incomplete shard is removed, and not committed
+def test_errordiscards(tmp_path):
+    committed = []
+    with pytest.raises(RuntimeError):
+        with ShardWriter(tmp_path, 'run', oncommit=committed.extend) as writer:
+            writer.write('a', json.dumps({'id': 'a'}) + '\n')
+            raise RuntimeError('crash')
+    assert os.listdir(tmp_path) == []
+    assert committed == []
+
+#a new generation replaces the earlier ones, runs in the same generation add songs
+def test_generations(tmp_path):
+    writeShards(tmp_path, 'first', ['a', 'b', 'c'], generation=0)
+    writeShards(tmp_path, 'other', ['x'], generation=0, collection='other')
+    writeShards(tmp_path, 'second', ['a', 'b'], generation=1)
+    assert latestGeneration(tmp_path, 'test') == 1
+    assert latestGeneration(tmp_path, 'none') is None
+    assert sorted(seq['id'] for seq in readShards(tmp_path)) == ['a', 'b', 'x']
+    writeShards(tmp_path, 'missing', ['c'], generation=1)
+    assert shardedIds(tmp_path) == {'a', 'b', 'c', 'x'}
+    removeOldGenerations(tmp_path, 'test', 1)
+    assert not [name for name in os.listdir(tmp_path) if name.startswith('first')]
+    assert sorted(seq['id'] for seq in readShards(tmp_path)) == ['a', 'b', 'c', 'x']
+
+#a song that is in several shards of a generation is read from the newest one
+def test_duplicates(tmp_path):
+    writeShards(tmp_path, 'worker1', ['a', 'b'])
+    writeShards(tmp_path, 'worker2', ['b', 'c'])
+    assert [(seq['id'], seq['prefix']) for seq in readShards(tmp_path)] == [('a', 'worker1'), ('b', 'worker2'), ('c', 'worker2')]
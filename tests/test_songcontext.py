@@ -0,0 +1,97 @@
+import os
+import sys
+import subprocess
+from fractions import Fraction
+
+import numpy as np
+import pytest
+
+pytest.importorskip('music21')
+
+import mtc_to_seqs
+from songcontext import SongContext, KernTimeSignature, KernKey, opFrac
+from kernparser import parseKern
+from conftest import SRCDIR, krnFiles
+
+#the files kernparser handles
+KERNFILES = [path for path in krnFiles() if os.path.basename(path) != 'metermixed.krn']
+
+def contexts(krnpath):
+    mtc_to_seqs.configure([])
+    return SongContext(mtc_to_seqs.parseMelody(krnpath)), SongContext.fromKern(parseKern(krnpath))
+
+def ratios(timesignatures):
+    return [ts.ratioString for ts in timesignatures]
+
+#SongContext.fromKern() gives the same context as the music21 stream
+@pytest.mark.parametrize('krnpath', KERNFILES, ids=os.path.basename)
+def test_fromkern(krnpath):
+    sc, kc = contexts(krnpath)
+    for name in ('ev_offset', 'name', 'nameWithOctave', 'fullname', 'duration', 'tie', 'offset', 'beat', 'beatstr', 'ev_beatduration', 'metersegments', 'lineoffsets', 'resolution', 'nextisrest'):
+        assert getattr(kc, name) == getattr(sc, name), name
+    for name in ('ev_isnote', 'midi', 'octave', 'ev_ticks', 'restafter_ticks', 'beatstrength'):
+        np.testing.assert_array_equal(getattr(kc, name), getattr(sc, name), err_msg=name)
+    assert ratios(kc.timesignature) == ratios(sc.timesignature)
+    assert [ts.beatCount for ts in kc.ev_timesignature] == [ts.beatCount for ts in sc.ev_timesignature]
+    assert [(k.tonic.name, k.mode) for k in kc.key] == [(k.tonic.name, k.mode) for k in sc.key]
+
+#the beat properties of KernTimeSignature are those of music21's TimeSignature
+@pytest.mark.parametrize('denominator', [2, 4, 8, 16])
+def test_timesignature(denominator):
+    import music21
+    assert isinstance(KernTimeSignature.make(3, denominator), KernTimeSignature)
+    for numerator in KernTimeSignature.accentDivisions:
+        ts = music21.meter.TimeSignature(f'{numerator}/{denominator}')
+        kts = KernTimeSignature(numerator, denominator)
+        assert kts.beatCount == ts.beatCount
+        #every 1/24 of the accent divisions, and the triplet and quintuplet positions
+        step = kts.accentStep / 24
+        offsets = {step * i for i in range(int(kts.barDuration / step))}
+        offsets |= {kts.barDuration * Fraction(i, 15 * numerator) for i in range(15 * numerator)}
+        for offset in sorted(offsets):
+            offset = opFrac(offset)
+            expected = (
+                ts.getBeatProportion(offset),
+                ts.getBeatProportionStr(offset),
+                ts.getAccentWeight(offset, forcePositionMatch=True, permitMeterModulus=False),
+                ts.getBeatDuration(offset).quarterLength,
+            )
+            assert kts.beatProperties(offset) == expected, (ts.ratioString, offset)
+
+@pytest.mark.parametrize('keystring', ['C', 'G', 'F#', 'B-', 'a', 'e-', 'c#', 'g##', 'f--'])
+def test_key(keystring):
+    import music21
+    key = music21.key.Key(keystring)
+    kk = KernKey(keystring)
+    assert (kk.tonic.name, kk.tonic.midi, kk.tonic.diatonicNoteNum, kk.mode) == (key.tonic.name, key.tonic.midi, key.tonic.diatonicNoteNum, key.mode)
+
+#other meters are left to music21
+def test_othertimesignature():
+    import music21
+    assert isinstance(KernTimeSignature.make(19, 8), music21.meter.TimeSignature)
+    assert isinstance(KernTimeSignature.make(3, 32), music21.meter.TimeSignature)
+
+#the interval specifiers of the scale degrees are those of music21.interval
+def test_scalespecifiers():
+    import music21
+    for tonic in ['C', 'G', 'B', 'F#', 'B-', 'C-', 'E#']:
+        lowtonic = music21.pitch.Pitch(tonic + '0')
+        for name in [step + alter for step in 'CDEFGAB' for alter in ['', '#', '-', '##', '--']]:
+            for octave in range(0, 7):
+                p = music21.pitch.Pitch(f'{name}{octave}')
+                expected = music21.interval.prefixSpecs[music21.interval.Interval(pitchStart=lowtonic, pitchEnd=p).specifier]
+                assert mtc_to_seqs.pitch2scaledegreeSpecifer(p.diatonicNoteNum, p.midi, lowtonic.diatonicNoteNum, lowtonic.midi) == expected, (tonic, p)
+
+#-fastparse does not need music21, except for the names of tuplet durations
+def test_withoutmusic21():
+    script = 'import sys; from kernparser import parseKern; from songcontext import SongContext\n'
+    script += ''.join(f'SongContext.fromKern(parseKern({path!r}))\n' for path in KERNFILES if os.path.basename(path) != 'tuplets.krn')
+    script += 'print("music21" in sys.modules)'
+    out = subprocess.run([sys.executable, '-c', script], cwd=SRCDIR, capture_output=True, text=True, check=True).stdout
+    assert out.strip() == 'False'
+
+#only what is selected is collected
+def test_nometer():
+    sc = SongContext.fromKern(parseKern(KERNFILES[0]), meter=False, keys=False)
+    assert sc.key == []
+    assert sc.n_notes > 0
@@ -0,0 +1,64 @@
+import os
+import time
+import subprocess
+
+from songsupervisor import SongSupervisor, SongTimeoutError, WorkerDiedError
+
+def init():
+    pass
+
+def failingInit():
+    raise RuntimeError('init')
+
+def square(task):
+    if task == 'slow':
+        time.sleep(60)
+    return task * task
+
+#starts a child in its own session (as IMAExecutor does), and hangs. Writes the pid of
+#the child to the file task.
+def startChild(task):
+    child = subprocess.Popen(['sleep', '60'], start_new_session=True)
+    with open(task, 'w') as f:
+        f.write(str(child.pid))
+    time.sleep(60)
+
+def failed(task, exc):
+    return type(exc)
+
+def test_order():
+    pool = SongSupervisor(2, init, (), square, failed)
+    try:
+        assert list(pool.map(range(20))) == [i * i for i in range(20)]
+    finally:
+        pool.close()
+
+def test_timeout():
+    pool = SongSupervisor(2, init, (), square, failed, timeout=0.5, pollseconds=0.1)
+    try:
+        assert list(pool.map([2, 'slow', 3])) == [4, SongTimeoutError, 9]
+        assert list(pool.map([4])) == [16]
+    finally:
+        pool.close()
+
+#a worker that died in init fails the tasks, and is replaced
+def test_failinginit():
+    pool = SongSupervisor(1, failingInit, (), square, failed, pollseconds=0.1)
+    try:
+        time.sleep(0.5)
+        assert list(pool.map([1, 2, 3])) == [WorkerDiedError] * 3
+    finally:
+        pool.close()
+
+#the process groups started by a killed worker are killed as well
+def test_killchildren(tmp_path):
+    pidfile = str(tmp_path / 'child.pid')
+    pool = SongSupervisor(1, init, (), startChild, failed, timeout=1.0, pollseconds=0.1)
+    try:
+        assert list(pool.map([pidfile])) == [SongTimeoutError]
+    finally:
+        pool.close()
+    with open(pidfile) as f:
+        pid = int(f.read())
+    time.sleep(0.2)
+    assert not os.path.exists(f'/proc/{pid}') or ' Z ' in open(f'/proc/{pid}/stat').read()
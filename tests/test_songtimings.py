@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+from songtimings import SongTimer, Histogram, TimingReport
+
+def timings(parse, features, pitch=0.0):
+    return {'stages': {'parse': [parse, parse/2], 'features': [features, features]}, 'features': {'pitch': [pitch, pitch]}}
+
+def test_histogram():
+    h = Histogram(nbuckets=4)
+    for wall in (0.0005, 0.001, 0.003, 0.004, 0.005, 10.0):
+        h.add(wall, 0.0)
+    assert h.asdict()['histogram'] == [{'le_ms': 1, 'n': 2}, {'le_ms': 4, 'n': 2}, {'le_ms': None, 'n': 2}]
+    assert h.max == 10.0
+
+def test_songtimer():
+    timer = SongTimer()
+    for _ in range(2):
+        with timer.stage('parse'):
+            pass
+    with timer.feature('pitch'):
+        pass
+    assert set(timer.asdict()['stages']) == {'parse'}
+    assert set(timer.asdict()['features']) == {'pitch'}
+
+#the songs are aggregated per collection, with the slowest songs of each
+def test_report(tmp_path):
+    report = TimingReport(slowest=2)
+    report.add('a1', timings(1.0, 2.0))
+    report.begin('b')
+    report.add('b1', timings(0.5, 0.25, pitch=0.2))
+    report.add('b2', timings(3.0, 1.0))
+    report.add('b3', timings(0.1, 0.1))
+    report.begin('')
+    report.add('a2', timings(0.1, 0.2))
+    assert report.collections['b'].slowestIds() == ['b2', 'b1']
+    report.write(tmp_path / 'timings.json')
+    with open(tmp_path / 'timings.json') as f:
+        collections = json.load(f)['collections']
+    assert set(collections) == {'', 'b'}
+    b = collections['b']
+    assert b['total']['n'] == 3
+    assert b['total']['wall'] == pytest.approx(4.95)
+    assert b['stages']['parse']['cpu'] == pytest.approx(1.8)
+    assert b['features']['pitch']['max_wall'] == pytest.approx(0.2)
+    assert [(song['id'], song['dominant_stage']) for song in b['slowest']] == [('b2', 'parse'), ('b1', 'parse')]
+    assert b['slowest'][0]['wall'] == pytest.approx(4.0)
+    assert b['slowest'][0]['cpu'] == pytest.approx(2.5)
+    assert collections['']['total']['n'] == 2
+    assert collections['']['slowest'][0]['dominant_stage'] == 'features'
@@ -0,0 +1,49 @@
+import os
+import gzip
+import json
+
+import pytest
+
+from textindex import TextIndex, blockGzip
+
+def records(n, text='lyrics'):
+    return [{'id': f's{i}', 'text': f'{text} {i} ' + 'la ' * (i % 7)} for i in range(n)]
+
+def jsonl(recs):
+    return ''.join(json.dumps(rec) + '\n' for rec in recs).encode('utf8')
+
+def checkLookups(path, recs):
+    index = TextIndex(path, cachesize=4)
+    for rec in reversed(recs):
+        assert rec['id'] in index
+        assert index[rec['id']] == rec
+    assert 'none' not in index
+    with pytest.raises(KeyError):
+        index['none']
+
+@pytest.mark.parametrize('kind', ['jsonl', 'gz', 'blockgzip'])
+def test_lookups(tmp_path, kind):
+    recs = records(200)
+    path = tmp_path / 'text.jsonl'
+    path.write_bytes(jsonl(recs))
+    if kind == 'gz':
+        path = tmp_path / 'text.jsonl.gz'
+        path.write_bytes(gzip.compress(jsonl(recs)))
+    elif kind == 'blockgzip':
+        blockGzip(tmp_path / 'text.jsonl', tmp_path / 'block.jsonl.gz', blockbytes=500)
+        path = tmp_path / 'block.jsonl.gz'
+        assert gzip.decompress(path.read_bytes()) == jsonl(recs)
+    checkLookups(path, recs)
+
+#a new index of a file that changed is built again, also if only the mtime changed
+def test_rebuild(tmp_path):
+    path = tmp_path / 'text.jsonl'
+    path.write_bytes(jsonl(records(20)))
+    checkLookups(path, records(20))
+    path.write_bytes(jsonl(records(30)))
+    checkLookups(path, records(30))
+    st = os.stat(path)
+    path.write_bytes(jsonl(records(30, text='LYRICS')))
+    assert os.stat(path).st_size == st.st_size
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    checkLookups(path, records(30, text='LYRICS'))
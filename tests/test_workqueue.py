@@ -0,0 +1,58 @@
+import time
+
+from workqueue import WorkQueue, DeferredDoneQueue
+
+def newQueue(path, owner, **kwargs):
+    queue = WorkQueue(path, 'test', pollseconds=0.05, **kwargs)
+    queue.owner = owner
+    return queue
+
+def test_batches(tmp_path):
+    queue = newQueue(tmp_path / 'queue.sqlite', 'a', batchsize=3)
+    assert queue.enqueue([f's{i}' for i in range(7)]) == 7
+    assert queue.enqueue(['s0', 's7']) == 1
+    seen = []
+    for batch in queue.batches():
+        for songid in batch:
+            if songid == 's5':
+                queue.failed(songid)
+            else:
+                queue.done(songid)
+        seen.extend(batch)
+    assert seen == [f's{i}' for i in range(8)]
+    assert queue.counts() == {'done': 7, 'failed': 1}
+    assert queue.requeueFailed() == 1
+    assert queue.claim() == ['s5']
+
+#a worker of which the lease expired does not finish the songs of the worker that
+#claimed them
+def test_expiredlease(tmp_path):
+    slow = newQueue(tmp_path / 'queue.sqlite', 'slow', leaseseconds=0.1)
+    fast = newQueue(tmp_path / 'queue.sqlite', 'fast')
+    slow.enqueue(['s0', 's1'])
+    assert slow.claim() == ['s0', 's1']
+    time.sleep(0.2)
+    assert fast.claim() == ['s0', 's1']
+    slow.failed('s0')
+    assert fast.counts() == {'leased': 2}
+    assert fast._finish('s0', 'done')
+    assert not slow._finish('s1', 'done')
+    assert fast.counts() == {'leased': 1, 'done': 1}
+
+#songs are done after commit()
+def test_deferred(tmp_path):
+    queue = DeferredDoneQueue(newQueue(tmp_path / 'queue.sqlite', 'a'))
+    queue.enqueue(['s0', 's1'])
+    assert queue.claim() == ['s0', 's1']
+    queue.done('s0')
+    queue.done('s1')
+    assert queue.counts() == {'leased': 2}
+    queue.commit(['s0', 's1'])
+    assert queue.counts() == {'done': 2}
+
+#the first worker sets the generation for all workers
+def test_generation(tmp_path):
+    first = newQueue(tmp_path / 'queue.sqlite', 'a')
+    second = newQueue(tmp_path / 'queue.sqlite', 'b')
+    assert first.generation(3) == 3
+    assert second.generation(4) == 3